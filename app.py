@@ -6,15 +6,25 @@ Desktop application for generating calibration test certificates for GasClip gas
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime, timedelta
-import shutil
 from pathlib import Path
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.colors import black, white
-import io
-from product_coordinates import get_coordinates
+from certificate_engine import (
+    PRODUCTS,
+    calculate_expiration_date,
+    create_text_overlay,
+    get_engine,
+    make_record,
+    output_options,
+    validate_date,
+    validate_inputs,
+)
+from certificate_ledger import CertificateLedger, ledger_entry
+from certificate_verify import Verifier
+from pdf_output import bundle_pdfs, finish_pdf
+from invoice_staging import StagingSession
+from invoice_zip import zip_folder
+from invoice_manifest import write_hashed
+from output_layout import OutputLayout
+from session_journal import SessionJournal
 import json
 
 
@@ -76,26 +86,7 @@ class DateEntry(ttk.Entry):
     
     def validate_date(self):
         """Validate if the entered date is valid"""
-        date_str = self.get_raw_date()
-        if len(date_str) != 8:
-            return False, "Date must be 8 digits (DD/MM/YYYY)"
-        
-        try:
-            day = int(date_str[:2])
-            month = int(date_str[2:4])
-            year = int(date_str[4:])
-            
-            if month < 1 or month > 12:
-                return False, "Month must be between 01 and 12"
-            if day < 1 or day > 31:
-                return False, "Day must be between 01 and 31"
-            if year < 2000 or year > 2100:
-                return False, "Year must be between 2000 and 2100"
-            
-            datetime(year, month, day)
-            return True, ""
-        except ValueError:
-            return False, "Invalid date (e.g., 31/02/2025 doesn't exist)"
+        return validate_date(self.get_raw_date())
 
 
 class GasClipCertificateGenerator:
@@ -107,46 +98,38 @@ class GasClipCertificateGenerator:
         
         # Product configurations - using clean templates
         self.products = {
-            "MGC-S+ (MGC-SIMPLEPLUS)": {
-                "prefix": "D4PQ",
-                "template": "D4PQ236599_clean.pdf",
-                "detector_life": 36,
-                "calibration_days": 1095,
-            },
-            "SGC-O (Single Gas Clip O2)": {
-                "prefix": "SOSP",
-                "template": "SOSP215459_clean.pdf",
-                "detector_life": 24,
-                "calibration_days": 730,
-            },
-            "SGC-C (Single Gas Clip CO)": {
-                "prefix": "SCSQ",
-                "template": "SCSQ175392_clean.pdf",
-                "detector_life": 24,
-                "calibration_days": 730,
-            },
-            "MGC-S (MGC-SIMPLE)": {
-                "prefix": "D4SQ",
-                "template": "D4SQ106733_clean.pdf",
-                "detector_life": 24,
-                "calibration_days": 730,
-            },
-            "SGC-H (Single Gas Clip H2S)": {
-                "prefix": "SHSP",
-                "template": "SHSP085112_clean.pdf",
-                "detector_life": 24,
-                "calibration_days": 730,
-            }
+            info["name"]: {"prefix": prefix, **info}
+            for prefix, info in PRODUCTS.items()
         }
         
         self.generated_certificates = []
         self.output_dir = Path("output")
         self.output_dir.mkdir(exist_ok=True)
+        self.ledger = CertificateLedger()
+        # Certificates are staged in a hidden folder until the invoice is finished
+        self.layout = OutputLayout(self.output_dir)
+        self.staging = StagingSession.resume_or_create(self.output_dir)
+        self.journal = SessionJournal(self.staging.path)
+        # A sample of the certificates is read back and checked in the background
+        verify_sample = output_options()["verify_sample"]
+        self.verifier = Verifier(verify_sample) if verify_sample > 0 else None
         self.entry_widgets = []
         
         self.setup_ui()
         self.setup_keyboard_navigation()
         self.load_calibrated_coordinates()
+        self.restore_session()
+    
+    def restore_session(self):
+        """Rebuild the certificate list of a session that ended before its invoice was finished"""
+        restored = self.journal.restore()
+        if not restored:
+            return
+        self.generated_certificates = restored
+        self.counter_label.config(text=f"Certificates Generated: {len(restored)}")
+        self.status_label.config(
+            text=f"✓ Restored {len(restored)} certificate(s) from the unfinished session",
+            foreground="blue")
     
     def load_calibrated_coordinates(self):
         """Load calibrated coordinates if available and display status"""
@@ -311,103 +294,37 @@ class GasClipCertificateGenerator:
     
     def calculate_expiration_date(self, activation_date_str, days):
         """Calculate expiration date from activation date"""
-        parts = activation_date_str.split('/')
-        day = int(parts[0])
-        month = int(parts[1])
-        year = int(parts[2])
-        
-        activation = datetime(year, month, day)
-        expiration = activation + timedelta(days=days)
-        
-        return expiration.strftime("%d/%m/%Y")
+        return calculate_expiration_date(activation_date_str, days)
     
     def validate_inputs(self):
         """Validate all input fields"""
-        if not self.product_var.get():
-            messagebox.showerror("Error", "Please select a product")
-            return False
-        
-        if not self.serial_entry.get() or not self.serial_entry.get().isdigit():
-            messagebox.showerror("Error", "Serial number must contain only digits")
-            self.serial_entry.focus()
-            return False
-        
-        valid, msg = self.activation_entry.validate_date()
-        if not valid:
-            messagebox.showerror("Error", f"Activation Date: {msg}")
-            self.activation_entry.focus()
-            return False
-        
-        if not self.lot_entry.get():
-            messagebox.showerror("Error", "Lot number is required")
-            self.lot_entry.focus()
-            return False
-        
-        valid, msg = self.gas_prod_entry.validate_date()
-        if not valid:
-            messagebox.showerror("Error", f"Gas Production Date: {msg}")
-            self.gas_prod_entry.focus()
-            return False
-        
-        valid, msg = self.calibration_entry.validate_date()
-        if not valid:
-            messagebox.showerror("Error", f"Calibration Date: {msg}")
-            self.calibration_entry.focus()
-            return False
-        
-        return True
+        product = self.products.get(self.product_var.get())
+        errors = validate_inputs(
+            product["prefix"] if product else None,
+            self.serial_entry.get(),
+            self.activation_entry.get(),
+            self.lot_entry.get(),
+            self.gas_prod_entry.get(),
+            self.calibration_entry.get())
+        if not errors:
+            return True
+        
+        field, message = errors[0]
+        messagebox.showerror("Error", message)
+        widgets = {
+            "serial": self.serial_entry,
+            "activation": self.activation_entry,
+            "lot": self.lot_entry,
+            "gas_prod": self.gas_prod_entry,
+            "calibration": self.calibration_entry,
+        }
+        if field in widgets:
+            widgets[field].focus()
+        return False
     
     def create_text_overlay(self, data, prefix):
         """Create PDF overlay - NO white rectangles needed with clean templates!"""
-        # Get coordinates for this product
-        coords = get_coordinates(prefix)
-        
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=A4)
-        
-        # Page 1 - Cover lot placeholder, then write text
-        # Cover the "O2 18%" placeholder in lot area (smaller rectangle)
-        can.setFillColor(white)
-        can.rect(195, 405, 50, 15, fill=1, stroke=0)
-        
-        can.setFillColor(black)
-        
-        # Serial number
-        p1_serial = coords["page1"]["serial"]
-        can.setFont("Helvetica-Bold", int(p1_serial["size"]))
-        can.drawString(p1_serial["x"], p1_serial["y"], data["serial"])
-        
-        # Activation date
-        p1_act = coords["page1"]["activation_date"]
-        can.setFont("Helvetica", int(p1_act["size"]))
-        can.drawString(p1_act["x"], p1_act["y"], data["activation"])
-        
-        # Lot number
-        p1_lot = coords["page1"]["lot"]
-        can.setFont("Helvetica-Bold", int(p1_lot["size"]))
-        can.drawString(p1_lot["x"], p1_lot["y"], data["lot"])
-        
-        # Gas production date
-        p1_gas = coords["page1"]["gas_prod"]
-        can.setFont("Helvetica", int(p1_gas["size"]))
-        can.drawString(p1_gas["x"], p1_gas["y"], data["gas_prod"])
-        
-        # Calibration date
-        p1_cal = coords["page1"]["calibration"]
-        can.setFont("Helvetica-Bold", int(p1_cal["size"]))
-        can.drawString(p1_cal["x"], p1_cal["y"], data["calibration"])
-        
-        can.showPage()
-        
-        # Page 2 - ONLY serial number, NO date boxes
-        can.setFillColor(black)
-        p2_serial = coords["page2"]["serial"]
-        can.setFont('Helvetica-Bold', int(p2_serial["size"]))
-        can.drawString(p2_serial["x"], p2_serial["y"], data["serial"])
-        
-        can.save()
-        packet.seek(0)
-        return packet
+        return create_text_overlay(data, prefix)
     
     def generate_certificate(self):
         """Generate the PDF certificate"""
@@ -418,48 +335,45 @@ class GasClipCertificateGenerator:
             product_name = self.product_var.get()
             product_info = self.products[product_name]
             
-            serial_number = product_info["prefix"] + self.serial_entry.get()
-            activation_date = self.activation_entry.get()
-            lot_number = self.lot_entry.get()
-            gas_prod_date = self.gas_prod_entry.get()
-            calibration_date = self.calibration_entry.get()
-            
-            calibration_exp = self.calculate_expiration_date(
-                activation_date, 
-                product_info["calibration_days"])
-            
-            data = {
-                "serial": serial_number,
-                "activation": activation_date,
-                "lot": lot_number,
-                "gas_prod": gas_prod_date,
-                "calibration": calibration_date,
-                "calibration_exp": calibration_exp
-            }
+            data = make_record(
+                product_info["prefix"],
+                self.serial_entry.get(),
+                self.activation_entry.get(),
+                self.lot_entry.get(),
+                self.gas_prod_entry.get(),
+                self.calibration_entry.get())
+            serial_number = data["serial"]
+            activation_date = data["activation"]
+            calibration_exp = data["calibration_exp"]
             
             output_filename = f"{serial_number}.pdf"
-            output_path = self.output_dir / output_filename
+            output_path = self.staging.path / output_filename
             
-            # Use absolute path for template
-            template_path = Path(__file__).parent / "templates" / product_info["template"]
-            if not template_path.exists():
-                messagebox.showerror("Error", f"Template not found: {template_path}\n\nPlease ensure the templates folder contains: {product_info['template']}")
+            # Serials are unique across sessions (certificates.db)
+            issued = self.ledger.lookup(serial_number)
+            if issued and not messagebox.askyesno(
+                    "Serial Already Issued",
+                    f"{serial_number} was already issued on {issued['issued_at']} "
+                    f"(invoice {issued['invoice'] or 'not finished'}).\n\n"
+                    f"Issue it again and replace the ledger record?"):
                 return
             
-            # Create overlay and merge
-            overlay_pdf = self.create_text_overlay(data, product_info["prefix"])
-            
-            template_pdf = PdfReader(str(template_path))
-            overlay_reader = PdfReader(overlay_pdf)
-            writer = PdfWriter()
-            
-            for i, page in enumerate(template_pdf.pages):
-                if i < len(overlay_reader.pages):
-                    page.merge_page(overlay_reader.pages[i])
-                writer.add_page(page)
+            # Backend chosen per product in engine_config.json
+            engine = get_engine(product_info["prefix"])
+            template_path = engine.template_path(product_info["prefix"])
+            if not template_path.exists():
+                messagebox.showerror("Error", f"Template not found: {template_path}\n\nPlease ensure the templates folder contains: {template_path.name}")
+                return
             
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)
+            options = output_options()
+            rendered = engine.render(data)
+            pdf = finish_pdf(rendered, options["linearize"], options["compact"])
+            size, sha256 = write_hashed(output_path, pdf)
+            if self.verifier is not None:
+                self.verifier.submit(pdf, data)
+            self.ledger.record(ledger_entry(data, product_name, template_path, output_path),
+                               replace=issued is not None)
+            size_note = f" ({len(rendered) // 1024} KB → {len(pdf) // 1024} KB)" if options["compact"] else ""
             
             self.generated_certificates.append({
                 "filename": output_filename,
@@ -468,9 +382,10 @@ class GasClipCertificateGenerator:
                 "product": product_name,
                 "data": data
             })
+            self.journal.append(self.generated_certificates[-1], sha256, size)
             
             self.status_label.config(
-                text=f"✓ Certificate generated: {output_filename}", 
+                text=f"✓ Certificate generated: {output_filename}{size_note}", 
                 foreground="green")
             self.counter_label.config(
                 text=f"Certificates Generated: {len(self.generated_certificates)}")
@@ -538,16 +453,32 @@ class GasClipCertificateGenerator:
                 return
             
             try:
-                invoice_folder = self.output_dir / f"Invoice_{invoice_number}"
-                invoice_folder.mkdir(exist_ok=True)
+                invoice_folder = self.layout.invoice_dir(invoice_number)
+                
+                def show_progress(done, total):
+                    self.status_label.config(text=f"Moving certificates... {done}/{total}",
+                                             foreground="blue")
+                    self.root.update_idletasks()
+                
+                # One rename of the staging folder (copies only across filesystems, one move
+                # per certificate with a sharded layout), then the checksum manifest
+                self.journal.close()
+                moved = self.layout.finish_invoice(self.staging, self.journal.load(), invoice_number, show_progress)
+                moved_count = len(moved)
+                self.staging = StagingSession.create(self.output_dir)
+                self.journal = SessionJournal(self.staging.path)
+                
+                self.ledger.set_invoice([Path(path).stem for path in moved], invoice_number, paths=moved)
+                
+                # One combined PDF per invoice for the customer portal
+                options = output_options()
+                if options["invoice_bundle"] and moved:
+                    bundle_pdfs(moved, invoice_folder / f"Invoice_{invoice_number}.pdf",
+                                linearize=options["linearize"], compact=options["compact"])
                 
-                moved_count = 0
-                for cert in self.generated_certificates:
-                    src = Path(cert["path"])
-                    dst = invoice_folder / cert["filename"]
-                    if src.exists():
-                        shutil.move(str(src), str(dst))
-                        moved_count += 1
+                # Single download for the customer: Invoice_<number>.zip next to the folder
+                if options["invoice_zip"] and moved:
+                    zip_folder(invoice_folder, files=moved)
                 
                 invoice_dialog.destroy()
                 
@@ -1,19 +1,29 @@
 #!/usr/bin/env python3
 """
 GasClip Certificates Generator - Version 2.1 with Corrected Coordinates
+Renders through the shared certificate engine (see certificate_engine.py).
 """
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime, timedelta
 import os
-import shutil
 from pathlib import Path
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.colors import black
-import io
+from certificate_engine import (
+    PRODUCTS,
+    calculate_expiration_date,
+    get_engine,
+    make_record,
+    output_options,
+    validate_date,
+    validate_inputs,
+)
+from certificate_ledger import CertificateLedger, ledger_entry
+from pdf_output import bundle_pdfs, finish_pdf
+from invoice_staging import StagingSession
+from invoice_zip import zip_folder
+from invoice_manifest import write_hashed
+from output_layout import OutputLayout
+from session_journal import SessionJournal
 
 
 class DateEntry(ttk.Entry):
@@ -75,26 +85,7 @@ class DateEntry(ttk.Entry):
     
     def validate_date(self):
         """Validate if the entered date is valid"""
-        date_str = self.get_raw_date()
-        if len(date_str) != 8:
-            return False, "Date must be 8 digits (DD/MM/YYYY)"
-        
-        try:
-            day = int(date_str[:2])
-            month = int(date_str[2:4])
-            year = int(date_str[4:])
-            
-            if month < 1 or month > 12:
-                return False, "Month must be between 01 and 12"
-            if day < 1 or day > 31:
-                return False, "Day must be between 01 and 31"
-            if year < 2000 or year > 2100:
-                return False, "Year must be between 2000 and 2100"
-            
-            datetime(year, month, day)
-            return True, ""
-        except ValueError:
-            return False, "Invalid date (e.g., 31/02/2025 doesn't exist)"
+        return validate_date(self.get_raw_date())
 
 
 class GasClipCertificateGenerator:
@@ -104,93 +95,36 @@ class GasClipCertificateGenerator:
         self.root.geometry("750x750")
         self.root.resizable(False, False)
         
-        # Product configurations with CORRECTED coordinates
+        # Product configurations (shared with the other generators)
         self.products = {
-            "MGC-S+ (MGC-SIMPLEPLUS)": {
-                "prefix": "D4PQ",
-                "template": "D4PQ236599.pdf",
-                "detector_life": 36,
-                "calibration_days": 1095,
-                "positions": self.get_positions_mgc_s_plus()
-            },
-            "SGC-O (Single Gas Clip O2)": {
-                "prefix": "SOSP",
-                "template": "SOSP215459.pdf",
-                "detector_life": 24,
-                "calibration_days": 730,
-                "positions": self.get_positions_sgc_o()
-            },
-            "SGC-C (Single Gas Clip CO)": {
-                "prefix": "SCSQ",
-                "template": "SCSQ175392.pdf",
-                "detector_life": 24,
-                "calibration_days": 730,
-                "positions": self.get_positions_sgc_c()
-            },
-            "MGC-S (MGC-SIMPLE)": {
-                "prefix": "D4SQ",
-                "template": "D4SQ106733.pdf",
-                "detector_life": 24,
-                "calibration_days": 730,
-                "positions": self.get_positions_mgc_s()
-            },
-            "SGC-H (Single Gas Clip H2S)": {
-                "prefix": "SHSP",
-                "template": "SHSP085112.pdf",
-                "detector_life": 24,
-                "calibration_days": 730,
-                "positions": self.get_positions_sgc_h()
-            }
+            info["name"]: {"prefix": prefix, **info}
+            for prefix, info in PRODUCTS.items()
         }
         
         self.generated_certificates = []
         self.output_dir = Path("output")
         self.output_dir.mkdir(exist_ok=True)
+        self.ledger = CertificateLedger()
+        # Certificates are staged in a hidden folder until the invoice is finished
+        self.layout = OutputLayout(self.output_dir)
+        self.staging = StagingSession.resume_or_create(self.output_dir)
+        self.journal = SessionJournal(self.staging.path)
         self.entry_widgets = []
         
         self.setup_ui()
         self.setup_keyboard_navigation()
+        self.restore_session()
     
-    def get_positions_sgc_o(self):
-        """Get corrected positions for SGC-O template"""
-        return {
-            "page1": {
-                "serial": (520, 727),
-                "activation_before": (520, 712),
-                "lot_number": (145, 475),
-                "gas_production": (145, 460),
-                "calibration_date": (190, 555),
-            },
-            "page2": {
-                "serial": (520, 750),
-                "activation_boxes": [
-                    (545, 477), (560, 477),  # DD
-                    (590, 477), (605, 477),  # MM
-                    (650, 477), (665, 477), (680, 477), (695, 477)  # YYYY
-                ],
-                "expiration_boxes": [
-                    (545, 397), (560, 397),  # DD
-                    (590, 397), (605, 397),  # MM
-                    (650, 397), (665, 397), (680, 397), (695, 397)  # YYYY
-                ]
-            }
-        }
-    
-    def get_positions_mgc_s_plus(self):
-        """Get positions for MGC-S+ template (same layout as SGC-O)"""
-        return self.get_positions_sgc_o()
-    
-    def get_positions_sgc_c(self):
-        """Get positions for SGC-C template (same layout as SGC-O)"""
-        return self.get_positions_sgc_o()
-    
-    def get_positions_mgc_s(self):
-        """Get positions for MGC-S template (same layout as SGC-O)"""
-        return self.get_positions_sgc_o()
-    
-    def get_positions_sgc_h(self):
-        """Get positions for SGC-H template (same layout as SGC-O)"""
-        return self.get_positions_sgc_o()
+    def restore_session(self):
+        """Rebuild the certificate list of a session that ended before its invoice was finished"""
+        restored = self.journal.restore()
+        if not restored:
+            return
+        self.generated_certificates = restored
+        self.counter_label.config(text=f"Certificates Generated: {len(restored)}")
+        self.status_label.config(
+            text=f"✓ Restored {len(restored)} certificate(s) from the unfinished session",
+            foreground="blue")
     
     def setup_ui(self):
         """Setup the user interface"""
@@ -338,102 +272,33 @@ class GasClipCertificateGenerator:
     
     def calculate_expiration_date(self, activation_date_str, days):
         """Calculate expiration date from activation date"""
-        parts = activation_date_str.split('/')
-        day = int(parts[0])
-        month = int(parts[1])
-        year = int(parts[2])
-        
-        activation = datetime(year, month, day)
-        expiration = activation + timedelta(days=days)
-        
-        return expiration.strftime("%d/%m/%Y")
+        return calculate_expiration_date(activation_date_str, days)
     
     def validate_inputs(self):
         """Validate all input fields"""
-        if not self.product_var.get():
-            messagebox.showerror("Error", "Please select a product")
-            return False
-        
-        if not self.serial_entry.get() or not self.serial_entry.get().isdigit():
-            messagebox.showerror("Error", "Serial number must contain only digits")
-            self.serial_entry.focus()
-            return False
-        
-        valid, msg = self.activation_entry.validate_date()
-        if not valid:
-            messagebox.showerror("Error", f"Activation Date: {msg}")
-            self.activation_entry.focus()
-            return False
-        
-        if not self.lot_entry.get():
-            messagebox.showerror("Error", "Lot number is required")
-            self.lot_entry.focus()
-            return False
-        
-        valid, msg = self.gas_prod_entry.validate_date()
-        if not valid:
-            messagebox.showerror("Error", f"Gas Production Date: {msg}")
-            self.gas_prod_entry.focus()
-            return False
-        
-        valid, msg = self.calibration_entry.validate_date()
-        if not valid:
-            messagebox.showerror("Error", f"Calibration Date: {msg}")
-            self.calibration_entry.focus()
-            return False
-        
-        return True
-    
-    def create_text_overlay(self, data, product_info):
-        """Create a transparent PDF overlay with text at corrected positions"""
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=A4)
-        
-        can.setFont("Helvetica", 10)
-        can.setFillColor(black)
-        
-        positions = product_info["positions"]
-        
-        # Page 1 overlays
-        can.drawString(positions["page1"]["serial"][0], positions["page1"]["serial"][1], 
-                      data["serial"])
-        can.drawString(positions["page1"]["activation_before"][0], 
-                      positions["page1"]["activation_before"][1], 
-                      data["activation"])
-        can.drawString(positions["page1"]["lot_number"][0], 
-                      positions["page1"]["lot_number"][1], 
-                      data["lot"])
-        can.drawString(positions["page1"]["gas_production"][0], 
-                      positions["page1"]["gas_production"][1], 
-                      data["gas_prod"])
-        can.drawString(positions["page1"]["calibration_date"][0], 
-                      positions["page1"]["calibration_date"][1], 
-                      data["calibration"])
-        
-        can.showPage()
-        
-        # Page 2 overlays
-        can.drawString(positions["page2"]["serial"][0], positions["page2"]["serial"][1], 
-                      data["serial"])
-        
-        # Activation date in boxes (individual digits)
-        activation_digits = data["activation"].replace('/', '')
-        for i, digit in enumerate(activation_digits):
-            if i < len(positions["page2"]["activation_boxes"]):
-                x, y = positions["page2"]["activation_boxes"][i]
-                can.drawString(x, y, digit)
-        
-        # Calibration expiration date in boxes
-        expiration_digits = data["calibration_exp"].replace('/', '')
-        for i, digit in enumerate(expiration_digits):
-            if i < len(positions["page2"]["expiration_boxes"]):
-                x, y = positions["page2"]["expiration_boxes"][i]
-                can.drawString(x, y, digit)
-        
-        can.save()
-        packet.seek(0)
-        
-        return packet
+        product = self.products.get(self.product_var.get())
+        errors = validate_inputs(
+            product["prefix"] if product else None,
+            self.serial_entry.get(),
+            self.activation_entry.get(),
+            self.lot_entry.get(),
+            self.gas_prod_entry.get(),
+            self.calibration_entry.get())
+        if not errors:
+            return True
+        
+        field, message = errors[0]
+        messagebox.showerror("Error", message)
+        widgets = {
+            "serial": self.serial_entry,
+            "activation": self.activation_entry,
+            "lot": self.lot_entry,
+            "gas_prod": self.gas_prod_entry,
+            "calibration": self.calibration_entry,
+        }
+        if field in widgets:
+            widgets[field].focus()
+        return False
     
     def generate_certificate(self):
         """Generate the PDF certificate with actual data overlay"""
@@ -444,46 +309,42 @@ class GasClipCertificateGenerator:
             product_name = self.product_var.get()
             product_info = self.products[product_name]
             
-            serial_number = product_info["prefix"] + self.serial_entry.get()
-            activation_date = self.activation_entry.get()
-            lot_number = self.lot_entry.get()
-            gas_prod_date = self.gas_prod_entry.get()
-            calibration_date = self.calibration_entry.get()
-            
-            calibration_exp = self.calculate_expiration_date(
-                activation_date, 
-                product_info["calibration_days"])
-            
-            data = {
-                "serial": serial_number,
-                "activation": activation_date,
-                "lot": lot_number,
-                "gas_prod": gas_prod_date,
-                "calibration": calibration_date,
-                "calibration_exp": calibration_exp
-            }
+            data = make_record(
+                product_info["prefix"],
+                self.serial_entry.get(),
+                self.activation_entry.get(),
+                self.lot_entry.get(),
+                self.gas_prod_entry.get(),
+                self.calibration_entry.get())
+            serial_number = data["serial"]
+            activation_date = data["activation"]
+            calibration_exp = data["calibration_exp"]
             
             output_filename = f"{serial_number}.pdf"
-            output_path = self.output_dir / output_filename
+            output_path = self.staging.path / output_filename
             
-            template_path = Path("templates") / product_info["template"]
+            # Serials are unique across sessions (certificates.db)
+            issued = self.ledger.lookup(serial_number)
+            if issued and not messagebox.askyesno(
+                    "Serial Already Issued",
+                    f"{serial_number} was already issued on {issued['issued_at']} "
+                    f"(invoice {issued['invoice'] or 'not finished'}).\n\n"
+                    f"Issue it again and replace the ledger record?"):
+                return
+            
+            engine = get_engine(product_info["prefix"])
+            template_path = engine.template_path(product_info["prefix"])
             if not template_path.exists():
                 messagebox.showerror("Error", f"Template not found: {template_path}")
                 return
             
-            overlay_pdf = self.create_text_overlay(data, product_info)
-            
-            template_pdf = PdfReader(str(template_path))
-            overlay_reader = PdfReader(overlay_pdf)
-            writer = PdfWriter()
-            
-            for i, page in enumerate(template_pdf.pages):
-                if i < len(overlay_reader.pages):
-                    page.merge_page(overlay_reader.pages[i])
-                writer.add_page(page)
-            
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)
+            options = output_options()
+            rendered = engine.render(data)
+            pdf = finish_pdf(rendered, options["linearize"], options["compact"])
+            size, sha256 = write_hashed(output_path, pdf)
+            self.ledger.record(ledger_entry(data, product_name, template_path, output_path),
+                               replace=issued is not None)
+            size_note = f" ({len(rendered) // 1024} KB → {len(pdf) // 1024} KB)" if options["compact"] else ""
             
             self.generated_certificates.append({
                 "filename": output_filename,
@@ -492,9 +353,10 @@ class GasClipCertificateGenerator:
                 "product": product_name,
                 "data": data
             })
+            self.journal.append(self.generated_certificates[-1], sha256, size)
             
             self.status_label.config(
-                text=f"✓ Certificate generated: {output_filename}", 
+                text=f"✓ Certificate generated: {output_filename}{size_note}", 
                 foreground="green")
             self.counter_label.config(
                 text=f"Certificates Generated: {len(self.generated_certificates)}")
@@ -560,16 +422,32 @@ class GasClipCertificateGenerator:
                 return
             
             try:
-                invoice_folder = self.output_dir / f"Invoice_{invoice_number}"
-                invoice_folder.mkdir(exist_ok=True)
+                invoice_folder = self.layout.invoice_dir(invoice_number)
+                
+                def show_progress(done, total):
+                    self.status_label.config(text=f"Moving certificates... {done}/{total}",
+                                             foreground="blue")
+                    self.root.update_idletasks()
+                
+                # One rename of the staging folder (copies only across filesystems, one move
+                # per certificate with a sharded layout), then the checksum manifest
+                self.journal.close()
+                moved = self.layout.finish_invoice(self.staging, self.journal.load(), invoice_number, show_progress)
+                moved_count = len(moved)
+                self.staging = StagingSession.create(self.output_dir)
+                self.journal = SessionJournal(self.staging.path)
+                
+                self.ledger.set_invoice([Path(path).stem for path in moved], invoice_number, paths=moved)
+                
+                # One combined PDF per invoice for the customer portal
+                options = output_options()
+                if options["invoice_bundle"] and moved:
+                    bundle_pdfs(moved, invoice_folder / f"Invoice_{invoice_number}.pdf",
+                                linearize=options["linearize"], compact=options["compact"])
                 
-                moved_count = 0
-                for cert in self.generated_certificates:
-                    src = Path(cert["path"])
-                    dst = invoice_folder / cert["filename"]
-                    if src.exists():
-                        shutil.move(str(src), str(dst))
-                        moved_count += 1
+                # Single download for the customer: Invoice_<number>.zip next to the folder
+                if options["invoice_zip"] and moved:
+                    zip_folder(invoice_folder, files=moved)
                 
                 invoice_dialog.destroy()
                 
@@ -6,11 +6,22 @@ Generates gas detector calibration certificates using Word templates
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from datetime import datetime, timedelta
 from pathlib import Path
-import subprocess
-import shutil
-from docx import Document
+from certificate_engine import (
+    PRODUCTS,
+    get_engine,
+    make_record,
+    output_options,
+    validate_date,
+    validate_inputs,
+)
+from certificate_ledger import CertificateLedger, ledger_entry
+from pdf_output import bundle_pdfs, finish_pdf
+from invoice_staging import StagingSession
+from invoice_zip import zip_folder
+from invoice_manifest import write_hashed
+from output_layout import OutputLayout
+from session_journal import SessionJournal
 
 class GasClipCertificateGenerator:
     def __init__(self, root):
@@ -20,37 +31,15 @@ class GasClipCertificateGenerator:
         
         # Product information
         self.products = {
-            "D4PQ": {
-                "name": "MGC-S+ (MGC-SIMPLEPLUS)",
-                "template": "D4PQ236599_clean.docx",
-                "detector_life_months": 36,
-                "calibration_days": 1095
-            },
-            "SOSP": {
-                "name": "SGC-O (Single Gas Clip O2)",
-                "template": "SOSP215459_clean.docx",
-                "detector_life_months": 24,
-                "calibration_days": 730
-            },
-            "SCSQ": {
-                "name": "SGC-C (Single Gas Clip CO)",
-                "template": "SCSQ175392_clean.docx",
-                "detector_life_months": 24,
-                "calibration_days": 730
-            },
-            "D4SQ": {
-                "name": "MGC-S (MGC-SIMPLE)",
-                "template": "D4SQ106733_clean.docx",
-                "detector_life_months": 36,
-                "calibration_days": 1095
-            },
-            "SHSP": {
-                "name": "SGC-H (Single Gas Clip H2S)",
-                "template": "SHSP085112_clean.docx",
-                "detector_life_months": 24,
-                "calibration_days": 730
+            prefix: {
+                "name": info["name"],
+                "template": info["word_template"],
+                "detector_life_months": info["detector_life"],
+                "calibration_days": info["calibration_days"]
             }
+            for prefix, info in PRODUCTS.items()
         }
+        self.engine = get_engine(backend="word")
         
         # Certificate counter
         self.certificates_generated = 0
@@ -59,8 +48,26 @@ class GasClipCertificateGenerator:
         # Create output directory
         self.output_dir = Path("output")
         self.output_dir.mkdir(exist_ok=True)
+        self.ledger = CertificateLedger()
+        # Certificates are staged in a hidden folder until the invoice is finished
+        self.layout = OutputLayout(self.output_dir)
+        self.staging = StagingSession.resume_or_create(self.output_dir)
+        self.journal = SessionJournal(self.staging.path)
         
         self.create_widgets()
+        self.restore_session()
+    
+    def restore_session(self):
+        """Rebuild the certificate list of a session that ended before its invoice was finished"""
+        restored = self.journal.restore()
+        if not restored:
+            return
+        self.generated_files = [Path(entry["path"]) for entry in restored]
+        self.certificates_generated = len(restored)
+        self.counter_label.config(text=f"Certificates Generated: {self.certificates_generated}")
+        self.status_label.config(
+            text=f"✓ Restored {len(restored)} certificate(s) from the unfinished session",
+            fg="#2563eb")
         
     def create_widgets(self):
         # Title
@@ -272,11 +279,7 @@ class GasClipCertificateGenerator:
             
     def validate_date(self, date_str):
         """Validate if date is real"""
-        try:
-            datetime.strptime(date_str, "%d/%m/%Y")
-            return True
-        except ValueError:
-            return False
+        return validate_date(date_str)[0]
             
     def generate_certificate(self):
         """Generate certificate using Word template"""
@@ -305,67 +308,54 @@ class GasClipCertificateGenerator:
             messagebox.showerror("Error", "Please fill in all fields")
             return
             
-        # Validate dates
-        for date_field, date_value in [("Activation", activation), ("Gas Production", gas_prod), ("Calibration", calibration)]:
-            if not self.validate_date(date_value):
-                messagebox.showerror("Error", f"Invalid {date_field} date: {date_value}")
-                return
+        errors = validate_inputs(prefix, serial_digits, activation, lot, gas_prod, calibration)
+        if errors:
+            messagebox.showerror("Error", errors[0][1])
+            return
                 
         # Generate certificate
         try:
-            full_serial = f"{prefix}{serial_digits}"
-            product_info = self.products[prefix]
+            record = make_record(prefix, serial_digits, activation, lot, gas_prod, calibration)
+            full_serial = record["serial"]
+            
+            # Serials are unique across sessions (certificates.db)
+            issued = self.ledger.lookup(full_serial)
+            if issued and not messagebox.askyesno(
+                    "Serial Already Issued",
+                    f"{full_serial} was already issued on {issued['issued_at']} "
+                    f"(invoice {issued['invoice'] or 'not finished'}).\n\n"
+                    f"Issue it again and replace the ledger record?"):
+                return
             
             self.status_label.config(text=f"Generating certificate for {full_serial}...", fg="#f59e0b")
             self.root.update()
             
-            # Process Word template
-            template_path = Path(__file__).parent / "templates_word" / product_info["template"]
-            
+            template_path = self.engine.template_path(prefix)
             if not template_path.exists():
                 messagebox.showerror("Error", f"Template not found: {template_path}")
                 return
                 
-            # Open Word document
-            doc = Document(template_path)
-            
-            # Replace text in the document
-            replacements = self.get_replacements(prefix, full_serial, activation, lot, gas_prod, calibration, product_info)
-            
-            # Replace in paragraphs
-            for paragraph in doc.paragraphs:
-                for old_text, new_text in replacements.items():
-                    if old_text in paragraph.text:
-                        for run in paragraph.runs:
-                            if old_text in run.text:
-                                run.text = run.text.replace(old_text, new_text)
-                                
-            # Replace in tables
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for paragraph in cell.paragraphs:
-                            for old_text, new_text in replacements.items():
-                                if old_text in paragraph.text:
-                                    for run in paragraph.runs:
-                                        if old_text in run.text:
-                                            run.text = run.text.replace(old_text, new_text)
-            
-            # Save modified Word document
-            output_docx = self.output_dir / f"{full_serial}.docx"
-            doc.save(output_docx)
-            
-            # Convert to PDF using LibreOffice
-            output_pdf = self.output_dir / f"{full_serial}.pdf"
-            self.convert_to_pdf(output_docx, output_pdf)
-            
-            # Delete temporary Word file
-            output_docx.unlink()
+            # Word text replacement + LibreOffice conversion
+            output_pdf = self.staging.path / f"{full_serial}.pdf"
+            options = output_options()
+            rendered = self.engine.render(record)
+            pdf = finish_pdf(rendered, options["linearize"], options["compact"])
+            size, sha256 = write_hashed(output_pdf, pdf)
+            self.ledger.record(ledger_entry(record, PRODUCTS[prefix]["name"], template_path, output_pdf),
+                               replace=issued is not None)
+            size_note = f" ({len(rendered) // 1024} KB → {len(pdf) // 1024} KB)" if options["compact"] else ""
             
             self.certificates_generated += 1
             self.generated_files.append(output_pdf)
+            self.journal.append({
+                "filename": output_pdf.name,
+                "path": str(output_pdf),
+                "serial": full_serial,
+                "product": PRODUCTS[prefix]["name"],
+                "data": record,
+            }, sha256, size)
             self.counter_label.config(text=f"Certificates Generated: {self.certificates_generated}")
-            self.status_label.config(text=f"✓ Certificate generated: {full_serial}.pdf", fg="#16a34a")
+            self.status_label.config(text=f"✓ Certificate generated: {full_serial}.pdf{size_note}", fg="#16a34a")
             
             # Clear form for next certificate
             self.clear_form(keep_product=True)
@@ -374,73 +364,6 @@ class GasClipCertificateGenerator:
             messagebox.showerror("Error", f"Failed to generate certificate: {str(e)}")
             self.status_label.config(text="Error generating certificate", fg="#dc2626")
             
-    def get_replacements(self, prefix, full_serial, activation, lot, gas_prod, calibration, product_info):
-        """Get text replacements based on product template"""
-        replacements = {}
-        
-        # Common replacements
-        replacements[full_serial.replace(prefix, prefix)] = full_serial  # This handles the serial number
-        
-        # Get the template serial number from the template filename
-        template_serial = product_info["template"].replace("_clean.docx", "")
-        
-        # Replace template serial with new serial
-        replacements[template_serial] = full_serial
-        
-        # Get template dates from the document (we'll need to identify these)
-        # For now, we'll use a simple approach: replace common date patterns
-        
-        # Read the template to find dates to replace
-        template_path = Path(__file__).parent / "templates_word" / product_info["template"]
-        doc = Document(template_path)
-        
-        # Extract dates from template
-        template_dates = []
-        for paragraph in doc.paragraphs:
-            text = paragraph.text
-            # Find dates in format DD/MM/YYYY
-            import re
-            dates = re.findall(r'\d{2}/\d{2}/\d{4}', text)
-            template_dates.extend(dates)
-            
-        # Map template dates to new dates (in order of appearance)
-        # This is a simplified approach - you may need to adjust based on actual template structure
-        if len(template_dates) >= 3:
-            replacements[template_dates[0]] = activation  # First date is activation
-            replacements[template_dates[1]] = gas_prod     # Second is gas production
-            replacements[template_dates[2]] = calibration  # Third is calibration
-            
-        # Replace lot number (find the lot pattern in template)
-        for paragraph in doc.paragraphs:
-            text = paragraph.text
-            # Look for lot number patterns
-            if "Lot Number" in text or "25-3348" in text or "RR" in text:
-                # Extract the lot number from template
-                import re
-                lot_match = re.search(r'(25-\d+|RR\d+|[A-Z]{1,3}\s*\d+\s*ppm|O2\s*\d+\s*%|CO\s*\d+\s*ppm|H2S\s*\d+\s*ppm)', text)
-                if lot_match:
-                    template_lot = lot_match.group(1)
-                    replacements[template_lot] = lot
-                    break
-                    
-        return replacements
-        
-    def convert_to_pdf(self, docx_path, pdf_path):
-        """Convert Word document to PDF using LibreOffice"""
-        try:
-            # Use LibreOffice to convert
-            subprocess.run([
-                "libreoffice",
-                "--headless",
-                "--convert-to", "pdf",
-                "--outdir", str(pdf_path.parent),
-                str(docx_path)
-            ], check=True, capture_output=True)
-            
-            return True
-        except Exception as e:
-            raise Exception(f"PDF conversion failed: {str(e)}")
-            
     def clear_form(self, keep_product=False):
         """Clear all input fields"""
         if not keep_product:
@@ -468,13 +391,30 @@ class GasClipCertificateGenerator:
             return
             
         # Create invoice folder
-        invoice_folder = self.output_dir / f"Invoice_{invoice_number}"
-        invoice_folder.mkdir(exist_ok=True)
-        
-        # Move all generated files to invoice folder
-        for pdf_file in self.generated_files:
-            if pdf_file.exists():
-                shutil.move(str(pdf_file), str(invoice_folder / pdf_file.name))
+        invoice_folder = self.layout.invoice_dir(invoice_number)
+        
+        def show_progress(done, total):
+            self.status_label.config(text=f"Moving certificates... {done}/{total}", fg="#f59e0b")
+            self.root.update_idletasks()
+        
+        # One rename of the staging folder (copies only across filesystems, one move
+        # per certificate with a sharded layout), then the checksum manifest
+        self.journal.close()
+        moved = self.layout.finish_invoice(self.staging, self.journal.load(), invoice_number, show_progress)
+        self.staging = StagingSession.create(self.output_dir)
+        self.journal = SessionJournal(self.staging.path)
+        
+        self.ledger.set_invoice([path.stem for path in moved], invoice_number, paths=moved)
+        
+        # One combined PDF per invoice for the customer portal
+        options = output_options()
+        if options["invoice_bundle"] and moved:
+            bundle_pdfs(moved, invoice_folder / f"Invoice_{invoice_number}.pdf",
+                        linearize=options["linearize"], compact=options["compact"])
+        
+        # Single download for the customer: Invoice_<number>.zip next to the folder
+        if options["invoice_zip"] and moved:
+            zip_folder(invoice_folder, files=moved)
                 
         messagebox.showinfo(
             "Success",
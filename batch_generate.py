@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Batch certificate generator
+Generates certificates for every row of an order CSV through the shared
+certificate engine, without the GUI.
+
+CSV columns: prefix, serial, activation, lot, gas_prod, calibration
+(serial may be given with or without its prefix; dates as DD/MM/YYYY)
+
+Usage:
+    python batch_generate.py orders.csv [--invoice 12345] [--backend incremental] [--profile email]
+                             [--linearize] [--compact] [--bundle | --zip] [--reissue]
+                             [--workers N | --workers auto] [--sign KEY.p12 [--sign-appearance]]
+                             [--verify]
+
+Every certificate is recorded in the ledger (certificates.db); serials that
+were already issued stop the batch unless --reissue is given. An interrupted
+run resumes from the session journal in the output folder: rows whose PDF is
+on disk and matches the journal hash are not rendered again.
+
+--zip streams the certificates straight into output/Invoice_<number>.zip
+instead of a folder (no resume in that mode, as there are no loose files).
+With a sharded output layout (output_layout.py) the certificates are staged
+in output/.batch-<number>/ and moved into their shards at the end.
+
+--workers renders in that many processes; --workers auto measures the
+first certificates and picks the count for this machine (worker_tuning.py).
+
+--sign signs every certificate with a PKCS#12 key before it is written
+(pdf_signing.py); the password comes from $GASCLIP_SIGN_PASSWORD or a prompt.
+
+--verify reads every written certificate back on a background thread and
+checks its text (certificate_verify.py); without it, the "verify_sample"
+share of engine_config.json is checked.
+"""
+
+from pathlib import Path
+from certificate_engine import PRODUCTS, PROFILES, get_engine, make_record, output_options, validate_inputs
+from certificate_ledger import LEDGER_BATCH_SIZE, LEDGER_FILE, CertificateLedger, ledger_entry
+from certificate_verify import Verifier, log_failure
+from pdf_output import bundle_pdfs, finish_pdf
+from pdf_signing import load_signer, signing_password
+from batch_validation import read_columns, validate_columns
+from invoice_zip import InvoiceZipWriter, member_location
+from invoice_manifest import MANIFEST_CSV, write_hashed, write_manifest
+from invoice_staging import StagingSession
+from output_layout import OutputLayout, SerialIndex
+from session_journal import SessionJournal
+from template_share import SharedTemplates, attach_templates
+from worker_tuning import WorkerTuner, measured, tuned_map
+import argparse
+import sys
+import time
+
+# Records per worker task with --workers
+PARALLEL_CHUNK = 8
+
+
+def parse_record(row):
+    """
+    Validate one order row (CSV row or JSON object) and build its record
+
+    Keys are matched case-insensitively; "product" may stand for "prefix" and
+    the serial may be given with or without its prefix.
+
+    Returns:
+        tuple: (record or None, list of error messages)
+    """
+    row = {key.strip().lower(): str(value or "").strip() for key, value in row.items() if key}
+    prefix = (row.get("prefix") or row.get("product") or "").upper()
+    serial = row.get("serial", "")
+    if prefix and serial.upper().startswith(prefix):
+        serial = serial[len(prefix):]
+
+    errors = validate_inputs(prefix, serial, row.get("activation", ""),
+                             row.get("lot", ""), row.get("gas_prod", ""),
+                             row.get("calibration", ""))
+    if errors:
+        return None, [message for _, message in errors]
+    return make_record(prefix, serial, row["activation"], row["lot"],
+                       row["gas_prod"], row["calibration"]), []
+
+
+def read_records(csv_path):
+    """
+    Read and validate an order CSV, all rows at once (see batch_validation.py)
+
+    Serials that appear twice are left to find_duplicates, so --reissue
+    still applies to them.
+
+    Returns:
+        tuple: (records, errors) - errors is a list of (row number, message)
+    """
+    return validate_columns(read_columns(csv_path), duplicates=False)
+
+
+def resumable(records, journal, output_dir):
+    """
+    Serials of records already generated by an interrupted run
+
+    A record counts when the journal has the same data for it and its PDF in
+    output_dir is unchanged since it was written.
+    """
+    completed = journal.completed()
+    return {record["serial"] for record in records
+            if record["serial"] in completed
+            and completed[record["serial"]]["data"] == record
+            and Path(completed[record["serial"]]["path"]) == Path(output_dir) / f"{record['serial']}.pdf"}
+
+
+def find_duplicates(records, ledger, resumed=()):
+    """
+    Serials issued twice in the batch or already in the ledger
+
+    Args:
+        resumed: Serials being resumed from the journal (issued by this batch)
+
+    Returns:
+        list: (serial, reason) pairs
+    """
+    duplicates = []
+    seen = set()
+    for record in records:
+        if record["serial"] in seen:
+            duplicates.append((record["serial"], "appears twice in this batch"))
+        seen.add(record["serial"])
+    for serial in sorted(ledger.issued_serials(seen - set(resumed))):
+        row = ledger.lookup(serial)
+        duplicates.append((serial, f"already issued on {row['issued_at']} "
+                                   f"(invoice {row['invoice'] or 'not finished'})"))
+    return duplicates
+
+
+# The signing key of a worker process (see init_worker)
+_SIGNER = None
+
+
+def finish_certificate(pdf, linearize, compact, signer=None):
+    """finish_pdf, then sign with a pdf_signing.Signer if one is given"""
+    finished = finish_pdf(pdf, linearize, compact)
+    return finished if signer is None else signer.sign(finished)
+
+
+def init_worker(templates, signing):
+    """Process pool initializer: attach the shared templates and load the signing key once"""
+    global _SIGNER
+    attach_templates(templates)
+    if signing is not None:
+        _SIGNER = load_signer(signing)
+
+
+def render_chunk(task):
+    """Render and finish a chunk of one engine's records (runs in a worker process)"""
+    records, backend, profile, linearize, compact = task
+    engine = get_engine(records[0]["prefix"], backend, profile)
+    return measured([(len(pdf), finish_certificate(pdf, linearize, compact, _SIGNER))
+                     for _, pdf in engine.render_many(records)])
+
+
+def render_parallel(groups, workers, backend, profile, linearize, compact, tuning_log=None, signing=None):
+    """
+    Render engine groups in worker processes, PARALLEL_CHUNK records per task
+
+    The workers share one copy of the templates (see template_share.py).
+
+    Args:
+        groups: {engine name: (engine, records)} as in generate_batch
+        workers: Worker count, or "auto" to tune it (and record it for
+            this machine)
+        tuning_log: Optional callback for the chosen worker count
+        signing: Signing options each worker loads its key from (see
+            pdf_signing.load_signer)
+
+    Yields:
+        tuple: (engine, record, rendered size, finished PDF bytes) in
+        completion order
+    """
+    tuned = workers == "auto"
+    tuner = WorkerTuner("+".join(sorted(groups)), workers=None if tuned else int(workers))
+    tasks = [(group[start:start + PARALLEL_CHUNK], backend, profile, linearize, compact)
+             for _, group in groups.values() for start in range(0, len(group), PARALLEL_CHUNK)]
+    templates = SharedTemplates({engine.template_path(prefix) for engine, group in groups.values()
+                                 for prefix in {record["prefix"] for record in group}})
+    try:
+        for task, results in tuned_map(render_chunk, tasks, tuner, sizes=lambda task: len(task[0]),
+                                       initializer=init_worker, initargs=(templates.descriptor, signing)):
+            engine = groups[get_engine(task[0][0]["prefix"], backend, profile).name][0]
+            for record, (rendered_size, finished) in zip(task[0], results):
+                yield engine, record, rendered_size, finished
+    finally:
+        templates.close()
+    if tuned:
+        tuner.save()
+    if tuning_log:
+        rss = f", {tuner.rss_per_worker / 1024 / 1024:.0f} MB per worker" if tuner.rss_per_worker else ""
+        tuning_log(f"✓ Workers: {tuner.workers}{rss}"
+                   + (f" (tuned: {', '.join(f'{w}→{t}/s' for w, t in tuner.history)})" if tuned else ""))
+
+
+def generate_batch(records, output_dir, backend=None, progress=None, profile=None,
+                   linearize=None, compact=None, ledger=None, invoice=None, reissue=False,
+                   journal=None, package=None, workers=None, tuning_log=None, signing=None,
+                   verifier=None):
+    """
+    Render records into output_dir
+
+    Records are grouped by engine so each backend renders its share with
+    render_many.
+
+    Args:
+        records: Certificate records (see certificate_engine.make_record)
+        output_dir: Directory for the PDFs
+        backend: Force one backend instead of engine_config.json
+        progress: Optional callback(done, total)
+        profile: Output profile instead of engine_config.json ("print", "email", "archive")
+        linearize: Write linearized PDFs (default: engine_config.json "output")
+        compact: Write object streams / xref streams without duplicate objects
+            (default: engine_config.json "output")
+        ledger: CertificateLedger to record the certificates in, in
+            transactions of LEDGER_BATCH_SIZE
+        invoice: Invoice number for the ledger
+        reissue: Replace ledger records of serials that were issued before
+        journal: SessionJournal to record each certificate in and to resume
+            from - records it already has on disk unchanged are not rendered
+        package: InvoiceZipWriter to stream the certificates into instead
+            of writing files to output_dir
+        workers: Render processes - None renders in this process, a number
+            uses that many, "auto" tunes the count (see worker_tuning.py)
+        tuning_log: Optional callback for the tuned worker count
+        signing: Sign every certificate before it is written - {"key": .p12
+            path, "password", "appearance", "reason"} (see pdf_signing.py)
+        verifier: certificate_verify.Verifier to hand each written
+            certificate to
+
+    Returns:
+        list: One entry per certificate, like the GUI's generated_certificates,
+        plus the rendered and written sizes in bytes
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    options = output_options()
+    if linearize is None:
+        linearize = options["linearize"]
+    if compact is None:
+        compact = options["compact"]
+
+    generated = []
+    resumed = resumable(records, journal, output_dir) if journal is not None else set()
+    for record in records:
+        if record["serial"] in resumed:
+            output_path = output_dir / f"{record['serial']}.pdf"
+            size = output_path.stat().st_size
+            generated.append({
+                "filename": output_path.name,
+                "path": str(output_path),
+                "serial": record["serial"],
+                "product": PRODUCTS[record["prefix"]]["name"],
+                "data": record,
+                "rendered_size": size,
+                "size": size,
+            })
+
+    groups = {}
+    for record in records:
+        if record["serial"] in resumed:
+            continue
+        engine = get_engine(record["prefix"], backend, profile)
+        groups.setdefault(engine.name, (engine, []))[1].append(record)
+
+    if workers in (None, 1):
+        signer = load_signer(signing) if signing is not None else None
+        rendered = ((engine, record, len(pdf), finish_certificate(pdf, linearize, compact, signer))
+                    for engine, group in groups.values() for record, pdf in engine.render_many(group))
+    else:
+        rendered = render_parallel(groups, workers, backend, profile, linearize, compact, tuning_log,
+                                   signing)
+
+    pending = []
+    for engine, record, rendered_size, finished in rendered:
+        output_filename = f"{record['serial']}.pdf"
+        if package is not None:
+            output_path = member_location(package.path, output_filename)
+            package.add(output_filename, finished,
+                        {"serial": record["serial"], "product": PRODUCTS[record["prefix"]]["name"]})
+            sha256 = package.entries[-1]["sha256"]
+        else:
+            output_path = output_dir / output_filename
+            sha256 = write_hashed(output_path, finished)[1]
+        generated.append({
+            "filename": output_filename,
+            "path": str(output_path),
+            "serial": record["serial"],
+            "product": PRODUCTS[record["prefix"]]["name"],
+            "data": record,
+            "rendered_size": rendered_size,
+            "size": len(finished),
+        })
+        if journal is not None:
+            journal.append(generated[-1], sha256, len(finished))
+        if verifier is not None:
+            verifier.submit(finished if package is not None else output_path, record)
+        if ledger is not None:
+            pending.append(ledger_entry(record, PRODUCTS[record["prefix"]]["name"],
+                                        engine.template_path(record["prefix"]), output_path, invoice))
+            if len(pending) >= LEDGER_BATCH_SIZE:
+                ledger.record_many(pending, replace=reissue)
+                pending = []
+        if progress:
+            progress(len(generated), len(records))
+    if pending:
+        ledger.record_many(pending, replace=reissue)
+    if journal is not None:
+        journal.sync()
+    return generated
+
+
+def run_batch(records, output="output", invoice=None, backend=None, profile=None, linearize=None,
+              compact=None, bundle=False, zip_package=False, reissue=False, ledger_path=LEDGER_FILE,
+              workers=None, signing=None, verify=False, log=print):
+    """
+    Generate one order's certificates as the command line does
+
+    Checks the ledger for duplicates, resumes an interrupted run, renders,
+    places the certificates (invoice folder, shards or ZIP) and writes the
+    manifest, serial index and optional bundle.
+
+    Args:
+        records: Validated records (read_records)
+        output: Output folder
+        invoice: Invoice number (None: straight into the output folder)
+        bundle: Also combine the certificates into one invoice PDF
+        zip_package: Stream the certificates into output/Invoice_<number>.zip
+        ledger_path: Certificate ledger database
+        workers: Render processes, or "auto" (see generate_batch)
+        signing: Signing options (see generate_batch)
+        verify: Check every certificate's text (default: the engine_config.json
+            "verify_sample" share of them)
+        log: Callback for progress lines
+
+    Returns:
+        dict: "duplicates" ((serial, reason) pairs - nothing was generated
+        if any), "certificates", "resumed", "elapsed" (s), "location"
+        (invoice folder or ZIP) and "verify_failures" ((serial, problems)
+        pairs)
+    """
+    root = output_dir = Path(output)
+    layout = OutputLayout(root)
+    package = staging = None
+    if zip_package:
+        package = InvoiceZipWriter(output_dir / f"Invoice_{invoice or 'bundle'}.zip")
+        journal = None
+        resumed = set()
+    else:
+        if layout.sharded:
+            # Staged like the GUIs (in its own folder, per invoice, so a rerun
+            # resumes it), then moved into the shards when complete
+            staging = StagingSession(root / f".batch-{invoice or 'unassigned'}")
+            output_dir = staging.path
+        elif invoice:
+            output_dir = layout.invoice_dir(invoice)
+        journal = SessionJournal(output_dir)
+        resumed = resumable(records, journal, output_dir)
+    ledger = CertificateLedger(ledger_path)
+    duplicates = find_duplicates(records, ledger, resumed)
+    if duplicates and not reissue:
+        ledger.close()
+        if package is not None:
+            package.abort()
+        return {"duplicates": duplicates, "certificates": 0, "resumed": len(resumed),
+                "elapsed": 0.0, "location": None, "verify_failures": []}
+    if resumed:
+        log(f"✓ Resuming: {len(resumed)} certificate(s) already generated by an interrupted run")
+
+    # --verify failures are listed in the summary; sampled ones go to the failure log
+    sample_rate = 1.0 if verify else output_options()["verify_sample"]
+    verifier = None
+    if sample_rate > 0:
+        verifier = Verifier(sample_rate, on_failure=None if verify else log_failure)
+    start = time.perf_counter()
+    with ledger:
+        try:
+            generated = generate_batch(records, output_dir, backend, profile=profile,
+                                       linearize=linearize, compact=compact,
+                                       ledger=ledger, invoice=invoice, reissue=reissue,
+                                       journal=journal, package=package, workers=workers,
+                                       tuning_log=log, signing=signing, verifier=verifier)
+        except BaseException:
+            if package is not None:
+                package.abort()
+            raise
+        finally:
+            # Checks read the staged files, so they finish before anything moves
+            if verifier is not None:
+                verifier.close()
+        if staging is not None:
+            journal.close()
+            moved = layout.finish_invoice(staging, journal.load(), invoice or "unassigned")
+            ledger.set_paths({path.stem: path for path in moved})
+            located = {path.name: path for path in moved}
+            for entry in generated:
+                entry["path"] = str(located[entry["filename"]])
+            output_dir = layout.invoice_dir(invoice or "unassigned")
+    if package is not None:
+        package.close()
+        output_dir = package.path
+    elapsed = time.perf_counter() - start
+
+    log(f"✓ Generated {len(generated) - len(resumed)} certificates in {elapsed:.2f}s")
+    if verifier is not None:
+        counts = verifier.counts
+        log(f"{'✗' if counts['failed'] else '✓'} Verified {counts['checked']} certificate(s): "
+            f"{counts['failed']} failed ({verifier.seconds:.2f}s on the verifier thread)")
+    options = output_options()
+    linearize = options["linearize"] if linearize is None else linearize
+    compact = options["compact"] if compact is None else compact
+    if compact:
+        before = sum(entry["rendered_size"] for entry in generated)
+        after = sum(entry["size"] for entry in generated)
+        log(f"✓ Compact output: {before / 1024:.0f} KB → {after / 1024:.0f} KB")
+    if package is None and (bundle or options["invoice_bundle"]):
+        bundle_path = output_dir / f"Invoice_{invoice or 'bundle'}.pdf"
+        bundle_pdfs([entry["path"] for entry in generated], bundle_path, linearize, compact)
+        log(f"✓ Bundle: {bundle_path.name} ({bundle_path.stat().st_size / 1024:.0f} KB)")
+    if journal is not None:
+        if staging is None:
+            write_manifest(output_dir, journal.load())
+            with SerialIndex(root) as index:
+                index.update({entry["serial"]: entry["path"] for entry in generated})
+        log(f"✓ Manifest: {MANIFEST_CSV} (verify with invoice_manifest.py verify)")
+        journal.finish()
+    return {"duplicates": [], "certificates": len(generated) - len(resumed), "resumed": len(resumed),
+            "elapsed": elapsed, "location": output_dir,
+            "verify_failures": verifier.failures if verifier is not None else []}
+
+
+def parse_workers(value):
+    """Parse --workers: a positive number of processes, or auto"""
+    if value == "auto":
+        return value
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError('expected a number of processes or "auto"')
+    return int(value)
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Generate GasClip certificates from an order CSV")
+    parser.add_argument("csv_file", help="Order CSV file")
+    parser.add_argument("--invoice", help="Write into output/Invoice_<number>/")
+    parser.add_argument("--output", default="output", help="Output directory (default: output)")
+    parser.add_argument("--backend", help="Certificate engine backend (default: engine_config.json)")
+    parser.add_argument("--profile", choices=sorted(PROFILES),
+                        help="Output profile (default: engine_config.json)")
+    parser.add_argument("--linearize", action="store_true", default=None,
+                        help="Write linearized (fast web view) PDFs")
+    parser.add_argument("--compact", action="store_true", default=None,
+                        help="Write object streams and xref streams, without duplicate objects")
+    package_mode = parser.add_mutually_exclusive_group()
+    package_mode.add_argument("--bundle", action="store_true",
+                              help="Also combine the certificates into one invoice PDF")
+    package_mode.add_argument("--zip", action="store_true",
+                              help="Stream the certificates into output/Invoice_<number>.zip")
+    parser.add_argument("--reissue", action="store_true",
+                        help="Allow serials that are already in the ledger")
+    parser.add_argument("--workers", type=parse_workers,
+                        help='Render processes, or "auto" to tune them for this machine')
+    parser.add_argument("--sign", metavar="KEY.p12", help="Sign the certificates with this PKCS#12 key")
+    parser.add_argument("--sign-appearance", action="store_true",
+                        help="Show the signature on page 1 (with --sign)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check the text of every written certificate")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("GasClip Batch Certificate Generator")
+    print("=" * 70)
+
+    records, errors = read_records(args.csv_file)
+    if errors:
+        print(f"✗ {len(errors)} problem(s) in {args.csv_file}:")
+        for row_number, message in errors:
+            print(f"  Row {row_number}: {message}")
+        return 1
+
+    signing = None
+    if args.sign:
+        signing = {"key": args.sign, "password": signing_password(), "appearance": args.sign_appearance}
+        try:
+            load_signer(signing)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"✗ Cannot sign with {args.sign}: {e}")
+            return 1
+
+    summary = run_batch(records, args.output, args.invoice, args.backend, args.profile,
+                        args.linearize, args.compact, args.bundle, args.zip, args.reissue,
+                        workers=args.workers, signing=signing, verify=args.verify)
+    if summary["duplicates"]:
+        print(f"✗ {len(summary['duplicates'])} serial(s) would be issued twice (use --reissue to allow):")
+        for serial, reason in summary["duplicates"]:
+            print(f"  {serial}: {reason}")
+        return 1
+    print(f"✓ Location: {Path(summary['location']).absolute()}")
+    for serial, problems in summary["verify_failures"]:
+        print(f"✗ {serial}: {'; '.join(problems)}")
+    print("=" * 70)
+    return 1 if summary["verify_failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
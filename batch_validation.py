@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Whole-batch validation
+Checks every row of an order at once instead of one form at a time: the
+columns become NumPy arrays, all dates are parsed into datetime64 in one
+pass, and the product, digit-only serial, lot and date range checks and the
+calibration expiry dates are array operations. A 100k-row import is
+reported in full, row by row, before anything is rendered.
+
+The messages are the same as certificate_engine.validate_inputs gives for
+a single form, in the same order.
+
+Usage:
+    python batch_validation.py orders.csv [...]
+"""
+
+from pathlib import Path
+import csv
+import sys
+import time
+
+import numpy as np
+
+from certificate_engine import PRODUCTS, RECORD_FIELDS, validate_date
+
+DATE_FIELDS = (("activation", "Activation Date"), ("gas_prod", "Gas Production Date"),
+               ("calibration", "Calibration Date"))
+
+# validate_date's messages, by the check that failed
+DATE_MESSAGES = {
+    1: "Date must be 8 digits (DD/MM/YYYY)",
+    2: "Month must be between 01 and 12",
+    3: "Day must be between 01 and 31",
+    4: "Year must be between 2000 and 2100",
+    5: "Invalid date (e.g., 31/02/2025 doesn't exist)",
+}
+
+
+def read_columns(csv_path):
+    """
+    Read an order CSV column-wise
+
+    Header names are matched case-insensitively, and "product" may stand
+    for "prefix", as in batch_generate.parse_record.
+
+    Returns:
+        dict: field -> list of strings (empty strings for missing columns)
+    """
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        rows = [row for row in reader if row]
+    if "prefix" not in header and "product" in header:
+        header[header.index("product")] = "prefix"
+    columns = {}
+    for field in RECORD_FIELDS:
+        if field in header:
+            index = header.index(field)
+            columns[field] = [row[index] if index < len(row) else "" for row in rows]
+        else:
+            columns[field] = [""] * len(rows)
+    return columns
+
+
+def parse_dates(values):
+    """
+    Parse DD/MM/YYYY (or DDMMYYYY) strings in one pass
+
+    Returns:
+        tuple: (datetime64[D] array, NaT where invalid; int array of the
+        failed check per value, 0 if valid - see DATE_MESSAGES)
+    """
+    values = np.char.replace(np.char.strip(np.asarray(values, dtype=str)), "/", "")
+    count = len(values)
+    codes = np.zeros(count, dtype=np.int8)
+    eight = np.char.str_len(values) == 8
+    codes[~eight] = 1
+
+    # Eight ASCII digits as code points -> day, month, year (other Unicode
+    # digits are left to validate_date below, as int() reads them)
+    filled = np.where(eight, values, "01012000").astype("<U8")
+    digits = _code_points(filled, 8).astype(np.int32) - ord("0")
+    digits_only = eight & ((digits >= 0) & (digits <= 9)).all(axis=1)
+    digits[~digits_only] = [0, 1, 0, 1, 2, 0, 0, 0]
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+
+    for code, bad in ((2, (month < 1) | (month > 12)),
+                      (3, (day < 1) | (day > 31)),
+                      (4, (year < 2000) | (year > 2100))):
+        codes[digits_only & (codes == 0) & bad] = code
+
+    months = ((year - 1970) * 12 + np.clip(month, 1, 12) - 1).astype("datetime64[M]")
+    dates = months.astype("datetime64[D]") + (np.clip(day, 1, 31) - 1).astype("timedelta64[D]")
+    codes[digits_only & (codes == 0) & (dates.astype("datetime64[M]") != months)] = 5
+
+    # Eight characters that are not all ASCII digits: int() decides, as in validate_date
+    for index in np.flatnonzero((codes == 0) & ~digits_only):
+        value = str(values[index])
+        valid, message = validate_date(value)
+        if valid:
+            dates[index] = np.datetime64(f"{int(value[4:]):04d}-{int(value[2:4]):02d}-{int(value[:2]):02d}")
+        else:
+            codes[index] = next(code for code, text in DATE_MESSAGES.items() if text == message)
+
+    dates[codes != 0] = np.datetime64("NaT")
+    return dates, codes
+
+
+def _code_points(values, width):
+    """Fixed-width string array as a (rows, width) array of code points"""
+    return np.ascontiguousarray(values, dtype=f"<U{width}").view(np.uint32).reshape(len(values), width)
+
+
+def ascii_upper(values):
+    """Upper-case the ASCII letters of a string array (np.char.upper runs per element)"""
+    values = np.asarray(values, dtype=str)
+    width = max(values.dtype.itemsize // 4, 1)
+    chars = _code_points(values, width).copy()
+    chars[(chars >= ord("a")) & (chars <= ord("z"))] -= ord("a") - ord("A")
+    return chars.view(f"<U{width}").ravel()
+
+
+def upper(values):
+    """str.upper of a string array: ascii_upper, then str.upper for the rare non-ASCII values"""
+    values = np.asarray(values, dtype=str)
+    result = ascii_upper(values)
+    width = max(values.dtype.itemsize // 4, 1)
+    other = np.flatnonzero((_code_points(values, width) > 127).any(axis=1))
+    if len(other):
+        result = result.astype(object)
+        result[other] = [value.upper() for value in values[other].tolist()]
+        result = result.astype(str)
+    return result
+
+
+def format_dates(dates):
+    """datetime64[D] array -> array of DD/MM/YYYY strings"""
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    years = dates.astype("datetime64[Y]")
+    months = dates.astype("datetime64[M]")
+    year = years.astype(np.int64) + 1970
+    month = (months - years.astype("datetime64[M]")).astype(np.int64) + 1
+    day = (dates - months.astype("datetime64[D]")).astype(np.int64) + 1
+    slash = np.full(len(dates), ord("/"))
+    chars = np.stack([day // 10, day % 10, slash - ord("0"), month // 10, month % 10, slash - ord("0"),
+                      year // 1000, year // 100 % 10, year // 10 % 10, year % 10], axis=1) + ord("0")
+    return chars.astype(np.uint32).view("<U10").ravel()
+
+
+def calculate_expiration_dates(activation, days):
+    """
+    Vectorized certificate_engine.calculate_expiration_date
+
+    Args:
+        activation: Activation dates (strings or datetime64[D])
+        days: Days to add (one value or one per date)
+
+    Returns:
+        numpy.ndarray: DD/MM/YYYY strings
+    """
+    if not np.issubdtype(np.asarray(activation).dtype, np.datetime64):
+        activation, _ = parse_dates(activation)
+    return format_dates(activation + np.asarray(days).astype("timedelta64[D]"))
+
+
+def check_columns(columns, first_row=2, duplicates=True):
+    """
+    Validate a whole order at once, without building records
+
+    Args:
+        columns: field -> list of strings (see read_columns)
+        first_row: Row number of the first record (2: after a CSV header)
+        duplicates: Also report serials that appear twice in the batch
+
+    Returns:
+        tuple: (errors, arrays) - errors as (row number, message) in row and
+        form order; arrays holds the cleaned columns (serial with its
+        prefix, dates of valid rows as DD/MM/YYYY), "calibration_exp" and
+        the "valid" row mask
+    """
+    arrays = {field: np.char.strip(np.asarray(columns[field], dtype=str)) for field in RECORD_FIELDS}
+    prefix = arrays["prefix"] = upper(arrays["prefix"])
+    serial = arrays["serial"]
+    count = len(prefix)
+
+    # A serial may carry its prefix, known or not (as in parse_record)
+    carries = (np.char.str_len(prefix) > 0) & np.char.startswith(upper(serial), prefix)
+    if carries.any():
+        serial = serial.astype(object)
+        serial[carries] = [value[len(known):] for value, known in zip(serial[carries], prefix[carries])]
+        serial = serial.astype(str)
+
+    checks = [(np.isin(prefix, list(PRODUCTS), invert=True), "Please select a product"),
+              (~np.char.isdigit(serial), "Serial number must contain only digits")]
+    parsed = {}
+    for field, label in DATE_FIELDS:
+        dates, codes = parse_dates(arrays[field])
+        parsed[field] = dates
+        if field == "gas_prod":
+            checks.append((np.char.str_len(arrays["lot"]) == 0, "Lot number is required"))
+        for code, message in DATE_MESSAGES.items():
+            checks.append((codes == code, f"{label}: {message}"))
+
+    failed = np.zeros(count, dtype=bool)
+    for mask, _ in checks:
+        failed |= mask
+    rows = {}
+    for mask, message in checks:
+        for index in np.flatnonzero(mask).tolist():
+            rows.setdefault(index, []).append(message)
+
+    arrays["serial"] = np.char.add(prefix, serial)
+    if duplicates:
+        seen = set()
+        repeated = [index for index, value in enumerate(arrays["serial"].tolist())
+                    if value in seen or seen.add(value)]
+        for index in repeated:
+            if not failed[index]:
+                rows.setdefault(index, []).append(f"{arrays['serial'][index]} appears twice in this batch")
+                failed[index] = True
+
+    errors = [(first_row + index, message) for index in sorted(rows) for message in rows[index]]
+
+    days = np.zeros(count, dtype=np.int64)
+    for known, info in PRODUCTS.items():
+        days[prefix == known] = info["calibration_days"]
+    expiry = np.full(count, "", dtype="<U10")
+    expiry[~failed] = calculate_expiration_dates(parsed["activation"][~failed], days[~failed])
+    arrays["calibration_exp"] = expiry
+    # Valid dates as make_record stores them: DD/MM/YYYY in ASCII digits
+    for field, _ in DATE_FIELDS:
+        arrays[field] = np.where(failed, arrays[field], format_dates(
+            np.where(failed, np.datetime64("2000-01-01"), parsed[field])))
+    arrays["valid"] = ~failed
+    return errors, arrays
+
+
+def validate_columns(columns, first_row=2, duplicates=True):
+    """
+    Validate a whole order and build the records of its valid rows
+
+    Returns:
+        tuple: (records, errors) like batch_generate.read_records (see
+        check_columns for the arguments)
+    """
+    errors, arrays = check_columns(columns, first_row, duplicates)
+    fields = RECORD_FIELDS + ["calibration_exp"]
+    valid = arrays["valid"]
+    records = [dict(zip(fields, values))
+               for values in zip(*(arrays[field][valid].tolist() for field in fields))]
+    return records, errors
+
+
+def main():
+    """Validate order CSVs and print the full error report"""
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+
+    print("=" * 70)
+    print("Batch Validation")
+    print("=" * 70)
+    failed = False
+    for csv_path in sys.argv[1:]:
+        start = time.perf_counter()
+        columns = read_columns(csv_path)
+        read = time.perf_counter() - start
+        records, errors = validate_columns(columns)
+        elapsed = time.perf_counter() - start - read
+        rows = len(columns["prefix"])
+        if errors:
+            failed = True
+            print(f"✗ {Path(csv_path).name}: {len(errors)} problem(s) in {rows} rows "
+                  f"(validated in {elapsed * 1000:.0f} ms)")
+            for row_number, message in errors:
+                print(f"  Row {row_number}: {message}")
+        else:
+            print(f"✓ {Path(csv_path).name}: {len(records)} rows valid "
+                  f"(read in {read * 1000:.0f} ms, validated in {elapsed * 1000:.0f} ms)")
+    print("=" * 70)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
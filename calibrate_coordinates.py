@@ -2,15 +2,21 @@
 """
 Coordinate Calibration Tool
 Generates test PDFs with text at different positions to help find the perfect coordinates.
+
+Run with --sweep to score a grid of x/y/size offsets for every product field
+automatically and write the best coordinates to sweep_coordinates.json.
 """
 
 from pathlib import Path
 from PyPDF2 import PdfReader, PdfWriter
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.colors import red, blue, green
+from reportlab.lib.colors import red, blue, green, black
+from concurrent.futures import ProcessPoolExecutor
 import io
 import json
+import sys
+from product_coordinates import PRODUCT_COORDINATES
 
 def load_coordinates():
     """Load coordinates from JSON file"""
@@ -170,5 +176,252 @@ def generate_calibration_tests():
     print("4. Run this script again to verify")
     print("=" * 70)
 
+# Sweep mode ---------------------------------------------------------------
+
+# Original template (with sample text) for each product prefix
+SWEEP_TEMPLATES = {
+    "D4PQ": "D4PQ236599",
+    "SOSP": "SOSP215459",
+    "SCSQ": "SCSQ175392",
+    "D4SQ": "D4SQ106733",
+    "SHSP": "SHSP085112",
+}
+
+# (page key, field key, font) for every field app.py writes
+SWEEP_FIELDS = [
+    ("page1", "serial", "Helvetica-Bold"),
+    ("page1", "activation_date", "Helvetica"),
+    ("page1", "lot", "Helvetica-Bold"),
+    ("page1", "gas_prod", "Helvetica"),
+    ("page1", "calibration", "Helvetica-Bold"),
+    ("page2", "serial", "Helvetica-Bold"),
+]
+
+SWEEP_SAMPLE_TEXT = {
+    "activation_date": "02/10/2025",
+    "lot": "TEST123456",
+    "gas_prod": "21/03/2024",
+    "calibration": "02/10/2025",
+}
+
+SWEEP_DX = [-6, -4, -2, 0, 2, 4, 6]
+SWEEP_DY = [-6, -4, -2, 0, 2, 4, 6]
+SWEEP_DSIZE = [-2, -1, 0, 1, 2]
+SWEEP_DPI = 144
+
+# Weight of one overlapping pixel fraction against one point of baseline error
+OVERLAP_WEIGHT = 20.0
+
+
+def _row_bands(mask):
+    """Split a mask into bands of consecutive inked rows: [(top_row, bottom_row), ...]"""
+    rows = mask.any(axis=1).nonzero()[0]
+    bands = []
+    for row in rows:
+        if bands and row - bands[-1][1] <= 2:
+            bands[-1][1] = row
+        else:
+            bands.append([row, row])
+    return bands
+
+
+def field_window(coord, scale, page_height):
+    """Pixel window (top, bottom, left, right) searched around a field's nominal position"""
+    size = coord["size"]
+    top = int((page_height - (coord["y"] + size * 2.0)) * scale)
+    bottom = int((page_height - (coord["y"] - size * 1.5)) * scale)
+    left = int((coord["x"] - 20) * scale)
+    right = int((coord["x"] + 160) * scale)
+    return max(top, 0), bottom, max(left, 0), right
+
+
+def find_label_baseline(original, clean, coord, scale, page_height):
+    """
+    Locate the sample text of the original template around a field
+
+    The original and clean templates differ only by the sample values, so the
+    difference of their rasters isolates the text the overlay has to replace.
+
+    Returns:
+        tuple: (baseline, cap_top) in PDF points, or None if nothing was found
+    """
+    top, bottom, left, right = field_window(coord, scale, page_height)
+    diff = (abs(original[top:bottom, left:right].astype(int) -
+                clean[top:bottom, left:right].astype(int)) > 64)
+    bands = _row_bands(diff)
+    if not bands:
+        return None
+
+    def to_points(row):
+        return page_height - (top + row) / scale
+
+    # Pick the band whose baseline is closest to the nominal position
+    band_top, band_bottom = min(bands, key=lambda b: abs(to_points(b[1] + 1) - coord["y"]))
+    return to_points(band_bottom + 1), to_points(band_top)
+
+
+def render_candidates(text, font, candidates, pagesize=A4):
+    """Render one overlay page per (x, y, size) candidate"""
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=pagesize)
+    for x, y, size in candidates:
+        can.setFillColor(black)
+        can.setFont(font, size)
+        can.drawString(x, y, text)
+        can.showPage()
+    can.save()
+    return packet.getvalue()
+
+
+def score_candidate(candidate_ink, template_ink, reference):
+    """
+    Score one rasterized candidate (lower is better)
+
+    Returns:
+        dict: overlap (fraction of text pixels landing on template ink),
+              baseline_error and top_error (points), and the combined score
+    """
+    text_pixels = candidate_ink.sum()
+    if not text_pixels:
+        return None
+    overlap = float((candidate_ink & template_ink).sum()) / float(text_pixels)
+
+    baseline_error = top_error = 0.0
+    if reference is not None:
+        bands = _row_bands(candidate_ink)
+        rows = candidate_ink.any(axis=1).nonzero()[0]
+        top_row, bottom_row = rows[0], rows[-1]
+        if bands:
+            top_row, bottom_row = bands[0][0], bands[-1][1]
+        baseline_error = abs(reference["baseline_px"] - (bottom_row + 1)) / reference["scale"]
+        top_error = abs(reference["top_px"] - top_row) / reference["scale"]
+
+    return {
+        "overlap": round(overlap, 4),
+        "baseline_error": round(baseline_error, 2),
+        "top_error": round(top_error, 2),
+        "score": round(OVERLAP_WEIGHT * overlap + baseline_error + top_error, 3),
+    }
+
+
+def sweep_field(task):
+    """
+    Evaluate every offset candidate for one product field
+
+    Runs in a worker process; task is (prefix, page_key, field, font).
+    """
+    from pdf_raster import rasterize_pdf, ink_mask
+
+    prefix, page_key, field, font = task
+    stem = SWEEP_TEMPLATES[prefix]
+    page_index = 0 if page_key == "page1" else 1
+    coord = PRODUCT_COORDINATES[prefix][page_key][field]
+    scale = SWEEP_DPI / 72
+    templates_dir = Path(__file__).parent / "templates"
+    mediabox = PdfReader(str(templates_dir / f"{stem}_clean.pdf")).pages[page_index].mediabox
+    pagesize = (float(mediabox.width), float(mediabox.height))
+
+    original = rasterize_pdf(templates_dir / f"{stem}.pdf", SWEEP_DPI, page_index, page_index)[0]
+    clean = rasterize_pdf(templates_dir / f"{stem}_clean.pdf", SWEEP_DPI, page_index, page_index)[0]
+
+    top, bottom, left, right = field_window(coord, scale, pagesize[1])
+    template_ink = ink_mask(clean[top:bottom, left:right])
+
+    reference = None
+    found = find_label_baseline(original, clean, coord, scale, pagesize[1])
+    if found:
+        baseline, cap_top = found
+        reference = {
+            "baseline": round(baseline, 2),
+            "cap_top": round(cap_top, 2),
+            "baseline_px": (pagesize[1] - baseline) * scale - top,
+            "top_px": (pagesize[1] - cap_top) * scale - top,
+            "scale": scale,
+        }
+
+    text = stem if field == "serial" else SWEEP_SAMPLE_TEXT[field]
+    candidates = [
+        (round(coord["x"] + dx, 2), round(coord["y"] + dy, 2), coord["size"] + ds)
+        for dx in SWEEP_DX for dy in SWEEP_DY for ds in SWEEP_DSIZE
+    ]
+    rasters = rasterize_pdf(render_candidates(text, font, candidates, pagesize), SWEEP_DPI)
+
+    results = []
+    for (x, y, size), raster in zip(candidates, rasters):
+        scores = score_candidate(ink_mask(raster[top:bottom, left:right]), template_ink, reference)
+        if scores is None:
+            continue
+        distance = abs(x - coord["x"]) + abs(y - coord["y"]) + abs(size - coord["size"])
+        results.append((scores["score"], distance, {"x": x, "y": y, "size": size, **scores}))
+
+    results.sort(key=lambda r: (r[0], r[1]))
+    baseline_scores = next((r[2] for r in results if r[1] == 0), None)
+    return {
+        "prefix": prefix,
+        "page": page_key,
+        "field": field,
+        "best": results[0][2] if results else None,
+        "current": baseline_scores,
+        "reference": {k: reference[k] for k in ("baseline", "cap_top")} if reference else None,
+        "candidates": len(candidates),
+    }
+
+
+def run_offset_sweep(prefixes=None, output_file="sweep_coordinates.json", workers=None):
+    """
+    Score an x/y/size offset grid for every field and write the winners
+
+    Args:
+        prefixes: Product prefixes to sweep (default: all)
+        output_file: JSON file for the winning coordinates and their scores
+        workers: Process pool size (default: CPU count)
+
+    Returns:
+        dict: Winning coordinates in PRODUCT_COORDINATES layout
+    """
+    print("=" * 70)
+    print("Coordinate Offset Sweep")
+    print("=" * 70)
+
+    prefixes = prefixes or list(SWEEP_TEMPLATES)
+    tasks = [(prefix, page_key, field, font)
+             for prefix in prefixes
+             for page_key, field, font in SWEEP_FIELDS]
+    grid = len(SWEEP_DX) * len(SWEEP_DY) * len(SWEEP_DSIZE)
+    print(f"Evaluating {len(tasks)} fields x {grid} candidates...")
+
+    winners = {}
+    no_ink = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(sweep_field, tasks):
+            best = result["best"]
+            current = result["current"] or {}
+            if best is None:
+                # No candidate drew any ink inside the field window
+                no_ink.append(f"{result['prefix']} {result['page']}.{result['field']}")
+                print(f"  ⚠ {no_ink[-1]}: no ink found, skipped")
+                continue
+            page = winners.setdefault(result["prefix"], {}).setdefault(result["page"], {})
+            page[result["field"]] = {**best, "current_score": current.get("score"),
+                                     "reference": result["reference"]}
+            print(f"  {result['prefix']} {result['page']}.{result['field']}: "
+                  f"({best['x']}, {best['y']}, {best['size']}) score {best['score']} "
+                  f"(current {current.get('score')})")
+
+    with open(output_file, 'w') as f:
+        json.dump(winners, f, indent=2)
+
+    print("\n" + "=" * 70)
+    print(f"✓ Wrote best coordinates to: {output_file}")
+    if no_ink:
+        print(f"⚠ No ink found for {len(no_ink)} field(s), not written: {', '.join(no_ink)}")
+    print("Copy the x/y/size values into product_coordinates.py to apply them.")
+    print("=" * 70)
+    return winners
+
+
 if __name__ == "__main__":
-    generate_calibration_tests()
+    if "--sweep" in sys.argv[1:]:
+        run_offset_sweep([a for a in sys.argv[1:] if not a.startswith("--")] or None)
+    else:
+        generate_calibration_tests()
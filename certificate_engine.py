@@ -0,0 +1,915 @@
+#!/usr/bin/env python3
+"""
+Shared certificate engine for the GasClip generators
+Product configuration, input validation, expiry calculation and the
+pluggable rendering backends used by the GUIs and the batch tools.
+
+Usage:
+    python certificate_engine.py benchmark [count] [--save]
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.colors import black, white
+from product_coordinates import get_coordinates, LOT_PLACEHOLDER_COVER
+from output_profiles import PROFILES, profile_template
+import contextlib
+import hashlib
+import io
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+BASE_DIR = Path(__file__).parent
+TEMPLATES_DIR = BASE_DIR / "templates"
+WORD_TEMPLATES_DIR = BASE_DIR / "templates_word"
+ENGINE_CONFIG_FILE = BASE_DIR / "engine_config.json"
+
+# Product configurations, keyed by serial number prefix
+PRODUCTS = {
+    "D4PQ": {
+        "name": "MGC-S+ (MGC-SIMPLEPLUS)",
+        "template": "D4PQ236599_clean.pdf",
+        "word_template": "D4PQ236599_clean.docx",
+        "detector_life": 36,
+        "calibration_days": 1095,
+    },
+    "SOSP": {
+        "name": "SGC-O (Single Gas Clip O2)",
+        "template": "SOSP215459_clean.pdf",
+        "word_template": "SOSP215459_clean.docx",
+        "detector_life": 24,
+        "calibration_days": 730,
+    },
+    "SCSQ": {
+        "name": "SGC-C (Single Gas Clip CO)",
+        "template": "SCSQ175392_clean.pdf",
+        "word_template": "SCSQ175392_clean.docx",
+        "detector_life": 24,
+        "calibration_days": 730,
+    },
+    "D4SQ": {
+        "name": "MGC-S (MGC-SIMPLE)",
+        "template": "D4SQ106733_clean.pdf",
+        "word_template": "D4SQ106733_clean.docx",
+        "detector_life": 24,
+        "calibration_days": 730,
+    },
+    "SHSP": {
+        "name": "SGC-H (Single Gas Clip H2S)",
+        "template": "SHSP085112_clean.pdf",
+        "word_template": "SHSP085112_clean.docx",
+        "detector_life": 24,
+        "calibration_days": 730,
+    },
+}
+
+# Text written on each certificate:
+# (page index, product_coordinates page key, coordinate key, record key, font)
+OVERLAY_FIELDS = [
+    (0, "page1", "serial", "serial", "Helvetica-Bold"),
+    (0, "page1", "activation_date", "activation", "Helvetica"),
+    (0, "page1", "lot", "lot", "Helvetica-Bold"),
+    (0, "page1", "gas_prod", "gas_prod", "Helvetica"),
+    (0, "page1", "calibration", "calibration", "Helvetica-Bold"),
+    (1, "page2", "serial", "serial", "Helvetica-Bold"),
+]
+
+OVERLAY_PAGE_COUNT = max(field[0] for field in OVERLAY_FIELDS) + 1
+
+# Resource name of the overlay form XObject on merged pages
+OVERLAY_XOBJECT_NAME = "/GasClipOverlay"
+
+
+def overlay_layout_version(prefix):
+    """
+    Short hash of everything the overlay draws with for a product (fields,
+    coordinates, placeholder cover) - changes whenever the layout does
+    """
+    layout = [OVERLAY_FIELDS, get_coordinates(prefix), LOT_PLACEHOLDER_COVER]
+    return hashlib.sha256(json.dumps(layout, sort_keys=True).encode()).hexdigest()[:12]
+
+RECORD_FIELDS = ["prefix", "serial", "activation", "lot", "gas_prod", "calibration"]
+
+
+# Products, validation and dates ---------------------------------------------
+
+def product_by_name(name):
+    """Return (prefix, product info) for a product display name"""
+    for prefix, info in PRODUCTS.items():
+        if info["name"] == name:
+            return prefix, info
+    raise KeyError(f"Unknown product: {name}")
+
+
+def validate_date(date_str):
+    """Validate a DD/MM/YYYY (or DDMMYYYY) date - returns (valid, message)"""
+    date_str = date_str.replace('/', '')
+    if len(date_str) != 8:
+        return False, "Date must be 8 digits (DD/MM/YYYY)"
+
+    try:
+        day = int(date_str[:2])
+        month = int(date_str[2:4])
+        year = int(date_str[4:])
+
+        if month < 1 or month > 12:
+            return False, "Month must be between 01 and 12"
+        if day < 1 or day > 31:
+            return False, "Day must be between 01 and 31"
+        if year < 2000 or year > 2100:
+            return False, "Year must be between 2000 and 2100"
+
+        datetime(year, month, day)
+        return True, ""
+    except ValueError:
+        return False, "Invalid date (e.g., 31/02/2025 doesn't exist)"
+
+
+def validate_inputs(prefix, serial_digits, activation, lot, gas_prod, calibration):
+    """
+    Validate the inputs for one certificate
+
+    Returns:
+        list: (field, message) for every problem, in form order; empty if valid
+    """
+    errors = []
+    if prefix not in PRODUCTS:
+        errors.append(("product", "Please select a product"))
+    if not serial_digits or not serial_digits.isdigit():
+        errors.append(("serial", "Serial number must contain only digits"))
+    for field, label, value in (("activation", "Activation Date", activation),
+                                ("lot", None, lot),
+                                ("gas_prod", "Gas Production Date", gas_prod),
+                                ("calibration", "Calibration Date", calibration)):
+        if label is None:
+            if not value:
+                errors.append((field, "Lot number is required"))
+            continue
+        valid, msg = validate_date(value)
+        if not valid:
+            errors.append((field, f"{label}: {msg}"))
+    return errors
+
+
+def parse_date(date_str):
+    """datetime of a DD/MM/YYYY (or DDMMYYYY) date, read as validate_date reads it"""
+    date_str = date_str.replace('/', '')
+    if len(date_str) != 8:
+        raise ValueError(f"Date must be 8 digits (DD/MM/YYYY): {date_str!r}")
+    return datetime(int(date_str[4:]), int(date_str[2:4]), int(date_str[:2]))
+
+
+def normalize_date(date_str):
+    """A valid date as printed on certificates: DD/MM/YYYY in ASCII digits"""
+    return parse_date(date_str).strftime("%d/%m/%Y")
+
+
+def calculate_expiration_date(activation_date_str, days):
+    """Calculate expiration date from activation date"""
+    activation = parse_date(activation_date_str)
+    expiration = activation + timedelta(days=days)
+
+    return expiration.strftime("%d/%m/%Y")
+
+
+def make_record(prefix, serial_digits, activation, lot, gas_prod, calibration):
+    """Build the certificate record the engines render (dates as DD/MM/YYYY)"""
+    return {
+        "prefix": prefix,
+        "serial": prefix + serial_digits,
+        "activation": normalize_date(activation),
+        "lot": lot,
+        "gas_prod": normalize_date(gas_prod),
+        "calibration": normalize_date(calibration),
+        "calibration_exp": calculate_expiration_date(
+            activation, PRODUCTS[prefix]["calibration_days"]),
+    }
+
+
+# Overlay rendering ----------------------------------------------------------
+
+def draw_overlay_pages(can, data, prefix):
+    """Draw one certificate's overlay pages on a canvas, finishing each page"""
+    coords = get_coordinates(prefix)
+
+    # Cover the "O2 18%" placeholder in lot area (smaller rectangle)
+    can.setFillColor(white)
+    can.rect(*LOT_PLACEHOLDER_COVER, fill=1, stroke=0)
+    can.setFillColor(black)
+
+    page = 0
+    for page_index, page_key, coord_key, data_key, font in OVERLAY_FIELDS:
+        if page_index != page:
+            can.showPage()
+            can.setFillColor(black)
+            page = page_index
+        coord = coords[page_key][coord_key]
+        can.setFont(font, int(coord["size"]))
+        can.drawString(coord["x"], coord["y"], data[data_key])
+    can.showPage()
+
+
+def create_text_overlay(data, prefix):
+    """Create PDF overlay - NO white rectangles needed with clean templates!"""
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=A4, invariant=1)
+    draw_overlay_pages(can, data, prefix)
+    can.save()
+    packet.seek(0)
+    return packet
+
+
+def create_batch_overlay(records):
+    """
+    Create the overlays for several certificates as one PDF
+
+    Fonts and document setup are paid once; record i owns pages
+    i * OVERLAY_PAGE_COUNT onwards.
+    """
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=A4, invariant=1)
+    for record in records:
+        draw_overlay_pages(can, record, record["prefix"])
+    can.save()
+    packet.seek(0)
+    return packet
+
+
+# Template buffers ------------------------------------------------------------
+
+# Template contents a process was handed instead of reading the files (e.g.
+# views of a shared memory block, see template_share.py):
+# {resolved path: (mtime, buffer)}
+_TEMPLATE_BUFFERS = {}
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable binary stream over a buffer, without copying it"""
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._buffer)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def readinto(self, target):
+        chunk = self._buffer[self._position:self._position + len(target)]
+        target[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+
+def install_template_buffers(buffers):
+    """Use buffers ({path: (mtime, buffer)}) instead of reading those template files"""
+    _TEMPLATE_BUFFERS.update({Path(path).resolve(): entry for path, entry in buffers.items()})
+
+
+def read_template(template):
+    """
+    Contents of a template file
+
+    Returns:
+        The installed buffer (memoryview) while the file is unchanged,
+        otherwise the file's bytes
+    """
+    template = Path(template).resolve()
+    entry = _TEMPLATE_BUFFERS.get(template)
+    if entry is not None and entry[0] == template.stat().st_mtime:
+        return entry[1]
+    return template.read_bytes()
+
+
+def template_stream(data):
+    """Readable binary stream over template bytes or a buffer"""
+    if isinstance(data, bytes):
+        return io.BytesIO(data)
+    return BufferReader(data)
+
+
+def merge_overlay(template, overlay_pdf, output, first_page=0):
+    """
+    Merge overlay pages onto the template pages and write the certificate
+
+    Args:
+        template: Template path, or the template PDF as bytes or a buffer
+            (see read_template)
+        overlay_pdf: Overlay PDF stream (see create_text_overlay), or an
+            already opened PdfReader
+        output: Path or writable binary stream
+        first_page: Overlay page merged onto the first template page
+            (for create_batch_overlay documents)
+    """
+    if isinstance(template, (bytes, memoryview)):
+        template_pdf = PdfReader(template_stream(template))
+    else:
+        template_pdf = PdfReader(str(template))
+    if isinstance(overlay_pdf, PdfReader):
+        overlay_reader = overlay_pdf
+    else:
+        overlay_reader = PdfReader(overlay_pdf)
+    writer = PdfWriter()
+
+    for i, page in enumerate(template_pdf.pages):
+        if i < OVERLAY_PAGE_COUNT and first_page + i < len(overlay_reader.pages):
+            page.merge_page(overlay_reader.pages[first_page + i])
+        writer.add_page(page)
+
+    if hasattr(output, "write"):
+        writer.write(output)
+    else:
+        with open(output, 'wb') as output_file:
+            writer.write(output_file)
+
+
+def merge_overlay_pikepdf(template, overlay_pdf, output, first_page=0):
+    """
+    merge_overlay with pikepdf (qpdf) instead of PyPDF2
+
+    Each overlay page becomes a form XObject drawn over the template page at
+    its own size (no scaling), and the result is saved with object streams.
+    Same arguments as merge_overlay; an opened overlay is a pikepdf.Pdf.
+
+    The output is reproducible: the same record and template give the same
+    bytes (fixed XObject name, deterministic /ID, invariant overlay), so a
+    certificate can be re-rendered and checked against its recorded hash.
+    """
+    if isinstance(template, (bytes, memoryview)):
+        template_pdf = pikepdf.open(template_stream(template))
+    else:
+        template_pdf = pikepdf.open(str(template))
+    # An opened overlay belongs to the caller; one opened here is closed here
+    if isinstance(overlay_pdf, pikepdf.Pdf):
+        overlay = contextlib.nullcontext(overlay_pdf)
+    else:
+        overlay = pikepdf.open(overlay_pdf)
+
+    with template_pdf, overlay as overlay_opened:
+        overlay_pages = overlay_opened.pages
+        for i, page in enumerate(template_pdf.pages[:OVERLAY_PAGE_COUNT]):
+            if first_page + i < len(overlay_pages):
+                overlay_page = overlay_pages[first_page + i]
+                # page.add_overlay, but under a fixed name instead of a random one
+                formx = overlay_page.as_form_xobject()
+                name = pikepdf.Name(OVERLAY_XOBJECT_NAME)
+                page.add_resource(formx, pikepdf.Name.XObject, name)
+                page.contents_add(b"q\n", prepend=True)
+                page.contents_add(b"Q\n")
+                page.contents_add(page.calc_form_xobject_placement(
+                    formx, name, pikepdf.Rectangle(*overlay_page.mediabox), allow_expand=True))
+                page.contents_coalesce()
+        template_pdf.save(output, object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                          deterministic_id=True)
+
+
+def pdf_string(text):
+    """Encode text as a PDF literal string for a WinAnsi-encoded font"""
+    raw = text.encode("cp1252", errors="replace")
+    escaped = raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+    return b"(" + escaped + b")"
+
+
+def overlay_operations(data, prefix, font_names):
+    """
+    Raw content-stream operators equivalent to create_text_overlay
+
+    Args:
+        font_names: Resource name for each base font used in OVERLAY_FIELDS
+
+    Returns:
+        list: Content stream bytes for each page
+    """
+    coords = get_coordinates(prefix)
+    x, y, width, height = LOT_PLACEHOLDER_COVER
+    pages = [[b"q 1 g %g %g %g %g re f Q" % (x, y, width, height)], []]
+    for page_index, page_key, coord_key, data_key, font in OVERLAY_FIELDS:
+        coord = coords[page_key][coord_key]
+        pages[page_index].append(
+            b"BT %s %d Tf 0 g 1 0 0 1 %g %g Tm %s Tj ET" % (
+                font_names[font].encode(), int(coord["size"]), coord["x"], coord["y"],
+                pdf_string(data[data_key])))
+    return [b"\n".join(ops) + b"\n" for ops in pages]
+
+
+# Engines --------------------------------------------------------------------
+
+class CertificateEngine:
+    """
+    Base class for certificate rendering backends
+
+    prepare(template) parses a template once and caches it; render(record)
+    returns the finished certificate PDF as bytes; render_many(records)
+    yields (record, pdf_bytes) pairs. PDF backends render from the template
+    variant of their output profile (see output_profiles.py).
+    """
+
+    name = None
+
+    def __init__(self, profile=None):
+        if profile is None:
+            profile = load_engine_config()["profile"]
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown output profile: {profile}")
+        self.profile = profile
+        self._prepared = {}
+
+    @classmethod
+    def available(cls):
+        """Return (available, reason) for this backend on this machine"""
+        return True, ""
+
+    def template_path(self, prefix):
+        """Template file this backend renders a product from"""
+        return profile_template(TEMPLATES_DIR / PRODUCTS[prefix]["template"], self.profile)
+
+    def prepare(self, template):
+        """Load and cache everything needed to render from a template"""
+        template = Path(template)
+        key = (template.resolve(), template.stat().st_mtime)
+        if key not in self._prepared:
+            self._prepared[key] = self._prepare(template)
+        return self._prepared[key]
+
+    def _prepare(self, template):
+        raise NotImplementedError
+
+    def render(self, record):
+        """Render one certificate record to PDF bytes"""
+        raise NotImplementedError
+
+    def render_many(self, records):
+        """Render several records, yielding (record, pdf_bytes)"""
+        for record in records:
+            yield record, self.render(record)
+
+
+class OverlayMergeEngine(CertificateEngine):
+    """
+    reportlab overlay merged onto the template (app.py's original path)
+
+    The merge runs on PyPDF2 or, when installed, pikepdf - chosen with
+    "pdf_library" in engine_config.json ("auto", "pikepdf" or "pypdf2").
+    """
+
+    name = "overlay"
+
+    def __init__(self, pdf_library=None, profile=None):
+        super().__init__(profile)
+        if pdf_library is None:
+            pdf_library = load_engine_config()["pdf_library"]
+        if pdf_library not in ("auto", "pikepdf", "pypdf2"):
+            raise ValueError(f"Unknown PDF library: {pdf_library}")
+        if pdf_library != "pypdf2" and pikepdf is None:
+            pdf_library = "pypdf2"
+        elif pdf_library == "auto":
+            pdf_library = "pikepdf"
+        self.pdf_library = pdf_library
+        self._merge = merge_overlay_pikepdf if pdf_library == "pikepdf" else merge_overlay
+
+    def _prepare(self, template):
+        return read_template(template)
+
+    # Certificates per shared overlay document in render_many
+    batch_size = 100
+
+    def render(self, record):
+        return self.render_with_template(record, self.prepare(self.template_path(record["prefix"])))
+
+    def render_with_template(self, record, template):
+        """Render onto given template bytes (e.g. an archived template revision)"""
+        output = io.BytesIO()
+        self._merge(template, create_text_overlay(record, record["prefix"]), output)
+        return output.getvalue()
+
+    def render_many(self, records):
+        """Render with one overlay document per batch_size records"""
+        records = list(records)
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            overlay_pdf = create_batch_overlay(batch)
+            if self.pdf_library == "pikepdf":
+                opened = pikepdf.open(overlay_pdf)
+            else:
+                opened = contextlib.nullcontext(PdfReader(overlay_pdf))
+            with opened as overlay:
+                for index, record in enumerate(batch):
+                    template = self.prepare(self.template_path(record["prefix"]))
+                    output = io.BytesIO()
+                    self._merge(template, overlay, output, index * OVERLAY_PAGE_COUNT)
+                    yield record, output.getvalue()
+
+
+class IncrementalUpdateEngine(CertificateEngine):
+    """
+    Appends the certificate text to the unchanged template as a PDF
+    incremental update: the template bytes are copied verbatim and only a
+    few small objects, a cross-reference section and a trailer are added.
+    """
+
+    name = "incremental"
+
+    FONT_NAMES = {"Helvetica": "/GCHelv", "Helvetica-Bold": "/GCHeBo"}
+
+    def _prepare(self, template):
+        data = read_template(template)
+        tail = bytes(data[-1024:])
+        startxref = int(tail[tail.rindex(b"startxref") + 9:].split()[0])
+        if bytes(data[startxref:startxref + 4]) != b"xref":
+            raise ValueError(f"{template.name}: incremental backend needs a classic xref table")
+
+        reader = PdfReader(template_stream(data))
+        trailer = reader.trailer
+        next_number = int(trailer["/Size"])
+        static_objects = []
+
+        def new_object(serialized):
+            nonlocal next_number
+            static_objects.append((next_number, 0, serialized))
+            next_number += 1
+            return IndirectObject(next_number - 1, 0, None)
+
+        font_refs = {}
+        for base_font, resource_name in self.FONT_NAMES.items():
+            font_refs[resource_name] = new_object(_serialize(DictionaryObject({
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/" + base_font),
+                NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+            })))
+        save_state = new_object(_stream_object(b"q\n"))
+
+        # Page content streams take the last object numbers, in page order
+        content_numbers = [next_number + i for i in range(len(reader.pages))]
+
+        for page, content_number in zip(reader.pages, content_numbers):
+            new_page = DictionaryObject({key: page.raw_get(key) for key in page})
+
+            # Wrap the template content in q/Q so it cannot shift the text
+            contents = page.raw_get("/Contents")
+            existing = contents.get_object()
+            refs = list(existing) if isinstance(existing, ArrayObject) else [contents]
+            new_page[NameObject("/Contents")] = ArrayObject(
+                [save_state] + refs + [IndirectObject(content_number, 0, None)])
+
+            resources = page["/Resources"]
+            new_resources = DictionaryObject({key: resources.raw_get(key) for key in resources})
+            fonts = resources.get("/Font", DictionaryObject())
+            new_fonts = DictionaryObject({key: fonts.raw_get(key) for key in fonts})
+            new_fonts.update({NameObject(name): ref for name, ref in font_refs.items()})
+            new_resources[NameObject("/Font")] = new_fonts
+            new_page[NameObject("/Resources")] = new_resources
+
+            ref = page.indirect_reference
+            static_objects.append((ref.idnum, ref.generation, _serialize(new_page)))
+
+        # Serialize the static part once; offsets are absolute in the output
+        separator = b"" if tail.endswith(b"\n") else b"\n"
+        static = bytearray(separator)
+        offsets = {}
+        for number, generation, serialized in static_objects:
+            offsets[(number, generation)] = len(data) + len(static)
+            static += b"%d %d obj\n" % (number, generation) + serialized + b"\nendobj\n"
+
+        trailer_entries = b"/Root " + _serialize(trailer.raw_get("/Root"))
+        if "/Info" in trailer:
+            trailer_entries += b" /Info " + _serialize(trailer.raw_get("/Info"))
+        file_id = trailer.get("/ID")
+
+        return {
+            "data": data,
+            "static": bytes(static),
+            "offsets": offsets,
+            "content_numbers": content_numbers,
+            "size": next_number + len(content_numbers),
+            "prev": startxref,
+            "trailer": trailer_entries,
+            "id": bytes(file_id[0].original_bytes) if file_id else None,
+        }
+
+    def render(self, record):
+        output = io.BytesIO()
+        self.render_to(record, output)
+        return output.getvalue()
+
+    def render_to(self, record, output):
+        """Write one certificate to a binary stream"""
+        prepared = self.prepare(self.template_path(record["prefix"]))
+        # Close the q that wraps the template before drawing the text
+        page_ops = [b"Q\n" + ops for ops in overlay_operations(record, record["prefix"], self.FONT_NAMES)]
+        output.write(prepared["data"])
+        output.write(prepared["static"])
+        output.write(self.update_tail(prepared, page_ops))
+
+    @staticmethod
+    def update_tail(prepared, page_ops):
+        """Per-certificate content streams, cross-reference section and trailer"""
+        position = len(prepared["data"]) + len(prepared["static"])
+        offsets = dict(prepared["offsets"])
+        tail = bytearray()
+        for number, ops in zip(prepared["content_numbers"], page_ops):
+            offsets[(number, 0)] = position + len(tail)
+            tail += b"%d 0 obj\n" % number + _stream_object(ops) + b"\nendobj\n"
+
+        xref_offset = position + len(tail)
+        tail += b"xref\n"
+        entries = sorted(offsets.items())
+        start = 0
+        while start < len(entries):
+            end = start
+            while end + 1 < len(entries) and entries[end + 1][0][0] == entries[end][0][0] + 1:
+                end += 1
+            tail += b"%d %d\n" % (entries[start][0][0], end - start + 1)
+            for (number, generation), offset in entries[start:end + 1]:
+                tail += b"%010d %05d n \n" % (offset, generation)
+            start = end + 1
+
+        tail += b"trailer\n<< /Size %d %s /Prev %d" % (
+            prepared["size"], prepared["trailer"], prepared["prev"])
+        if prepared["id"] is not None:
+            update_id = hashlib.md5(b"".join(page_ops)).hexdigest().encode()
+            tail += b" /ID [<%s> <%s>]" % (prepared["id"].hex().encode(), update_id)
+        tail += b" >>\nstartxref\n%d\n%%%%EOF\n" % xref_offset
+        return bytes(tail)
+
+
+def _serialize(obj):
+    """PDF syntax for a PyPDF2 object; indirect references keep their numbers"""
+    stream = io.BytesIO()
+    obj.write_to_stream(stream, None)
+    return stream.getvalue()
+
+
+def _stream_object(data):
+    """An uncompressed stream object body"""
+    return b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+
+
+class AcroFormEngine(CertificateEngine):
+    """Fills and flattens the form templates built by create_form_templates.py"""
+
+    name = "acroform"
+
+    @classmethod
+    def available(cls):
+        from form_filler import FORMS_DIR
+        if not FORMS_DIR.exists():
+            return False, "run create_form_templates.py first"
+        return True, ""
+
+    def template_path(self, prefix):
+        from form_filler import FORMS_DIR, FORM_TEMPLATES
+        return profile_template(FORMS_DIR / FORM_TEMPLATES[prefix], self.profile)
+
+    def _prepare(self, template):
+        from form_filler import load_form_template
+        return load_form_template(template)
+
+    def render(self, record):
+        from form_filler import fill_form, form_values
+        template = self.prepare(self.template_path(record["prefix"]))
+        output = io.BytesIO()
+        fill_form(template, form_values(record), output, flatten=True)
+        return output.getvalue()
+
+
+class WordEngine(CertificateEngine):
+    """Word template text replacement, converted to PDF by LibreOffice"""
+
+    name = "word"
+
+    @classmethod
+    def available(cls):
+        try:
+            import docx  # noqa: F401
+        except ImportError:
+            return False, "python-docx is not installed"
+        if not cls.office_command():
+            return False, "LibreOffice is not installed"
+        return True, ""
+
+    @staticmethod
+    def office_command():
+        return shutil.which("libreoffice") or shutil.which("soffice")
+
+    def template_path(self, prefix):
+        return WORD_TEMPLATES_DIR / PRODUCTS[prefix]["word_template"]
+
+    def _prepare(self, template):
+        """Read the template once and find the sample values to replace"""
+        import re
+        from docx import Document
+
+        data = read_template(template)
+        doc = Document(template_stream(data))
+
+        # Dates in format DD/MM/YYYY, in order of appearance
+        template_dates = []
+        for paragraph in doc.paragraphs:
+            template_dates.extend(re.findall(r'\d{2}/\d{2}/\d{4}', paragraph.text))
+
+        template_lot = None
+        for paragraph in doc.paragraphs:
+            text = paragraph.text
+            if "Lot Number" in text or "25-3348" in text or "RR" in text:
+                lot_match = re.search(r'(25-\d+|RR\d+|[A-Z]{1,3}\s*\d+\s*ppm|O2\s*\d+\s*%|CO\s*\d+\s*ppm|H2S\s*\d+\s*ppm)', text)
+                if lot_match:
+                    template_lot = lot_match.group(1)
+                    break
+
+        return {
+            "data": data,
+            "serial": template.name.replace("_clean.docx", ""),
+            "dates": template_dates,
+            "lot": template_lot,
+        }
+
+    def get_replacements(self, prepared, record):
+        """Map template sample text to the record's values"""
+        replacements = {prepared["serial"]: record["serial"]}
+
+        # Map template dates to new dates (in order of appearance)
+        if len(prepared["dates"]) >= 3:
+            replacements[prepared["dates"][0]] = record["activation"]
+            replacements[prepared["dates"][1]] = record["gas_prod"]
+            replacements[prepared["dates"][2]] = record["calibration"]
+        if prepared["lot"]:
+            replacements[prepared["lot"]] = record["lot"]
+        return replacements
+
+    def render(self, record):
+        from docx import Document
+
+        prepared = self.prepare(self.template_path(record["prefix"]))
+        doc = Document(template_stream(prepared["data"]))
+        replacements = self.get_replacements(prepared, record)
+
+        paragraphs = list(doc.paragraphs)
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    paragraphs.extend(cell.paragraphs)
+        for paragraph in paragraphs:
+            for old_text, new_text in replacements.items():
+                if old_text in paragraph.text:
+                    for run in paragraph.runs:
+                        if old_text in run.text:
+                            run.text = run.text.replace(old_text, new_text)
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            docx_path = Path(work_dir) / f"{record['serial']}.docx"
+            doc.save(docx_path)
+            self.convert_to_pdf(docx_path, docx_path.with_suffix(".pdf"))
+            return docx_path.with_suffix(".pdf").read_bytes()
+
+    def convert_to_pdf(self, docx_path, pdf_path):
+        """Convert Word document to PDF using LibreOffice"""
+        try:
+            subprocess.run([
+                self.office_command() or "libreoffice",
+                "--headless",
+                "--convert-to", "pdf",
+                "--outdir", str(pdf_path.parent),
+                str(docx_path)
+            ], check=True, capture_output=True)
+            return True
+        except Exception as e:
+            raise Exception(f"PDF conversion failed: {str(e)}")
+
+
+ENGINES = {engine.name: engine for engine in
+           (OverlayMergeEngine, IncrementalUpdateEngine, AcroFormEngine, WordEngine)}
+
+_ENGINE_INSTANCES = {}
+
+
+def load_engine_config():
+    """
+    Backend selection: {"default": name, "products": {prefix: name},
+    "pdf_library": "auto" | "pikepdf" | "pypdf2", "profile": output profile}
+    """
+    config = {"default": "overlay", "products": {}, "pdf_library": "auto", "profile": "print"}
+    if ENGINE_CONFIG_FILE.exists():
+        with open(ENGINE_CONFIG_FILE, 'r') as f:
+            config.update(json.load(f))
+    return config
+
+
+def output_options():
+    """
+    Finishing options from engine_config.json's "output" section:
+    {"linearize": bool, "compact": bool, "invoice_bundle": bool,
+    "invoice_zip": bool, "layout": str, "verify_sample": float} (see
+    pdf_output.py, invoice_zip.py, output_layout.py and certificate_verify.py)
+    """
+    options = {"linearize": False, "compact": False, "invoice_bundle": False, "invoice_zip": False,
+               "layout": "Invoice_{invoice}", "verify_sample": 0.0}
+    options.update(load_engine_config().get("output", {}))
+    return options
+
+
+def get_engine(prefix=None, backend=None, profile=None):
+    """
+    Engine for a product, as chosen in engine_config.json
+
+    Engines are shared per backend and output profile so prepared templates
+    stay cached.
+    """
+    config = load_engine_config()
+    if backend is None:
+        backend = config["products"].get(prefix, config["default"])
+    if profile is None:
+        profile = config["profile"]
+    if backend not in ENGINES:
+        raise ValueError(f"Unknown certificate engine: {backend}")
+    key = (backend, profile)
+    if key not in _ENGINE_INSTANCES:
+        _ENGINE_INSTANCES[key] = ENGINES[backend](profile=profile)
+    return _ENGINE_INSTANCES[key]
+
+
+def benchmark(count=10, prefixes=None, backends=None):
+    """
+    Time every available backend for every product
+
+    Returns:
+        dict: {prefix: {backend: seconds per certificate}}
+    """
+    prefixes = prefixes or list(PRODUCTS)
+    results = {}
+    for prefix in prefixes:
+        record = make_record(prefix, "55555", "02/10/2025", "TEST123456",
+                             "21/03/2024", "02/10/2025")
+        results[prefix] = {}
+        for name in backends or ENGINES:
+            available, _ = ENGINES[name].available()
+            if not available:
+                continue
+            engine = ENGINES[name]()
+            engine.render(record)  # prepare the template outside the timing
+            start = time.perf_counter()
+            for _ in engine.render_many([record] * count):
+                pass
+            results[prefix][name] = (time.perf_counter() - start) / count
+    return results
+
+
+def main():
+    """Command line entry point"""
+    args = sys.argv[1:]
+    if not args or args[0] != "benchmark":
+        print(__doc__)
+        return 1
+
+    count = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+    print("=" * 70)
+    print("Certificate Engine Benchmark")
+    print("=" * 70)
+    for name, engine in ENGINES.items():
+        available, reason = engine.available()
+        if not available:
+            print(f"  (skipping {name}: {reason})")
+    print(f"  (overlay merges with {OverlayMergeEngine().pdf_library})")
+
+    results = benchmark(count)
+    fastest = {}
+    for prefix, timings in results.items():
+        fastest[prefix] = min(timings, key=timings.get)
+        line = "  ".join(f"{name}: {seconds * 1000:8.1f} ms" for name, seconds in timings.items())
+        print(f"{prefix}: {line}  -> fastest: {fastest[prefix]}")
+
+    if "--save" in args:
+        config = load_engine_config()
+        config["products"].update(fastest)
+        with open(ENGINE_CONFIG_FILE, 'w') as f:
+            json.dump(config, f, indent=2)
+        print(f"\n✓ Saved per-product backends to: {ENGINE_CONFIG_FILE}")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
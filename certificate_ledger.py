@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Certificate ledger
+Every issued certificate is recorded in a local SQLite database (WAL mode):
+serial, product, dates, lot, template hash, output path and invoice number.
+The serial column is UNIQUE, so checking a serial before rendering is an
+index lookup and the same serial cannot be issued twice by accident.
+
+Usage:
+    python certificate_ledger.py lookup SERIAL [...]
+    python certificate_ledger.py stats
+"""
+
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import sqlite3
+import sys
+
+LEDGER_FILE = Path(__file__).parent / "certificates.db"
+
+# Certificates written per transaction by record_many
+LEDGER_BATCH_SIZE = 500
+
+COLUMNS = ["serial", "prefix", "product", "activation", "lot", "gas_prod", "calibration",
+           "calibration_exp", "template_hash", "output_path", "invoice", "issued_at"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    id INTEGER PRIMARY KEY,
+    serial TEXT NOT NULL UNIQUE,
+    prefix TEXT NOT NULL,
+    product TEXT NOT NULL,
+    activation TEXT,
+    lot TEXT,
+    gas_prod TEXT,
+    calibration TEXT,
+    calibration_exp TEXT,
+    template_hash TEXT,
+    output_path TEXT,
+    invoice TEXT,
+    issued_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS certificates_invoice ON certificates (invoice);
+"""
+
+_TEMPLATE_HASHES = {}
+
+
+def template_hash(template):
+    """SHA-256 of a template file, computed once while the file is unchanged"""
+    template = Path(template)
+    stat = template.stat()
+    key = (template.resolve(), stat.st_mtime, stat.st_size)
+    if key not in _TEMPLATE_HASHES:
+        _TEMPLATE_HASHES[key] = hashlib.sha256(template.read_bytes()).hexdigest()
+    return _TEMPLATE_HASHES[key]
+
+
+def ledger_entry(record, product, template, output_path, invoice=None):
+    """Build a ledger row from a certificate record (see certificate_engine.make_record)"""
+    return {
+        "serial": record["serial"],
+        "prefix": record["prefix"],
+        "product": product,
+        "activation": record["activation"],
+        "lot": record["lot"],
+        "gas_prod": record["gas_prod"],
+        "calibration": record["calibration"],
+        "calibration_exp": record["calibration_exp"],
+        "template_hash": template_hash(template),
+        "output_path": str(output_path),
+        "invoice": invoice,
+        "issued_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+class CertificateLedger:
+    """SQLite record of issued certificates"""
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = Path(path)
+        self.connection = sqlite3.connect(str(self.path))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, serial):
+        """Ledger row for a serial, or None if it was never issued"""
+        return self.connection.execute(
+            "SELECT * FROM certificates WHERE serial = ?", (serial,)).fetchone()
+
+    def issued_serials(self, serials):
+        """Subset of serials that are already in the ledger"""
+        serials = list(serials)
+        issued = set()
+        for start in range(0, len(serials), 500):
+            chunk = serials[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            issued.update(row[0] for row in self.connection.execute(
+                f"SELECT serial FROM certificates WHERE serial IN ({placeholders})", chunk))
+        return issued
+
+    def _insert_sql(self, replace):
+        columns = ", ".join(COLUMNS)
+        values = ", ".join(f":{column}" for column in COLUMNS)
+        if replace:
+            updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS[1:])
+            return (f"INSERT INTO certificates ({columns}) VALUES ({values}) "
+                    f"ON CONFLICT(serial) DO UPDATE SET {updates}")
+        return f"INSERT INTO certificates ({columns}) VALUES ({values})"
+
+    def record(self, entry, replace=False):
+        """
+        Record one issued certificate
+
+        Raises:
+            sqlite3.IntegrityError: If the serial is already issued and
+                replace is not set
+        """
+        with self.connection:
+            self.connection.execute(self._insert_sql(replace), entry)
+
+    def record_many(self, entries, replace=False):
+        """Record certificates, LEDGER_BATCH_SIZE per transaction"""
+        entries = list(entries)
+        sql = self._insert_sql(replace)
+        for start in range(0, len(entries), LEDGER_BATCH_SIZE):
+            with self.connection:
+                self.connection.executemany(sql, entries[start:start + LEDGER_BATCH_SIZE])
+
+    def set_invoice(self, serials, invoice, output_dir=None, paths=None):
+        """
+        Assign certificates to an invoice (and their new folder) when it is finished
+
+        Args:
+            output_dir: Folder the certificates were moved to
+            paths: New path of each serial, in order (sharded layouts,
+                see output_layout.py) - overrides output_dir
+        """
+        serials = list(serials)
+        if paths is None and output_dir is not None:
+            paths = [Path(output_dir) / f"{serial}.pdf" for serial in serials]
+        with self.connection:
+            if paths is None:
+                self.connection.executemany(
+                    "UPDATE certificates SET invoice = ? WHERE serial = ?",
+                    [(invoice, serial) for serial in serials])
+            else:
+                self.connection.executemany(
+                    "UPDATE certificates SET invoice = ?, output_path = ? WHERE serial = ?",
+                    [(invoice, str(path), serial) for serial, path in zip(serials, paths)])
+
+    def set_paths(self, paths):
+        """Record new output paths (serial -> path) after certificates were moved"""
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE certificates SET output_path = ? WHERE serial = ?",
+                [(str(path), serial) for serial, path in paths.items()])
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM certificates").fetchone()[0]
+
+
+def main():
+    """Command line entry point"""
+    args = sys.argv[1:]
+    if not args or args[0] not in ("lookup", "stats"):
+        print(__doc__)
+        return 1
+
+    print("=" * 70)
+    print("Certificate Ledger")
+    print("=" * 70)
+
+    with CertificateLedger() as ledger:
+        if args[0] == "stats":
+            print(f"Certificates issued: {ledger.count()}")
+            for row in ledger.connection.execute(
+                    "SELECT prefix, COUNT(*) FROM certificates GROUP BY prefix ORDER BY prefix"):
+                print(f"  {row[0]}: {row[1]}")
+        else:
+            for serial in args[1:]:
+                row = ledger.lookup(serial.upper())
+                if row is None:
+                    print(f"{serial}: not issued")
+                else:
+                    print(f"{row['serial']}: {row['product']}, issued {row['issued_at']}, "
+                          f"invoice {row['invoice'] or '-'}, lot {row['lot']}")
+                    print(f"  {row['output_path']}")
+
+    print(f"\nLedger: {LEDGER_FILE}")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
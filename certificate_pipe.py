@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Certificate pipeline (NDJSON in, tar out)
+Reads one certificate record per line of JSON on stdin and writes a tar
+stream of the PDFs to stdout as they are rendered, followed by a
+manifest.csv entry (filename, serial, product, size, sha256, generated).
+Nothing is collected: records are read, rendered and written one at a time,
+at most --lookahead of them in flight, and the manifest rows are spooled to
+a temporary file, so memory stays flat however long the stream is.
+
+Records use the order CSV fields (prefix, serial, activation, lot, gas_prod,
+calibration - see batch_generate.py) and render through the shared
+certificate engine (the app's overlay and product_coordinates). Invalid
+lines are reported on stderr and skipped; the exit status is 1 if there
+were any. stdout carries only the tar stream.
+
+Usage:
+    python certificate_pipe.py [--backend overlay] [--profile email] [--workers 4] [--lookahead 8]
+        < records.ndjson > certificates.tar
+    producer | python certificate_pipe.py | gzip > certificates.tar.gz
+    producer | ssh host python certificate_pipe.py | tar -x -C output/
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+from batch_generate import parse_record
+from certificate_engine import PRODUCTS, get_engine, output_options
+from certificate_service import warm_worker
+from invoice_manifest import MANIFEST_CSV, MANIFEST_FIELDS
+from pdf_output import finish_pdf
+from template_share import SharedTemplates
+
+LOOKAHEAD = 8
+
+
+def read_ndjson(stream):
+    """
+    Records of an NDJSON byte stream, as the lines arrive
+
+    Yields:
+        tuple: (line number, record or None, list of error messages)
+    """
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, [f"Invalid JSON: {e}"]
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, ["Expected a JSON object"]
+            continue
+        record, errors = parse_record(row)
+        yield line_number, record, errors
+
+
+def render_finished(record, backend=None, profile=None, linearize=False, compact=False):
+    """Finished PDF bytes of one record, as batch_generate writes them"""
+    pdf = get_engine(record["prefix"], backend, profile).render(record)
+    return finish_pdf(pdf, linearize, compact)
+
+
+def render_stream(records, render, workers=1, lookahead=LOOKAHEAD, initializer=None, initargs=()):
+    """
+    Render records in input order with a bounded look-ahead
+
+    With one worker each record is rendered when it is read. With more, up
+    to lookahead records are rendering in a process pool while the oldest is
+    yielded, so the source is never read further ahead than that.
+
+    Args:
+        records: Iterable of records (consumed lazily)
+        render: Picklable function(record) -> PDF bytes
+
+    Yields:
+        tuple: (record, pdf bytes)
+    """
+    if workers <= 1:
+        for record in records:
+            yield record, render(record)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as pool:
+        in_flight = deque()
+        for record in records:
+            in_flight.append((record, pool.submit(render, record)))
+            while in_flight and (len(in_flight) >= lookahead or in_flight[0][1].done()):
+                head, future = in_flight.popleft()
+                yield head, future.result()
+        while in_flight:
+            head, future = in_flight.popleft()
+            yield head, future.result()
+
+
+class TarWriter:
+    """Streaming tar output of certificates plus a trailing manifest.csv"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.tar = tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT)
+        self.manifest = tempfile.TemporaryFile()
+        self.rows = csv.DictWriter(io.TextIOWrapper(self.manifest, encoding="utf-8", newline="",
+                                                    write_through=True), fieldnames=MANIFEST_FIELDS)
+        self.rows.writeheader()
+        self.count = 0
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def add(self, record, pdf):
+        """Write one certificate and spool its manifest row"""
+        filename = f"{record['serial']}.pdf"
+        self._add(filename, pdf)
+        self.stream.flush()
+        self.rows.writerow({"filename": filename, "serial": record["serial"],
+                            "product": PRODUCTS[record["prefix"]]["name"], "size": len(pdf),
+                            "sha256": hashlib.sha256(pdf).hexdigest(),
+                            "generated": datetime.now().isoformat(timespec="seconds")})
+        self.count += 1
+
+    def close(self):
+        """Append manifest.csv and end the archive"""
+        info = tarfile.TarInfo(MANIFEST_CSV)
+        info.size = self.manifest.seek(0, io.SEEK_END)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self.manifest.seek(0)
+        self.tar.addfile(info, self.manifest)
+        self.tar.close()
+        self.manifest.close()
+        self.stream.flush()
+
+
+def run_pipe(source, target, backend=None, profile=None, workers=1, lookahead=LOOKAHEAD, errors=None):
+    """
+    Render NDJSON records from source into a tar stream on target
+
+    Args:
+        source: Binary stream of NDJSON records
+        target: Binary stream for the tar archive
+        errors: Text stream for invalid lines (default: stderr)
+
+    Returns:
+        tuple: (certificates written, invalid lines)
+    """
+    errors = errors or sys.stderr
+    options = output_options()
+    invalid = 0
+
+    def valid_records():
+        nonlocal invalid
+        for line_number, record, messages in read_ndjson(source):
+            if messages:
+                invalid += 1
+                print(f"✗ Line {line_number}: {'; '.join(messages)}", file=errors, flush=True)
+                continue
+            yield record
+
+    render = partial(render_finished, backend=backend, profile=profile,
+                     linearize=options["linearize"], compact=options["compact"])
+    writer = TarWriter(target)
+    templates = SharedTemplates.for_backend(backend, profile) if workers > 1 else None
+    try:
+        for record, pdf in render_stream(valid_records(), render, workers, lookahead, warm_worker,
+                                         (backend, profile, templates.descriptor if templates else None)):
+            writer.add(record, pdf)
+    finally:
+        if templates is not None:
+            templates.close()
+    writer.close()
+    return writer.count, invalid
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Render NDJSON records from stdin into a tar stream on stdout")
+    parser.add_argument("--backend", help="Certificate engine backend (default: engine_config.json)")
+    parser.add_argument("--profile", help="Output profile (default: engine_config.json)")
+    parser.add_argument("--workers", type=int, default=1, help="Render processes (default: 1)")
+    parser.add_argument("--lookahead", type=int, default=LOOKAHEAD,
+                        help="Records rendering ahead of the output with --workers")
+    args = parser.parse_args()
+
+    if sys.stdout.isatty():
+        print("✗ stdout is a terminal; redirect it to a file or pipe", file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    try:
+        count, invalid = run_pipe(sys.stdin.buffer, sys.stdout.buffer, args.backend, args.profile,
+                                  args.workers, max(args.lookahead, args.workers))
+    except BrokenPipeError:
+        # The reader went away (e.g. "| head"); stop quietly like other filters
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    print(f"✓ {count} certificates in {time.perf_counter() - start:.2f}s"
+          + (f", {invalid} invalid line(s) skipped" if invalid else ""), file=sys.stderr)
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
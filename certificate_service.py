@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Certificate HTTP service
+A local HTTP endpoint for the ERP, on asyncio and the standard library only.
+Rendering runs in a process pool whose workers keep their engines and
+templates loaded between requests (the template files themselves are shared
+by all workers, see template_share.py); the event loop only parses requests
+and queues work.
+
+    POST /certificates   one record (JSON)                  -> application/pdf
+    POST /invoices       {"invoice": ..., "records": [...]} -> application/zip
+    GET  /health         liveness and queue state
+    GET  /metrics        counters and latencies
+
+Records use the order CSV fields (prefix, serial, activation, lot, gas_prod,
+calibration - see batch_generate.py). "priority": "rush" (or an
+X-Priority: rush header) moves a request ahead of queued normal work. When
+max_pending requests are queued or running, new ones get 429 with
+Retry-After instead of waiting.
+
+A sample of the certificates sent (engine_config.json "verify_sample", or
+--verify-sample) is read back on a background thread after the response is
+written (certificate_verify.py); failures are logged and counted in /metrics.
+
+Usage:
+    python certificate_service.py [--port 8765] [--workers 4] [--max-pending 32]
+                                  [--backend overlay] [--profile email] [--verify-sample 0.05]
+"""
+
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+from batch_generate import parse_record
+from certificate_engine import PRODUCTS, get_engine, output_options
+from certificate_verify import Verifier
+from invoice_zip import InvoiceZipWriter
+from template_share import SharedTemplates, attach_templates
+
+DEFAULT_PORT = 8765
+MAX_PENDING = 32
+MAX_BODY = 8 * 1024 * 1024
+MAX_RECORDS = 1000
+
+PRIORITIES = {"rush": 0, "normal": 1}
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+           413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class ServiceBusy(Exception):
+    """The in-flight limit is reached"""
+
+
+# Worker processes -----------------------------------------------------------
+
+def warm_worker(backend, profile, templates=None):
+    """
+    Process pool initializer: load every product's engine and template once
+
+    Args:
+        templates: SharedTemplates.descriptor to parse the templates from
+            instead of reading them
+    """
+    attach_templates(templates)
+    for prefix in PRODUCTS:
+        engine = get_engine(prefix, backend, profile)
+        template = engine.template_path(prefix)
+        if template.exists():
+            engine.prepare(template)
+
+
+def render_certificate(record, backend, profile):
+    """PDF bytes of one record (runs in a worker)"""
+    return get_engine(record["prefix"], backend, profile).render(record)
+
+
+def render_invoice(records, invoice, backend, profile):
+    """Invoice ZIP bytes for several records (runs in a worker)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        zip_path = Path(tmp) / f"Invoice_{invoice}.zip"
+        with InvoiceZipWriter(zip_path) as package:
+            groups = {}
+            for record in records:
+                engine = get_engine(record["prefix"], backend, profile)
+                groups.setdefault(engine.name, (engine, []))[1].append(record)
+            for engine, group in groups.values():
+                for record, pdf in engine.render_many(group):
+                    package.add(f"{record['serial']}.pdf", pdf,
+                                {"serial": record["serial"], "product": PRODUCTS[record["prefix"]]["name"]})
+        return zip_path.read_bytes()
+
+
+def _ready():
+    return os.getpid()
+
+
+# Service --------------------------------------------------------------------
+
+class CertificateService:
+    """Bounded, prioritized render queue in front of a process pool"""
+
+    def __init__(self, workers=None, max_pending=MAX_PENDING, backend=None, profile=None,
+                 verify_sample=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.backend = backend
+        self.profile = profile
+        self.templates = SharedTemplates.for_backend(backend, profile)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=warm_worker,
+                                        initargs=(backend, profile, self.templates.descriptor))
+        self.queue = None
+        self.pending = 0
+        self.running = 0
+        self.started = time.time()
+        self.counters = {"requests": 0, "certificates": 0, "invoices": 0, "rejected": 0, "errors": 0}
+        self.latencies = deque(maxlen=1000)
+        if verify_sample is None:
+            verify_sample = output_options()["verify_sample"]
+        self.verifier = Verifier(verify_sample) if verify_sample > 0 else None
+        self._order = itertools.count()
+        self._dispatchers = []
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        """Start the workers (templates loaded) and listen; returns the bound port"""
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.PriorityQueue()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _ready) for _ in range(self.workers)))
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self._dispatchers:
+            task.cancel()
+        self.pool.shutdown(cancel_futures=True)
+        self.templates.close()
+        if self.verifier is not None:
+            self.verifier.close()
+
+    async def submit(self, priority, function, *args):
+        """
+        Run function(*args) in the pool once the jobs ahead of it are done
+
+        Raises:
+            ServiceBusy: max_pending jobs are already queued or running
+        """
+        if self.pending >= self.max_pending:
+            raise ServiceBusy()
+        self.pending += 1
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put((priority, next(self._order), function, args, done))
+        try:
+            return await done
+        finally:
+            self.pending -= 1
+
+    async def _dispatch(self):
+        """Feed queued jobs to the pool, lowest priority value first"""
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, function, args, done = await self.queue.get()
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self.pool, function, *args)
+            except Exception as e:
+                if not done.cancelled():
+                    done.set_exception(e)
+            else:
+                if not done.cancelled():
+                    done.set_result(result)
+            finally:
+                self.running -= 1
+
+    # HTTP -------------------------------------------------------------------
+
+    async def handle(self, reader, writer):
+        """One HTTP/1.1 request per connection"""
+        start = time.perf_counter()
+        try:
+            method, path, headers, body = await read_request(reader)
+            status, content_type, payload, extra = await self.route(method, path, headers, body)
+        except RequestError as e:
+            status, content_type, payload, extra = e.status, "application/json", json_body({"error": str(e)}), {}
+        except Exception as e:
+            self.counters["errors"] += 1
+            status, content_type, payload, extra = 500, "application/json", json_body({"error": str(e)}), {}
+
+        head = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}",
+                f"Content-Length: {len(payload)}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in extra.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        if status == 200:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def route(self, method, path, headers, body):
+        """(status, content type, body bytes, extra headers) for a request"""
+        self.counters["requests"] += 1
+        path = path.split("?", 1)[0]
+        if path in ("/health", "/metrics"):
+            if method != "GET":
+                raise RequestError(405, f"{path} only supports GET")
+            data = self.health() if path == "/health" else self.metrics()
+            return 200, "application/json", json_body(data), {}
+        if path not in ("/certificates", "/invoices"):
+            raise RequestError(404, f"No such endpoint: {path}")
+        if method != "POST":
+            raise RequestError(405, f"{path} only supports POST")
+
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError as e:
+            raise RequestError(400, f"Invalid JSON: {e}")
+        if not isinstance(request, dict):
+            raise RequestError(400, "Expected a JSON object")
+        priority = PRIORITIES.get(str(request.get("priority") or headers.get("x-priority", "normal")).lower())
+        if priority is None:
+            raise RequestError(400, f"priority must be one of {', '.join(PRIORITIES)}")
+
+        try:
+            if path == "/certificates":
+                record = parse_or_raise(request)
+                pdf = await self.submit(priority, render_certificate, record, self.backend, self.profile)
+                self.counters["certificates"] += 1
+                if self.verifier is not None:
+                    self.verifier.submit(pdf, record)
+                return 200, "application/pdf", pdf, {
+                    "Content-Disposition": f'attachment; filename="{record["serial"]}.pdf"'}
+
+            rows = request.get("records")
+            if not isinstance(rows, list) or not rows:
+                raise RequestError(400, "records must be a non-empty list")
+            if len(rows) > MAX_RECORDS:
+                raise RequestError(413, f"At most {MAX_RECORDS} records per invoice")
+            records = [parse_or_raise(row, index) for index, row in enumerate(rows)]
+            serials = [record["serial"] for record in records]
+            if len(set(serials)) != len(serials):
+                raise RequestError(400, "A serial appears more than once in the invoice")
+            invoice = str(request.get("invoice") or "bundle")
+            package = await self.submit(priority, render_invoice, records, invoice,
+                                        self.backend, self.profile)
+            self.counters["invoices"] += 1
+            self.counters["certificates"] += len(records)
+            if self.verifier is not None:
+                for record in records:
+                    self.verifier.submit(partial(zip_member, package, f"{record['serial']}.pdf"), record)
+            return 200, "application/zip", package, {
+                "Content-Disposition": f'attachment; filename="Invoice_{invoice}.zip"'}
+        except ServiceBusy:
+            self.counters["rejected"] += 1
+            return 429, "application/json", json_body({"error": "Too many requests in flight"}), {
+                "Retry-After": "1"}
+
+    def health(self):
+        return {"status": "ok", "workers": self.workers, "pending": self.pending,
+                "running": self.running, "max_pending": self.max_pending}
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 4)
+
+        verified = self.verifier.counts if self.verifier is not None else {}
+        return dict(self.counters, uptime=round(time.time() - self.started, 1),
+                    pending=self.pending, running=self.running, queued=self.queue.qsize(),
+                    latency_p50=percentile(0.5), latency_p95=percentile(0.95),
+                    verified=verified.get("checked", 0), verify_failures=verified.get("failed", 0))
+
+
+class RequestError(Exception):
+    """A request the service answers with an error status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def zip_member(package, name):
+    """One file of ZIP bytes (read on the verifier thread)"""
+    with zipfile.ZipFile(io.BytesIO(package)) as archive:
+        return archive.read(name)
+
+
+def json_body(data):
+    return json.dumps(data).encode()
+
+
+def parse_or_raise(row, index=None):
+    """Record for a JSON row, or RequestError(400) with the validation messages"""
+    if not isinstance(row, dict):
+        raise RequestError(400, "Each record must be a JSON object")
+    try:
+        record, errors = parse_record(row)
+    except (ValueError, IndexError, TypeError) as e:
+        errors = [f"Cannot read the record: {e}"]
+    if errors:
+        where = "" if index is None else f"record {index}: "
+        raise RequestError(400, where + "; ".join(errors))
+    return record
+
+
+async def read_request(reader):
+    """Parse request line, headers and body"""
+    try:
+        request_line = await reader.readline()
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise RequestError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get("content-length")
+    if length is None:
+        if method.upper() in ("POST", "PUT", "PATCH"):
+            raise RequestError(411, "Content-Length required")
+        length = 0
+    else:
+        try:
+            length = int(length)
+        except ValueError:
+            raise RequestError(400, f"Invalid Content-Length: {length!r}")
+        if length < 0:
+            raise RequestError(400, f"Invalid Content-Length: {length}")
+    if length > MAX_BODY:
+        raise RequestError(413, f"Body larger than {MAX_BODY} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, headers, body
+
+
+async def serve(args):
+    service = CertificateService(args.workers, args.max_pending, args.backend, args.profile,
+                                 args.verify_sample)
+    port = await service.start(args.host, args.port)
+    print(f"✓ Listening on http://{args.host}:{port} ({service.workers} workers, "
+          f"at most {service.max_pending} requests in flight)")
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="GasClip certificate HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, help="Render processes (default: CPU count)")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="Requests queued or running before 429")
+    parser.add_argument("--backend", help="Certificate engine backend (default: engine_config.json)")
+    parser.add_argument("--profile", help="Output profile (default: engine_config.json)")
+    parser.add_argument("--verify-sample", type=float,
+                        help="Share of certificates read back and checked (default: engine_config.json)")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("GasClip Certificate Service")
+    print("=" * 70)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("\n✓ Stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
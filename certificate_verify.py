@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Post-write certificate verification
+Reads back only the overlay part of a written certificate - the last content
+stream of each page (incremental and acroform backends) or what follows the
+template in the page's single stream (overlay merges), plus the form
+XObjects it draws - and checks that the serial, activation, lot, gas
+production and calibration strings are drawn in the font, size and position
+of OVERLAY_FIELDS and product_coordinates.py. The template's own content
+(hundreds of KB of paths per page) is never interpreted, so a check costs
+3-12 ms, most of it inflating the written file's streams.
+
+A Verifier runs the checks on a background thread: generation hands it the
+written PDF and carries on. Production code checks a sample
+(engine_config.json "output": {"verify_sample": 0.05}); batch_generate.py
+--verify checks every certificate.
+
+Usage:
+    python certificate_verify.py output/Invoice_12345            # check PDFs against the ledger
+    python certificate_verify.py D4PQ236599.pdf --ledger certificates.db
+"""
+
+from pathlib import Path
+from PyPDF2 import PdfReader
+from PyPDF2.generic import DictionaryObject
+import argparse
+import io
+import json
+import math
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from certificate_engine import OVERLAY_FIELDS, get_coordinates
+
+BASE_DIR = Path(__file__).parent
+FAILURE_LOG = BASE_DIR / "output" / "verification_failures.log"
+
+# Points a string's origin may be away from its coordinate (PDF writers
+# round to 2 decimals; a moved field is off by far more)
+POSITION_TOLERANCE = 0.1
+# Bytes at the end of a single-stream page searched for the overlay
+OVERLAY_WINDOW = 16384
+# Certificates waiting for the background thread before sampled ones are skipped
+MAX_PENDING = 64
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+_TOKEN = re.compile(rb"""
+    (?P<space>\s+|%[^\r\n]*)
+  | (?P<string>\()
+  | (?P<hex><[0-9A-Fa-f\s]*>)
+  | (?P<name>/[^\s/\[\]()<>{}%]*)
+  | (?P<number>[+-]?(?:\d+\.?\d*|\.\d+))
+  | (?P<open>\[)
+  | (?P<close>\])
+  | (?P<other><<|>>|[{}])
+  | (?P<operator>[^\s/\[\]()<>{}%]+)
+""", re.VERBOSE)
+
+_ESCAPES = {ord("n"): b"\n", ord("r"): b"\r", ord("t"): b"\t", ord("b"): b"\b", ord("f"): b"\f"}
+
+# Where the overlay starts in a page stream shared with the template: both
+# merges wrap the template in q ... Q and the overlay draws no q/Q before its text
+_OVERLAY_START = re.compile(rb"Q\s+q\s")
+
+
+# Content streams ------------------------------------------------------------
+
+def _literal(data, pos):
+    """Decode a literal string starting after its "("; returns (bytes, end)"""
+    out = bytearray()
+    depth = 1
+    while pos < len(data):
+        char = data[pos]
+        pos += 1
+        if char == 0x5C:  # backslash
+            if pos >= len(data):
+                break
+            char = data[pos]
+            pos += 1
+            if 0x30 <= char <= 0x37:
+                end = pos
+                while end < len(data) and end - pos < 2 and 0x30 <= data[end] <= 0x37:
+                    end += 1
+                out.append(int(data[pos - 1:end], 8) & 0xFF)
+                pos = end
+            elif char in (0x0A, 0x0D):
+                if char == 0x0D and data[pos:pos + 1] == b"\n":
+                    pos += 1
+            else:
+                out += _ESCAPES.get(char, bytes([char]))
+            continue
+        if char == 0x28:
+            depth += 1
+        elif char == 0x29:
+            depth -= 1
+            if depth == 0:
+                break
+        out.append(char)
+    return bytes(out), pos
+
+
+def operations(data):
+    """Yield (operands, operator) for each operator of a content stream"""
+    operands = []
+    arrays = []
+    pos = 0
+    while pos < len(data):
+        match = _TOKEN.match(data, pos)
+        if match is None:
+            pos += 1
+            continue
+        pos = match.end()
+        kind = match.lastgroup
+        if kind in ("space", "other"):
+            continue
+        if kind == "string":
+            value, pos = _literal(data, pos)
+        elif kind == "hex":
+            digits = re.sub(rb"\s", b"", match.group()[1:-1])
+            value = bytes.fromhex((digits + b"0" * (len(digits) % 2)).decode())
+        elif kind == "name":
+            value = match.group().decode("latin-1")
+        elif kind == "number":
+            value = float(match.group())
+        elif kind == "open":
+            arrays.append(operands)
+            operands = []
+            continue
+        elif kind == "close":
+            value = operands
+            operands = arrays.pop() if arrays else []
+        else:
+            operator = match.group().decode("latin-1")
+            if operator in ("true", "false", "null"):
+                operands.append(operator)
+                continue
+            if operator == "ID":  # inline image data
+                end = data.find(b"EI", pos)
+                pos = len(data) if end < 0 else end + 2
+            yield operands, operator
+            operands = []
+            arrays = []
+            continue
+        operands.append(value)
+
+
+def _multiply(first, second):
+    """first x second for PDF matrices (a, b, c, d, e, f)"""
+    a1, b1, c1, d1, e1, f1 = first
+    a2, b2, c2, d2, e2, f2 = second
+    return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+            c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+            e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+
+def _resource(resources, category):
+    """A resource dictionary (/Font, /XObject) of possibly indirect resources"""
+    if resources is None:
+        return {}
+    return resources.get_object().get(category, DictionaryObject()).get_object()
+
+
+def _base_font(resources, name):
+    fonts = _resource(resources, "/Font")
+    if name not in fonts:
+        return None
+    return str(fonts[name].get_object().get("/BaseFont", "/?"))[1:]
+
+
+def text_runs(data, resources, matrix=IDENTITY, depth=0):
+    """
+    Strings a content stream draws, following the form XObjects it draws
+
+    Only the origin of the first string after a positioning operator is
+    exact (glyph widths are not looked up); the overlay draws one string per
+    text object.
+
+    Returns:
+        list: {"text", "font" (base font name), "size", "x", "y"} in page space
+    """
+    runs = []
+    ctm = matrix
+    font, size, leading = None, 0.0, 0.0
+    stack = []
+    line = text = IDENTITY
+    for operands, operator in operations(data):
+        if operator == "q":
+            stack.append((ctm, font, size, leading))
+        elif operator == "Q":
+            if stack:
+                ctm, font, size, leading = stack.pop()
+        elif operator == "cm" and len(operands) == 6:
+            ctm = _multiply(operands, ctm)
+        elif operator == "BT":
+            line = text = IDENTITY
+        elif operator == "Tf" and len(operands) == 2:
+            font, size = operands
+        elif operator == "TL" and operands:
+            leading = operands[0]
+        elif operator == "Tm" and len(operands) == 6:
+            line = text = tuple(operands)
+        elif operator in ("Td", "TD") and len(operands) == 2:
+            if operator == "TD":
+                leading = -operands[1]
+            line = text = _multiply((1, 0, 0, 1, operands[0], operands[1]), line)
+        elif operator in ("T*", "'", '"'):
+            line = text = _multiply((1, 0, 0, 1, 0, -leading), line)
+        if operator in ("Tj", "'", '"', "TJ") and operands:
+            value = operands[-1]
+            if isinstance(value, list):
+                value = b"".join(item for item in value if isinstance(item, bytes))
+            placed = _multiply(text, ctm)
+            runs.append({"text": value.decode("cp1252", errors="replace"),
+                         "font": _base_font(resources, font),
+                         "size": round(size * math.hypot(placed[2], placed[3]), 2),
+                         "x": round(placed[4], 2), "y": round(placed[5], 2)})
+        elif operator == "Do" and operands and depth < 4:
+            xobjects = _resource(resources, "/XObject")
+            if operands[0] in xobjects:
+                form = xobjects[operands[0]].get_object()
+                if form.get("/Subtype") == "/Form":
+                    form_matrix = tuple(float(value) for value in form.get("/Matrix", IDENTITY))
+                    runs += text_runs(form.get_data(), form.get("/Resources", resources),
+                                      _multiply(form_matrix, ctm), depth + 1)
+    return runs
+
+
+def overlay_runs(page):
+    """
+    text_runs of the overlay part of a page
+
+    The incremental and acroform backends append their own last content
+    stream; the overlay merges put the overlay after the template in one
+    stream, so only the end of that stream is read.
+    """
+    contents = page["/Contents"].get_object()
+    streams = list(contents) if isinstance(contents, list) else [contents]
+    data = streams[-1].get_object().get_data()
+    if len(streams) == 1:
+        window = data[-OVERLAY_WINDOW:]
+        starts = [match.end() - 1 for match in _OVERLAY_START.finditer(window)]
+        data = window[starts[-1]:] if starts else data
+    return text_runs(data, page["/Resources"])
+
+
+# Checks ---------------------------------------------------------------------
+
+def expected_fields(record):
+    """(page index, label, text, font, size, x, y) the certificate must show"""
+    coords = get_coordinates(record["prefix"])
+    fields = []
+    for page_index, page_key, coord_key, data_key, font in OVERLAY_FIELDS:
+        coord = coords[page_key][coord_key]
+        fields.append((page_index, coord_key, record[data_key], font, int(coord["size"]),
+                       coord["x"], coord["y"]))
+    return fields
+
+
+def verify_certificate(pdf, record, tolerance=POSITION_TOLERANCE):
+    """
+    Check a written certificate shows its record's text where it should
+
+    Args:
+        pdf: PDF bytes or path
+        record: The certificate record it was rendered from (see
+            certificate_engine.make_record)
+        tolerance: Points a string may be away from its coordinate
+
+    Returns:
+        list: Problems found, empty for a correct certificate
+    """
+    stream = io.BytesIO(pdf) if isinstance(pdf, (bytes, bytearray)) else str(pdf)
+    try:
+        pages = PdfReader(stream).pages
+        runs = {}
+        problems = []
+        for page_index, label, text, font, size, x, y in expected_fields(record):
+            where = f"page {page_index + 1} {label}"
+            if page_index >= len(pages):
+                problems.append(f"{where}: the certificate has {len(pages)} page(s)")
+                continue
+            if page_index not in runs:
+                runs[page_index] = overlay_runs(pages[page_index])
+            distance = lambda run: math.hypot(run["x"] - x, run["y"] - y)  # noqa: E731
+            matches = sorted((run for run in runs[page_index] if run["text"] == text), key=distance)
+            if not matches:
+                nearby = [run["text"] for run in sorted(runs[page_index], key=distance)
+                          if distance(run) <= 2]
+                problems.append(f"{where}: {text!r} not found"
+                                + (f" ({nearby[0]!r} drawn instead)" if nearby else ""))
+                continue
+            run = matches[0]
+            if distance(run) > tolerance:
+                problems.append(f"{where}: at ({run['x']:g}, {run['y']:g}), expected ({x:g}, {y:g})")
+            if run["font"] != font:
+                problems.append(f"{where}: font {run['font']}, expected {font}")
+            if abs(run["size"] - size) > 0.01:
+                problems.append(f"{where}: size {run['size']:g}, expected {size}")
+        return problems
+    except Exception as e:
+        return [f"cannot read the certificate: {e}"]
+
+
+def log_failure(record, problems):
+    """Print a failed check and append it to FAILURE_LOG"""
+    print(f"✗ Verification failed for {record['serial']}: {'; '.join(problems)}", file=sys.stderr)
+    FAILURE_LOG.parent.mkdir(parents=True, exist_ok=True)
+    with open(FAILURE_LOG, "a", encoding="utf-8") as log:
+        log.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"),
+                              "serial": record["serial"], "problems": problems}) + "\n")
+
+
+# Background checks ----------------------------------------------------------
+
+class Verifier:
+    """
+    Checks written certificates on a background thread
+
+    submit() returns at once. A sample_rate share of the certificates is
+    checked (1.0: all of them, waiting for the thread if max_pending are
+    queued; below 1.0 a sample that finds the queue full is skipped
+    instead). Failures go to on_failure(record, problems) on the thread
+    and are kept in failures; a certificate that cannot be read (pdf()
+    raised) counts as failed, and an on_failure that raises is reported
+    without stopping the thread.
+    """
+
+    def __init__(self, sample_rate=1.0, max_pending=MAX_PENDING, on_failure=log_failure):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"Sample rate must be between 0 and 1: {sample_rate}")
+        self.sample_rate = sample_rate
+        self.on_failure = on_failure
+        self.counts = {"submitted": 0, "checked": 0, "failed": 0, "skipped": 0}
+        self.failures = []
+        self.seconds = 0.0
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, name="certificate-verify", daemon=True)
+        self._thread.start()
+
+    def submit(self, pdf, record):
+        """
+        Queue a written certificate if it is sampled
+
+        Args:
+            pdf: PDF bytes, a path, or a function returning the bytes
+                (called on the verifier thread)
+            record: The record it was rendered from
+
+        Returns:
+            bool: Whether it will be checked
+        """
+        self.counts["submitted"] += 1
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+        try:
+            self._queue.put((pdf, record), block=self.sample_rate >= 1)
+        except queue.Full:
+            self.counts["skipped"] += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                pdf, record = item
+                start = time.perf_counter()
+                try:
+                    problems = verify_certificate(pdf() if callable(pdf) else pdf, record)
+                except Exception as e:
+                    problems = [f"cannot read the certificate: {e}"]
+                self.seconds += time.perf_counter() - start
+                self.counts["checked"] += 1
+                if problems:
+                    self.counts["failed"] += 1
+                    self.failures.append((record["serial"], problems))
+                    if self.on_failure is not None:
+                        try:
+                            self.on_failure(record, problems)
+                        except Exception as e:
+                            print(f"✗ Could not report the failed check of {record['serial']}: {e}",
+                                  file=sys.stderr)
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        """Block until every queued certificate is checked"""
+        self._queue.join()
+
+    def close(self):
+        """Finish the queued checks and stop the thread; returns counts"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        return dict(self.counts)
+
+
+def main():
+    """Command line entry point"""
+    from certificate_ledger import LEDGER_FILE, CertificateLedger
+
+    parser = argparse.ArgumentParser(description="Check written certificates against the ledger")
+    parser.add_argument("paths", nargs="+", help="Certificate PDFs or folders of them")
+    parser.add_argument("--ledger", default=str(LEDGER_FILE), help="Certificate ledger (default: certificates.db)")
+    args = parser.parse_args()
+
+    files = []
+    for path in map(Path, args.paths):
+        files += sorted(path.rglob("*.pdf")) if path.is_dir() else [path]
+
+    print("=" * 70)
+    print("Certificate Verification")
+    print("=" * 70)
+    failed = unknown = 0
+    start = time.perf_counter()
+    with CertificateLedger(args.ledger) as ledger:
+        for path in files:
+            record = ledger.lookup(path.stem)
+            if record is None:
+                print(f"- {path.name}: not in the ledger, skipped")
+                unknown += 1
+                continue
+            problems = verify_certificate(path, record)
+            if problems:
+                failed += 1
+                print(f"✗ {path.name}")
+                for problem in problems:
+                    print(f"  {problem}")
+            else:
+                print(f"✓ {path.name}")
+    checked = len(files) - unknown
+    print(f"\n{checked - failed}/{checked} certificates verified in {time.perf_counter() - start:.2f}s")
+    print("=" * 70)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,12 +11,45 @@ from PyPDF2.generic import (
     ArrayObject,
     TextStringObject,
     NumberObject,
+    FloatObject,
     NameObject,
-    IndirectObject
+    DecodedStreamObject,
 )
+from product_coordinates import PRODUCT_COORDINATES, LOT_PLACEHOLDER_COVER
 import sys
 
-def create_text_field(writer, name, x, y, width, height, page_num=0):
+# Field rectangles start this far (as a fraction of the font size) below the
+# text baseline, so the filled value lands exactly where app.py draws it
+DESCENT_RATIO = 0.25
+
+# Default-resource font names used in /DA strings
+FORM_FONTS = {
+    "/Helv": "Helvetica",
+    "/HeBo": "Helvetica-Bold",
+}
+
+# (field name, page key, product_coordinates key, font, width)
+FORM_FIELDS = [
+    ("serial_number", "page1", "serial", "/HeBo", 150),
+    ("activation_before", "page1", "activation_date", "/Helv", 80),
+    ("lot_number", "page1", "lot", "/HeBo", 150),
+    ("gas_production", "page1", "gas_prod", "/Helv", 80),
+    ("calibration_date", "page1", "calibration", "/HeBo", 100),
+    ("serial_number_p2", "page2", "serial", "/HeBo", 150),
+]
+
+
+def standard_font(base_font):
+    """Dictionary for one of the standard 14 Type1 fonts"""
+    return DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/" + base_font),
+        NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+    })
+
+
+def create_text_field(writer, name, x, y, width, height, page_num=0, font="/Helv", size=10):
     """
     Create a text form field
     
@@ -26,25 +59,57 @@ def create_text_field(writer, name, x, y, width, height, page_num=0):
         x, y: Position from bottom-left (in points)
         width, height: Field dimensions
         page_num: Page number (0-indexed)
+        font: Default-resource font name for the field's /DA
+        size: Font size
     """
-    # Create the field dictionary
+    # Create the field dictionary (merged field and widget annotation)
     field = DictionaryObject()
     field.update({
+        NameObject("/Type"): NameObject("/Annot"),
+        NameObject("/Subtype"): NameObject("/Widget"),
         NameObject("/FT"): NameObject("/Tx"),  # Field Type: Text
         NameObject("/T"): TextStringObject(name),  # Field Name
         NameObject("/V"): TextStringObject(""),  # Value (empty initially)
         NameObject("/Rect"): ArrayObject([
-            NumberObject(x),
-            NumberObject(y),
-            NumberObject(x + width),
-            NumberObject(y + height)
+            FloatObject(x),
+            FloatObject(y),
+            FloatObject(x + width),
+            FloatObject(y + height)
         ]),
+        NameObject("/DA"): TextStringObject(f"{font} {size} Tf 0 g"),
         NameObject("/F"): NumberObject(4),  # Flags: Print
         NameObject("/Ff"): NumberObject(0),  # Field flags
+        NameObject("/P"): writer.pages[page_num].indirect_reference,
     })
     
     return field
 
+
+def append_page_content(writer, page, data):
+    """
+    Append a content stream to a page
+
+    The existing content is wrapped in q/Q so graphics state it leaves behind
+    cannot shift the appended drawing.
+    """
+    def add_stream(stream_data):
+        stream = DecodedStreamObject()
+        stream.set_data(stream_data)
+        return writer._add_object(stream)
+
+    contents = page.raw_get("/Contents")
+    existing = contents.get_object()
+    refs = list(existing) if isinstance(existing, ArrayObject) else [contents]
+    page[NameObject("/Contents")] = ArrayObject(
+        [add_stream(b"q\n")] + refs + [add_stream(b"\nQ\n" + data)])
+
+
+def add_static_cover(writer, page_num, rect):
+    """Paint a white rectangle into a page's content once, at template build time"""
+    x, y, width, height = rect
+    append_page_content(writer, writer.pages[page_num],
+                        f"q 1 g {x} {y} {width} {height} re f Q\n".encode())
+
 def add_form_fields_to_pdf(input_path, output_path, fields_config):
     """
     Add form fields to a PDF
@@ -68,14 +133,27 @@ def add_form_fields_to_pdf(input_path, output_path, fields_config):
     fields = []
     
     for field_name, field_info in fields_config.items():
+        if field_name == '_cover':
+            add_static_cover(writer, field_info['page'], field_info['rect'])
+            print(f"  Added placeholder cover at {field_info['rect']}")
+            continue
+        
         page_num = field_info.get('page', 0)
         x = field_info['x']
         y = field_info['y']
         width = field_info.get('width', 100)
         height = field_info.get('height', 15)
         
-        field = create_text_field(writer, field_name, x, y, width, height, page_num)
-        fields.append(field)
+        field = create_text_field(writer, field_name, x, y, width, height, page_num,
+                                  field_info.get('font', '/Helv'), field_info.get('size', 10))
+        field_ref = writer._add_object(field)
+        fields.append(field_ref)
+        
+        # Attach the widget to its page so viewers (and fillers) can find it
+        page = writer.pages[page_num]
+        if "/Annots" not in page:
+            page[NameObject("/Annots")] = ArrayObject()
+        page["/Annots"].append(field_ref)
         
         print(f"  Added field: {field_name} at ({x}, {y}) on page {page_num + 1}")
     
@@ -84,6 +162,13 @@ def add_form_fields_to_pdf(input_path, output_path, fields_config):
         writer._root_object.update({
             NameObject("/AcroForm"): DictionaryObject({
                 NameObject("/Fields"): ArrayObject(fields),
+                NameObject("/DA"): TextStringObject("/Helv 10 Tf 0 g"),
+                NameObject("/DR"): DictionaryObject({
+                    NameObject("/Font"): DictionaryObject({
+                        NameObject(name): writer._add_object(standard_font(base_font))
+                        for name, base_font in FORM_FONTS.items()
+                    })
+                }),
                 NameObject("/NeedAppearances"): NameObject("/true")
             })
         })
@@ -94,50 +179,42 @@ def add_form_fields_to_pdf(input_path, output_path, fields_config):
     
     print(f"✓ Created form template with {len(fields)} fields\n")
 
+def get_product_field_configuration(prefix):
+    """
+    Field configuration for one product, placed from product_coordinates.py
+
+    Each field's rectangle starts DESCENT_RATIO * size below the text baseline
+    that app.py uses, so a filled field matches the overlay output.
+    """
+    coords = PRODUCT_COORDINATES[prefix]
+    config = {}
+    for field_name, page_key, coord_key, font, width in FORM_FIELDS:
+        coord = coords[page_key][coord_key]
+        size = int(coord["size"])
+        config[field_name] = {
+            'page': 0 if page_key == "page1" else 1,
+            'x': coord["x"],
+            'y': round(coord["y"] - size * DESCENT_RATIO, 2),
+            'width': width,
+            'height': round(size * (1 + DESCENT_RATIO), 2),
+            'font': font,
+            'size': size,
+        }
+    config['_cover'] = {'page': 0, 'rect': LOT_PLACEHOLDER_COVER}
+    return config
+
+
 def get_field_configurations():
     """
     Define field configurations for each template
-    Based on visual analysis of the PDFs
+    Maps clean template name -> (form template name, field configuration)
     """
-    # Common configuration for all templates (they have the same layout)
-    common_config = {
-        # Page 1 fields
-        'serial_number': {'page': 0, 'x': 520, 'y': 727, 'width': 80, 'height': 12},
-        'activation_before': {'page': 0, 'x': 520, 'y': 712, 'width': 80, 'height': 12},
-        'lot_number': {'page': 0, 'x': 145, 'y': 475, 'width': 120, 'height': 12},
-        'gas_production': {'page': 0, 'x': 145, 'y': 460, 'width': 80, 'height': 12},
-        'calibration_date': {'page': 0, 'x': 190, 'y': 555, 'width': 80, 'height': 12},
-        
-        # Page 2 fields - Serial number
-        'serial_number_p2': {'page': 1, 'x': 520, 'y': 750, 'width': 80, 'height': 12},
-        
-        # Page 2 - Activation date boxes (8 individual digit fields)
-        'act_d1': {'page': 1, 'x': 545, 'y': 477, 'width': 12, 'height': 12},
-        'act_d2': {'page': 1, 'x': 560, 'y': 477, 'width': 12, 'height': 12},
-        'act_m1': {'page': 1, 'x': 590, 'y': 477, 'width': 12, 'height': 12},
-        'act_m2': {'page': 1, 'x': 605, 'y': 477, 'width': 12, 'height': 12},
-        'act_y1': {'page': 1, 'x': 650, 'y': 477, 'width': 12, 'height': 12},
-        'act_y2': {'page': 1, 'x': 665, 'y': 477, 'width': 12, 'height': 12},
-        'act_y3': {'page': 1, 'x': 680, 'y': 477, 'width': 12, 'height': 12},
-        'act_y4': {'page': 1, 'x': 695, 'y': 477, 'width': 12, 'height': 12},
-        
-        # Page 2 - Expiration date boxes (8 individual digit fields)
-        'exp_d1': {'page': 1, 'x': 545, 'y': 397, 'width': 12, 'height': 12},
-        'exp_d2': {'page': 1, 'x': 560, 'y': 397, 'width': 12, 'height': 12},
-        'exp_m1': {'page': 1, 'x': 590, 'y': 397, 'width': 12, 'height': 12},
-        'exp_m2': {'page': 1, 'x': 605, 'y': 397, 'width': 12, 'height': 12},
-        'exp_y1': {'page': 1, 'x': 650, 'y': 397, 'width': 12, 'height': 12},
-        'exp_y2': {'page': 1, 'x': 665, 'y': 397, 'width': 12, 'height': 12},
-        'exp_y3': {'page': 1, 'x': 680, 'y': 397, 'width': 12, 'height': 12},
-        'exp_y4': {'page': 1, 'x': 695, 'y': 397, 'width': 12, 'height': 12},
-    }
-    
     return {
-        'D4PQ236599.pdf': common_config,
-        'SOSP215459.pdf': common_config,
-        'SCSQ175392.pdf': common_config,
-        'D4SQ106733.pdf': common_config,
-        'SHSP085112.pdf': common_config,
+        'D4PQ236599_clean.pdf': ('D4PQ236599.pdf', get_product_field_configuration('D4PQ')),
+        'SOSP215459_clean.pdf': ('SOSP215459.pdf', get_product_field_configuration('SOSP')),
+        'SCSQ175392_clean.pdf': ('SCSQ175392.pdf', get_product_field_configuration('SCSQ')),
+        'D4SQ106733_clean.pdf': ('D4SQ106733.pdf', get_product_field_configuration('D4SQ')),
+        'SHSP085112_clean.pdf': ('SHSP085112.pdf', get_product_field_configuration('SHSP')),
     }
 
 def main():
@@ -157,9 +234,9 @@ def main():
     field_configs = get_field_configurations()
     
     created_count = 0
-    for template_name, fields_config in field_configs.items():
+    for template_name, (form_name, fields_config) in field_configs.items():
         input_path = templates_dir / template_name
-        output_path = forms_dir / template_name
+        output_path = forms_dir / form_name
         
         if not input_path.exists():
             print(f"WARNING: Template not found: {input_path}")
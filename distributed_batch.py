@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Distributed batch generation through a shared folder
+For orders too large for one machine. A coordinator splits a validated
+order into chunk files in a job folder on a shared filesystem; workers on
+any number of machines claim chunks, render them and write the results
+with a completion marker; the coordinator then collects everything into
+output/Invoice_<n>/, the ledger and the manifest.
+
+    job/job.json                       invoice, backend, chunk count, lease time
+    job/chunks/chunk-00000.json        records of a chunk
+    job/leases/chunk-00000.<gen>       lease of a chunk (created with O_EXCL)
+    job/results/chunk-00000/           certificates of a finished chunk
+    job/results/chunk-00000.done       completion marker (manifest entries)
+
+A worker claims a chunk by creating its lease file with O_EXCL and keeps it
+alive by touching it (heartbeat) while rendering. A lease not touched for
+lease seconds has expired: the chunk is taken over by creating the next
+generation's lease, again with O_EXCL, so of several nodes reclaiming the
+same chunk exactly one wins. A node that lost its lease discards its work
+instead of publishing it; results published without a marker (the node
+died in between) are replaced by the next lease holder's. Leases compare
+file times with the local clock, so keep the lease well above the clock
+skew between nodes.
+
+Usage:
+    python distributed_batch.py split orders.csv /shared/job-12345 --invoice 12345 [--chunk-size 100]
+    python distributed_batch.py work /shared/job-12345            # on every node
+    python distributed_batch.py status /shared/job-12345
+    python distributed_batch.py collect /shared/job-12345 [--output output]
+"""
+
+from datetime import datetime
+from pathlib import Path
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+
+from batch_generate import find_duplicates, generate_batch, read_records
+from certificate_engine import PRODUCTS, get_engine
+from certificate_ledger import LEDGER_FILE, CertificateLedger, ledger_entry
+from invoice_staging import place_files
+from output_layout import OutputLayout, SerialIndex
+from session_journal import SessionJournal
+
+JOB_FILE = "job.json"
+CHUNKS_DIR = "chunks"
+LEASES_DIR = "leases"
+RESULTS_DIR = "results"
+DONE_SUFFIX = ".done"
+
+CHUNK_SIZE = 100
+LEASE_SECONDS = 60
+POLL_INTERVAL = 1.0
+
+
+def node_name():
+    """This worker's name in leases and markers"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _write_json(path, data):
+    """Write JSON atomically (partial file, then rename)"""
+    partial = path.with_name(f".{path.name}.partial")
+    partial.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    os.replace(partial, path)
+
+
+def _create_exclusive(path, data):
+    """Create path with O_EXCL; False if it already exists"""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    return True
+
+
+class Job:
+    """A job folder on the shared filesystem"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.chunks_dir = self.path / CHUNKS_DIR
+        self.leases_dir = self.path / LEASES_DIR
+        self.results_dir = self.path / RESULTS_DIR
+        self._info = None
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = json.loads((self.path / JOB_FILE).read_text(encoding="utf-8"))
+        return self._info
+
+    def ready(self):
+        return (self.path / JOB_FILE).exists()
+
+    def chunks(self):
+        return [f"chunk-{index:05d}" for index in range(self.info["chunks"])]
+
+    def records(self, chunk):
+        return json.loads((self.chunks_dir / f"{chunk}.json").read_text(encoding="utf-8"))
+
+    def marker(self, chunk):
+        return self.results_dir / f"{chunk}{DONE_SUFFIX}"
+
+    def is_done(self, chunk):
+        return self.marker(chunk).exists()
+
+    def pending(self):
+        return [chunk for chunk in self.chunks() if not self.is_done(chunk)]
+
+    def lease(self, chunk):
+        """(generation, path) of a chunk's current lease, or (None, None) if never claimed"""
+        generations = [int(path.suffix[1:]) for path in self.leases_dir.glob(f"{chunk}.*")
+                       if path.suffix[1:].isdigit()]
+        if not generations:
+            return None, None
+        generation = max(generations)
+        return generation, self.leases_dir / f"{chunk}.{generation}"
+
+    def lease_age(self, chunk):
+        """Seconds since the chunk's lease was last renewed, or None"""
+        _, path = self.lease(chunk)
+        try:
+            return time.time() - path.stat().st_mtime if path else None
+        except FileNotFoundError:
+            return None
+
+    def status(self):
+        """Chunk counts: done, leased, expired, unclaimed"""
+        counts = {"done": 0, "leased": 0, "expired": 0, "unclaimed": 0}
+        for chunk in self.chunks():
+            age = self.lease_age(chunk)
+            if self.is_done(chunk):
+                counts["done"] += 1
+            elif age is None:
+                counts["unclaimed"] += 1
+            elif age > self.info["lease_seconds"]:
+                counts["expired"] += 1
+            else:
+                counts["leased"] += 1
+        return counts
+
+
+class Lease:
+    """A claimed chunk; renew() is the heartbeat"""
+
+    def __init__(self, job, chunk, generation, node):
+        self.job = job
+        self.chunk = chunk
+        self.generation = generation
+        self.node = node
+        self.path = job.leases_dir / f"{chunk}.{generation}"
+
+    @classmethod
+    def acquire(cls, job, chunk, node=None):
+        """
+        Claim a chunk that is unclaimed or whose lease expired
+
+        Returns:
+            Lease: The new lease, or None if the chunk is done or held
+        """
+        node = node or node_name()
+        if job.is_done(chunk):
+            return None
+        generation, path = job.lease(chunk)
+        if generation is None:
+            generation = 0
+        else:
+            try:
+                age = time.time() - path.stat().st_mtime
+            except FileNotFoundError:
+                return None
+            if age <= job.info["lease_seconds"]:
+                return None
+            generation += 1
+        lease = cls(job, chunk, generation, node)
+        if not _create_exclusive(lease.path, {"node": node, "generation": generation,
+                                              "acquired": datetime.now().isoformat(timespec="seconds")}):
+            return None
+        return lease
+
+    def renew(self):
+        os.utime(self.path)
+
+    def held(self):
+        """Still this node's: not expired and not taken over"""
+        generation, _ = self.job.lease(self.chunk)
+        try:
+            age = time.time() - self.path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return generation == self.generation and age <= self.job.info["lease_seconds"]
+
+
+class Heartbeat:
+    """Renews a lease from a background thread, every third of the lease time"""
+
+    def __init__(self, lease):
+        self.lease = lease
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        interval = self.lease.job.info["lease_seconds"] / 3
+        while not self.stop_event.wait(interval):
+            try:
+                self.lease.renew()
+            except OSError:
+                pass
+
+
+def split_order(records, job_path, invoice, chunk_size=CHUNK_SIZE, backend=None, profile=None,
+                lease_seconds=LEASE_SECONDS, reissue=False):
+    """
+    Write an order's records as chunk files into a new job folder
+
+    job.json is written last, so workers never see a partial job.
+
+    Returns:
+        Job: The job
+    """
+    job = Job(job_path)
+    if job.ready():
+        raise FileExistsError(f"{job.path} already holds a job")
+    for folder in (job.chunks_dir, job.leases_dir, job.results_dir):
+        folder.mkdir(parents=True, exist_ok=True)
+    chunks = 0
+    for start in range(0, len(records), chunk_size):
+        _write_json(job.chunks_dir / f"chunk-{chunks:05d}.json", records[start:start + chunk_size])
+        chunks += 1
+    _write_json(job.path / JOB_FILE, {
+        "invoice": invoice, "backend": backend, "profile": profile, "chunks": chunks,
+        "certificates": len(records), "lease_seconds": lease_seconds, "reissue": reissue,
+        "created": datetime.now().isoformat(timespec="seconds"),
+    })
+    return job
+
+
+def process_chunk(job, lease):
+    """
+    Render a leased chunk and publish it with its completion marker
+
+    Returns:
+        bool: True if published, False if the lease was lost meanwhile
+    """
+    partial = job.results_dir / f"{lease.chunk}.{lease.node}.partial"
+    if partial.exists():
+        shutil.rmtree(partial)
+    with Heartbeat(lease):
+        journal = SessionJournal(partial)
+        generate_batch(job.records(lease.chunk), partial, job.info["backend"],
+                       profile=job.info["profile"], journal=journal)
+        journal.close()
+        entries = journal.load()
+
+    final = job.results_dir / lease.chunk
+    if not lease.held() or job.is_done(lease.chunk):
+        shutil.rmtree(partial)
+        return False
+    journal.path.unlink()
+    if final.exists():
+        # A node died between publishing and writing the marker; this node
+        # holds the lease now, so its results replace the unmarked ones
+        stale = job.results_dir / f"{lease.chunk}.{lease.node}.stale"
+        os.rename(final, stale)
+        shutil.rmtree(stale)
+    try:
+        os.rename(partial, final)
+    except OSError:
+        # Another node published the chunk first
+        shutil.rmtree(partial)
+        return False
+    for entry in entries:
+        entry["path"] = str(Path(RESULTS_DIR) / lease.chunk / entry["filename"])
+    return _create_exclusive(job.marker(lease.chunk), {
+        "chunk": lease.chunk, "node": lease.node, "generation": lease.generation,
+        "finished": datetime.now().isoformat(timespec="seconds"), "certificates": entries,
+    })
+
+
+def work(job_path, node=None, poll=POLL_INTERVAL, wait_for_job=0, log=print):
+    """
+    Claim and render chunks until every chunk of the job is done
+
+    Chunks held by live nodes are waited for, so this node takes them over
+    if their node dies.
+
+    Returns:
+        int: Chunks this node published
+    """
+    job = Job(job_path)
+    deadline = time.monotonic() + wait_for_job
+    while not job.ready():
+        if time.monotonic() >= deadline:
+            raise FileNotFoundError(f"No {JOB_FILE} in {job.path}")
+        time.sleep(poll)
+    node = node or node_name()
+    published = 0
+    while True:
+        pending = job.pending()
+        if not pending:
+            return published
+        claimed = False
+        for chunk in pending:
+            lease = Lease.acquire(job, chunk, node)
+            if lease is None:
+                continue
+            claimed = True
+            start = time.perf_counter()
+            if process_chunk(job, lease):
+                published += 1
+                log(f"✓ {chunk} ({time.perf_counter() - start:.1f}s, lease generation {lease.generation})")
+            else:
+                log(f"✗ {chunk}: lease lost, results discarded")
+        if not claimed:
+            time.sleep(poll)
+
+
+def collect(job_path, output="output", ledger_path=LEDGER_FILE):
+    """
+    Move a finished job's certificates into the invoice folder
+
+    The certificates are recorded in the ledger and serial index and the
+    invoice manifest is written.
+
+    Returns:
+        list: Paths of the certificates
+
+    Raises:
+        RuntimeError: If chunks are not finished yet
+    """
+    job = Job(job_path)
+    pending = job.pending()
+    if pending:
+        raise RuntimeError(f"{len(pending)} chunk(s) not finished: {', '.join(pending[:5])}")
+    invoice = job.info["invoice"]
+    layout = OutputLayout(output)
+    entries = []
+    for chunk in job.chunks():
+        entries += json.loads(job.marker(chunk).read_text(encoding="utf-8"))["certificates"]
+    targets = layout.placement(entries, invoice) or {
+        entry["filename"]: layout.invoice_dir(invoice) / entry["filename"] for entry in entries}
+
+    layout.invoice_dir(invoice).mkdir(parents=True, exist_ok=True)
+    moves = [(job.path / entry["path"], targets[entry["filename"]]) for entry in entries
+             if (job.path / entry["path"]).exists()]
+    place_files(moves)
+    paths = [targets[entry["filename"]] for entry in entries]
+    layout.write_manifest(layout.invoice_dir(invoice), entries, paths)
+    with SerialIndex(layout.root) as index:
+        index.update({path.stem: path for path in paths})
+
+    backend, profile = job.info["backend"], job.info["profile"]
+    with CertificateLedger(ledger_path) as ledger:
+        ledger.record_many([ledger_entry(entry["data"], PRODUCTS[entry["data"]["prefix"]]["name"],
+                                         get_engine(entry["data"]["prefix"], backend, profile)
+                                         .template_path(entry["data"]["prefix"]),
+                                         targets[entry["filename"]], invoice)
+                            for entry in entries], replace=job.info["reissue"])
+    return paths
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Distributed batch generation through a shared folder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    split_args = commands.add_parser("split", help="Split an order into a job folder")
+    split_args.add_argument("csv_file")
+    split_args.add_argument("job")
+    split_args.add_argument("--invoice", required=True)
+    split_args.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    split_args.add_argument("--lease", type=float, default=LEASE_SECONDS, help="Lease time in seconds")
+    split_args.add_argument("--backend", help="Certificate engine backend (default: engine_config.json)")
+    split_args.add_argument("--profile", help="Output profile (default: engine_config.json)")
+    split_args.add_argument("--reissue", action="store_true", help="Allow serials already in the ledger")
+    work_args = commands.add_parser("work", help="Render chunks until the job is done")
+    work_args.add_argument("job")
+    work_args.add_argument("--wait", type=float, default=0, help="Seconds to wait for the job to appear")
+    status_args = commands.add_parser("status", help="Show the chunks' state")
+    status_args.add_argument("job")
+    collect_args = commands.add_parser("collect", help="Move a finished job into the invoice folder")
+    collect_args.add_argument("job")
+    collect_args.add_argument("--output", default="output")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("GasClip Distributed Batch")
+    print("=" * 70)
+
+    if args.command == "split":
+        records, errors = read_records(args.csv_file)
+        if errors:
+            print(f"✗ {len(errors)} problem(s) in {args.csv_file}:")
+            for row_number, message in errors:
+                print(f"  Row {row_number}: {message}")
+            return 1
+        with CertificateLedger() as ledger:
+            duplicates = find_duplicates(records, ledger)
+        if duplicates and not args.reissue:
+            print(f"✗ {len(duplicates)} serial(s) would be issued twice (use --reissue to allow):")
+            for serial, reason in duplicates:
+                print(f"  {serial}: {reason}")
+            return 1
+        job = split_order(records, args.job, args.invoice, args.chunk_size, args.backend, args.profile,
+                          args.lease, args.reissue)
+        print(f"✓ {len(records)} records in {job.info['chunks']} chunks: {job.path}")
+    elif args.command == "work":
+        print(f"Node: {node_name()}")
+        published = work(args.job, wait_for_job=args.wait)
+        print(f"✓ Job complete; this node finished {published} chunk(s)")
+    elif args.command == "status":
+        job = Job(args.job)
+        counts = job.status()
+        print(f"Invoice {job.info['invoice']}: {job.info['certificates']} certificates, "
+              f"{job.info['chunks']} chunks")
+        print("  " + ", ".join(f"{state}: {count}" for state, count in counts.items()))
+    else:
+        try:
+            paths = collect(args.job, args.output)
+        except RuntimeError as e:
+            print(f"✗ {e}")
+            return 1
+        print(f"✓ {len(paths)} certificates collected into "
+              f"{OutputLayout(args.output).invoice_dir(Job(args.job).info['invoice'])}")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
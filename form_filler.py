@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+AcroForm fill-and-flatten engine
+Fills the text fields added by create_form_templates.py by name, generates
+their appearance streams itself and optionally flattens them into the page
+content. No reportlab render is needed per certificate.
+"""
+
+from pathlib import Path
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    NameObject,
+    TextStringObject,
+)
+from create_form_templates import DESCENT_RATIO, FORM_FONTS, append_page_content, standard_font
+from certificate_engine import create_text_overlay, merge_overlay, pdf_string, read_template, template_stream
+import io
+import sys
+import time
+
+FORMS_DIR = Path(__file__).parent / "templates_with_forms"
+
+# Form template for each product prefix (built by create_form_templates.py)
+FORM_TEMPLATES = {
+    "D4PQ": "D4PQ236599.pdf",
+    "SOSP": "SOSP215459.pdf",
+    "SCSQ": "SCSQ175392.pdf",
+    "D4SQ": "D4SQ106733.pdf",
+    "SHSP": "SHSP085112.pdf",
+}
+
+# Certificate data key for each form field
+FIELD_DATA_KEYS = {
+    "serial_number": "serial",
+    "activation_before": "activation",
+    "lot_number": "lot",
+    "gas_production": "gas_prod",
+    "calibration_date": "calibration",
+    "serial_number_p2": "serial",
+}
+
+_TEMPLATE_CACHE = {}
+
+
+class FormTemplate:
+    """A parsed form template with its field/widget lookup resolved once"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.reader = PdfReader(template_stream(read_template(self.path)))
+        self.fields = self._index_fields()
+
+    def _index_fields(self):
+        """Map field name -> page index, /Annots index, rect, font and size"""
+        fields = {}
+        for page_index, page in enumerate(self.reader.pages):
+            for annot_index, annot_ref in enumerate(page.get("/Annots", [])):
+                annot = annot_ref.get_object()
+                if annot.get("/Subtype") != "/Widget" or annot.get("/FT") != "/Tx":
+                    continue
+                font, size = self._parse_da(annot.get("/DA", "/Helv 10 Tf"))
+                fields[str(annot["/T"])] = {
+                    "page": page_index,
+                    "annot": annot_index,
+                    "rect": [float(v) for v in annot["/Rect"]],
+                    "font": font,
+                    "size": size,
+                }
+        return fields
+
+    @staticmethod
+    def _parse_da(da):
+        """Extract font resource name and size from a /DA string"""
+        parts = str(da).split()
+        index = parts.index("Tf")
+        return parts[index - 2], float(parts[index - 1])
+
+    def appearance_stream(self, field, value, font_ref):
+        """Build the /N appearance form XObject for one filled field"""
+        info = self.fields[field]
+        x1, y1, x2, y2 = info["rect"]
+        size = info["size"]
+        baseline = size * DESCENT_RATIO
+
+        stream = DecodedStreamObject()
+        stream.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0),
+                                              FloatObject(x2 - x1), FloatObject(y2 - y1)]),
+            NameObject("/Resources"): DictionaryObject({
+                NameObject("/Font"): DictionaryObject({NameObject(info["font"]): font_ref}),
+            }),
+        })
+        stream.set_data(
+            b"/Tx BMC q BT " + info["font"].encode() + b" %g Tf 0 g 0 %g Td " % (size, baseline)
+            + pdf_string(value) + b" Tj ET Q EMC\n")
+        return stream
+
+
+def load_form_template(path):
+    """Load a form template, reusing the parsed copy while the file is unchanged"""
+    path = Path(path).resolve()
+    mtime = path.stat().st_mtime
+    cached = _TEMPLATE_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, FormTemplate(path))
+        _TEMPLATE_CACHE[path] = cached
+    return cached[1]
+
+
+def form_values(data):
+    """Map certificate data (as built by app.py) to form field values"""
+    return {field: data[key] for field, key in FIELD_DATA_KEYS.items()}
+
+
+def fill_form(template, values, output, flatten=True):
+    """
+    Fill form fields by name and write the result
+
+    Args:
+        template: FormTemplate (see load_form_template)
+        values: Dictionary of field name -> text
+        output: Path or writable binary stream
+        flatten: Burn the values into the page content and drop the form
+    """
+    writer = PdfWriter()
+    for page in template.reader.pages:
+        writer.add_page(page)
+
+    font_refs = {NameObject(name): writer._add_object(standard_font(base_font))
+                 for name, base_font in FORM_FONTS.items()}
+
+    flattened = {}
+    for field, value in values.items():
+        info = template.fields.get(field)
+        if info is None:
+            raise KeyError(f"Form field not found in {template.path.name}: {field}")
+
+        appearance_ref = writer._add_object(
+            template.appearance_stream(field, value, font_refs[info["font"]]))
+        page = writer.pages[info["page"]]
+        widget = page["/Annots"][info["annot"]].get_object()
+
+        if flatten:
+            x1, y1 = info["rect"][:2]
+            name = f"/GCFld{len(flattened.setdefault(info['page'], []))}"
+            flattened[info["page"]].append((name, appearance_ref, x1, y1))
+        else:
+            widget[NameObject("/V")] = TextStringObject(value)
+            widget[NameObject("/AP")] = DictionaryObject({NameObject("/N"): appearance_ref})
+
+    if flatten:
+        for page_index, placements in flattened.items():
+            _flatten_page(writer, writer.pages[page_index], placements)
+        for page in writer.pages:
+            if "/Annots" in page:
+                del page["/Annots"]
+    else:
+        form = template.reader.trailer["/Root"]["/AcroForm"]
+        acro_form = DictionaryObject({
+            NameObject("/Fields"): ArrayObject(
+                writer.pages[info["page"]]["/Annots"][info["annot"]]
+                for info in template.fields.values()),
+            NameObject("/DA"): TextStringObject(form.get("/DA", "/Helv 10 Tf 0 g")),
+            NameObject("/DR"): DictionaryObject({
+                NameObject("/Font"): DictionaryObject(font_refs),
+            }),
+            NameObject("/NeedAppearances"): NameObject("/false"),
+        })
+        writer._root_object[NameObject("/AcroForm")] = writer._add_object(acro_form)
+
+    if hasattr(output, "write"):
+        writer.write(output)
+    else:
+        with open(output, "wb") as output_file:
+            writer.write(output_file)
+
+
+def _flatten_page(writer, page, placements):
+    """Draw appearance XObjects into a page's content stream"""
+    resources = page["/Resources"]
+    if "/XObject" not in resources:
+        resources[NameObject("/XObject")] = DictionaryObject()
+    xobjects = resources["/XObject"]
+
+    ops = []
+    for name, appearance_ref, x, y in placements:
+        xobjects[NameObject(name)] = appearance_ref
+        ops.append(f"q 1 0 0 1 {x:g} {y:g} cm {name} Do Q")
+
+    append_page_content(writer, page, "\n".join(ops).encode() + b"\n")
+
+
+def fill_certificate(prefix, data, output, flatten=True):
+    """Fill a product's form template with certificate data"""
+    template = load_form_template(FORMS_DIR / FORM_TEMPLATES[prefix])
+    fill_form(template, form_values(data), output, flatten)
+
+
+def benchmark(prefix="SOSP", count=20):
+    """
+    Time the form-filling engine against app.py's overlay-merge path
+
+    Returns:
+        dict: Seconds per certificate for each engine
+    """
+    products_dir = Path(__file__).parent / "templates"
+    clean_template = products_dir / FORM_TEMPLATES[prefix].replace(".pdf", "_clean.pdf")
+    data = {
+        "serial": f"{prefix}55555",
+        "activation": "02/10/2025",
+        "lot": "TEST123456",
+        "gas_prod": "21/03/2024",
+        "calibration": "02/10/2025",
+        "calibration_exp": "02/10/2027",
+    }
+
+    def run_overlay():
+        merge_overlay(clean_template, create_text_overlay(data, prefix), io.BytesIO())
+
+    def run_form():
+        fill_certificate(prefix, data, io.BytesIO(), flatten=True)
+
+    results = {}
+    for name, run in (("overlay-merge (app.py)", run_overlay), ("acroform", run_form)):
+        run()  # warm up caches
+        start = time.perf_counter()
+        for _ in range(count):
+            run()
+        results[name] = (time.perf_counter() - start) / count
+    return results
+
+
+def main():
+    """Benchmark the engines for every product"""
+    print("=" * 70)
+    print("AcroForm Engine Benchmark")
+    print("=" * 70)
+
+    missing = [name for name in FORM_TEMPLATES.values() if not (FORMS_DIR / name).exists()]
+    if missing:
+        print(f"ERROR: Form templates not found in {FORMS_DIR}")
+        print("Please run: python create_form_templates.py")
+        return 1
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for prefix in FORM_TEMPLATES:
+        results = benchmark(prefix, count)
+        line = "  ".join(f"{name}: {seconds * 1000:.1f} ms" for name, seconds in results.items())
+        print(f"{prefix}: {line}")
+
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Invoice checksum manifests
+Certificates are hashed (SHA-256) while they are written, so no file is read
+back, and finishing an invoice writes manifest.csv and manifest.json into the
+invoice folder: serial, product, byte size, hash and generation time of
+every certificate. verify re-hashes a folder in parallel and reports any
+certificate that was changed, removed or added after issue.
+
+Usage:
+    python invoice_manifest.py verify output/Invoice_12345 [...]
+    python invoice_manifest.py write output/Invoice_12345   # manifest for an old folder
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+MANIFEST_CSV = "manifest.csv"
+MANIFEST_JSON = "manifest.json"
+MANIFEST_FIELDS = ("filename", "serial", "product", "size", "sha256", "generated")
+
+# Stub of a certificate compacted by lazy_archive.py (<serial>.lazy.json)
+LAZY_SUFFIX = ".lazy.json"
+
+WRITE_CHUNK = 1024 * 1024
+
+# hashlib releases the GIL on large buffers, so threads hash in parallel
+VERIFY_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+
+class HashingWriter:
+    """File wrapper that feeds every byte written into a SHA-256 digest"""
+
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def write_hashed(path, data):
+    """
+    Write PDF bytes to path, hashing them on the way
+
+    Returns:
+        tuple: (size in bytes, SHA-256 hex digest)
+    """
+    view = memoryview(data)
+    with open(path, "wb") as f:
+        tee = HashingWriter(f)
+        for offset in range(0, len(view), WRITE_CHUNK):
+            tee.write(view[offset:offset + WRITE_CHUNK])
+    return tee.size, tee.hexdigest()
+
+
+def file_hash(path):
+    """SHA-256 hex digest of a file on disk, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(WRITE_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def certificate_files(folder):
+    """Certificate PDFs of an invoice folder (not its Invoice_<n>.pdf bundle)"""
+    folder = Path(folder)
+    return sorted(path for path in folder.glob("*.pdf") if path.name != f"{folder.name}.pdf")
+
+
+def load_manifest(folder):
+    """An invoice folder's manifest.json, or None if it has none"""
+    path = Path(folder) / MANIFEST_JSON
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def read_manifest(folder):
+    """Entries of an invoice folder's manifest.json, or [] if it has none"""
+    manifest = load_manifest(folder)
+    return manifest["certificates"] if manifest else []
+
+
+def write_manifest(folder, entries, root="."):
+    """
+    Write manifest.csv and manifest.json for an invoice folder
+
+    Entries already in the folder's manifest are kept (an invoice finished
+    twice gets one manifest); new entries replace them by filename. Entries
+    without a hash or size (certificates from before hash-on-write) are
+    hashed from disk.
+
+    Args:
+        folder: Invoice folder
+        entries: Session journal entries (filename, serial, product, size,
+            sha256, generated)
+        root: Folder the filenames are relative to, relative to the invoice
+            folder ("." unless the output layout is sharded)
+
+    Returns:
+        list: The manifest rows written
+    """
+    folder = Path(folder)
+    base = folder / root
+    rows = {row["filename"]: row for row in read_manifest(folder)}
+    for entry in entries:
+        row = {field: entry.get(field) for field in MANIFEST_FIELDS}
+        path = base / row["filename"]
+        if row["sha256"] is None:
+            row["sha256"] = file_hash(path)
+        if row["size"] is None:
+            row["size"] = path.stat().st_size
+        rows[row["filename"]] = row
+    rows = sorted(rows.values(), key=lambda row: row["filename"])
+
+    manifest = {
+        "invoice": folder.name,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "algorithm": "sha256",
+        "root": str(root),
+        "certificates": rows,
+    }
+    partial = folder / f".{MANIFEST_JSON}.partial"
+    partial.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(partial, folder / MANIFEST_JSON)
+
+    partial = folder / f".{MANIFEST_CSV}.partial"
+    with open(partial, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(partial, folder / MANIFEST_CSV)
+    return rows
+
+
+def verify_folder(folder, workers=VERIFY_WORKERS):
+    """
+    Check every certificate of an invoice folder against its manifest
+
+    Certificates compacted by lazy_archive.py count as "lazy" when their
+    stub records the manifest hash ("lazy_archive.py get" re-renders and
+    checks them).
+
+    Returns:
+        dict: {"ok": [...], "modified": [...], "missing": [...], "lazy": [...],
+        "unlisted": [...]} (lists of filenames)
+    """
+    folder = Path(folder)
+    manifest = load_manifest(folder)
+    if not manifest:
+        raise FileNotFoundError(f"No {MANIFEST_JSON} in {folder}")
+    rows = manifest["certificates"]
+    base = folder / manifest.get("root", ".")
+
+    def check(row):
+        path = base / row["filename"]
+        try:
+            if path.stat().st_size != row["size"]:
+                return "modified"
+            return "ok" if file_hash(path) == row["sha256"] else "modified"
+        except FileNotFoundError:
+            stub = path.with_name(path.stem + LAZY_SUFFIX)
+            if stub.exists() and json.loads(stub.read_text(encoding="utf-8"))["sha256"] == row["sha256"]:
+                return "lazy"
+            return "missing"
+
+    result = {"ok": [], "modified": [], "missing": [], "lazy": [], "unlisted": []}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for row, status in zip(rows, executor.map(check, rows)):
+            result[status].append(row["filename"])
+
+    # A sharded invoice folder holds no certificates of its own
+    listed = {row["filename"] for row in rows}
+    result["unlisted"] = [path.name for path in certificate_files(folder) if path.name not in listed]
+    return result
+
+
+def main():
+    """Verify or (re)write invoice manifests"""
+    if len(sys.argv) < 3 or sys.argv[1] not in ("verify", "write"):
+        print(__doc__)
+        return 1
+
+    command, folders = sys.argv[1], sys.argv[2:]
+    print("=" * 70)
+    print("Invoice Manifest")
+    print("=" * 70)
+
+    if command == "write":
+        for folder in folders:
+            listed = {row["filename"] for row in read_manifest(folder)}
+            rows = write_manifest(folder, [{"filename": path.name, "serial": path.stem}
+                                           for path in certificate_files(folder)
+                                           if path.name not in listed])
+            print(f"✓ {folder}: {len(rows)} certificates")
+        print("=" * 70)
+        return 0
+
+    failed = False
+    for folder in folders:
+        start = time.perf_counter()
+        try:
+            result = verify_folder(folder)
+        except FileNotFoundError as e:
+            print(f"✗ {e}")
+            failed = True
+            continue
+        elapsed = time.perf_counter() - start
+        problems = {status: names for status, names in result.items()
+                    if status not in ("ok", "lazy") and names}
+        if problems:
+            failed = True
+            print(f"✗ {folder}: {len(result['ok'])} certificates unchanged")
+            for status, names in problems.items():
+                for name in names:
+                    print(f"  {status}: {name}")
+        else:
+            lazy = f", {len(result['lazy'])} compacted" if result["lazy"] else ""
+            print(f"✓ {folder}: {len(result['ok'])} certificates verified in {elapsed:.2f}s{lazy}")
+    print("=" * 70)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Staged invoice folders
+Certificates of a session are written into a hidden staging folder
+(output/.session-<time>-<pid>/) and the invoice is finished with one atomic
+directory rename, so an invoice folder is either complete or absent.
+
+When the rename is not possible - the invoice folder already exists, or it
+is on another filesystem - the files are moved or copied in parallel with
+progress reporting, into a hidden folder that is renamed into place last.
+With a sharded layout (output_layout.py) each certificate is moved to its
+own folder instead.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import errno
+import os
+import shutil
+
+from session_journal import JOURNAL_NAME
+
+STAGING_PREFIX = ".session-"
+
+# Threads for the copy fallback
+COPY_WORKERS = 8
+
+
+class StagingSession:
+    """Hidden folder holding the certificates of one unfinished invoice"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def create(cls, output_dir):
+        """Start a new staging folder"""
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        return cls(Path(output_dir) / f"{STAGING_PREFIX}{stamp}-{os.getpid()}")
+
+    @classmethod
+    def resume_or_create(cls, output_dir):
+        """Reuse the most recent unfinished staging folder, or start a new one"""
+        output_dir = Path(output_dir)
+        existing = sorted(path for path in output_dir.glob(f"{STAGING_PREFIX}*") if path.is_dir())
+        if existing:
+            return cls(existing[-1])
+        return cls.create(output_dir)
+
+    def files(self):
+        """Certificates staged so far"""
+        return sorted(path for path in self.path.iterdir()
+                      if path.is_file() and path.name != JOURNAL_NAME)
+
+    def finalize(self, invoice_folder, progress=None, placement=None):
+        """
+        Turn the staging folder into the invoice folder
+
+        Args:
+            invoice_folder: Final folder (e.g. output/Invoice_12345)
+            progress: Optional callback(done, total) for the copy fallback
+            placement: Optional {filename: target path} for sharded layouts
+                (see output_layout.py) - certificates are moved to their own
+                folders instead of renaming the staging folder
+
+        Returns:
+            list: Paths of the certificates in the invoice folder
+        """
+        invoice_folder = Path(invoice_folder)
+        names = [path.name for path in self.files()]
+
+        if placement is not None:
+            targets = [Path(placement.get(name, invoice_folder / name)) for name in names]
+            place_files(zip(self.files(), targets), progress)
+            invoice_folder.mkdir(parents=True, exist_ok=True)
+            shutil.rmtree(self.path, ignore_errors=True)
+            return targets
+
+        try:
+            os.rename(self.path, invoice_folder)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EEXIST, errno.ENOTEMPTY, errno.EISDIR):
+                raise
+            transfer_files(self.files(), invoice_folder, progress)
+            shutil.rmtree(self.path, ignore_errors=True)
+        else:
+            # The session journal travelled with the folder; the invoice is done
+            journal = invoice_folder / JOURNAL_NAME
+            if journal.exists():
+                journal.unlink()
+            if progress:
+                progress(len(names), len(names))
+        return [invoice_folder / name for name in names]
+
+
+def _transfer(source, target):
+    """Move one file; across filesystems copy it under a temporary name first"""
+    try:
+        os.replace(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        partial = target.with_name(f".{target.name}.partial")
+        shutil.copy2(source, partial)
+        os.replace(partial, target)
+        os.unlink(source)
+
+
+def transfer_files(files, target_dir, progress=None, workers=COPY_WORKERS):
+    """
+    Move files into target_dir in parallel
+
+    A new target_dir is assembled as a hidden sibling and renamed into place
+    when complete; an existing one receives the files one by one.
+    """
+    target_dir = Path(target_dir)
+    files = list(files)
+    if target_dir.exists():
+        destination = target_dir
+    else:
+        destination = target_dir.with_name(f".{target_dir.name}.partial")
+        destination.mkdir(parents=True, exist_ok=True)
+
+    place_files([(path, destination / path.name) for path in files], progress, workers)
+
+    if destination != target_dir:
+        os.rename(destination, target_dir)
+
+
+def place_files(moves, progress=None, workers=COPY_WORKERS):
+    """
+    Move (source, target) pairs in parallel, creating target folders as needed
+
+    Args:
+        moves: Iterable of (source path, target path)
+        progress: Optional callback(done, total)
+    """
+    moves = [(Path(source), Path(target)) for source, target in moves]
+
+    def move(source, target):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        _transfer(source, target)
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(move, source, target) for source, target in moves]
+        for future in futures:
+            future.result()
+            done += 1
+            if progress:
+                progress(done, len(moves))
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Streaming ZIP invoice packages
+Certificates are written into Invoice_<n>.zip one at a time as they are
+generated, so the invoice never has to exist as loose files or in memory at
+once. Each entry is deflated only when a quick probe shows the PDF still
+compresses; certificates whose streams are already Flate-compressed are
+stored as-is. A manifest.json entry is written last.
+
+Usage:
+    python invoice_zip.py output/Invoice_12345   # package a finished folder
+"""
+
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import json
+import os
+import sys
+import zipfile
+import zlib
+
+MANIFEST_NAME = "manifest.json"
+
+# Deflate an entry only if the probe shrinks by at least this much
+MIN_DEFLATE_GAIN = 0.10
+PROBE_CHUNK = 32 * 1024
+STREAM_CHUNK = 1024 * 1024
+
+
+def choose_compression(sample):
+    """ZIP_DEFLATED if a fast deflate of the sample saves MIN_DEFLATE_GAIN, else ZIP_STORED"""
+    if not sample:
+        return zipfile.ZIP_STORED
+    probe = zlib.compress(sample, 1)
+    if len(probe) <= (1 - MIN_DEFLATE_GAIN) * len(sample):
+        return zipfile.ZIP_DEFLATED
+    return zipfile.ZIP_STORED
+
+
+def probe_sample(data):
+    """Start, middle and end of a PDF (its bytes or an open binary file)"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        size = len(data)
+        middle = max(size // 2 - PROBE_CHUNK // 2, 0)
+        return b"".join(bytes(part) for part in
+                        (data[:PROBE_CHUNK], data[middle:middle + PROBE_CHUNK], data[-PROBE_CHUNK:]))
+
+    size = os.fstat(data.fileno()).st_size
+    sample = b""
+    for offset in (0, max(size // 2 - PROBE_CHUNK // 2, 0), max(size - PROBE_CHUNK, 0)):
+        data.seek(offset)
+        sample += data.read(PROBE_CHUNK)
+    data.seek(0)
+    return sample
+
+
+def member_location(archive, name):
+    """
+    Where a certificate inside an invoice ZIP is recorded (ledger, journal):
+    "<archive path>!/<member name>", which is never a file on disk
+    """
+    return f"{archive}!/{name}"
+
+
+def split_location(location):
+    """(archive Path, member name) of a member_location, or (Path, None) for a file"""
+    archive, separator, name = str(location).rpartition("!/")
+    if not separator:
+        return Path(location), None
+    return Path(archive), name
+
+
+def read_location(location):
+    """PDF bytes of a certificate file or of a member_location"""
+    archive, name = split_location(location)
+    if name is None:
+        return archive.read_bytes()
+    with zipfile.ZipFile(archive) as package:
+        return package.read(name)
+
+
+class InvoiceZipWriter:
+    """
+    Write an invoice ZIP entry by entry
+
+    The archive is built as <name>.zip.partial and renamed into place by
+    close(), after the manifest, so a ZIP with the final name is complete.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.partial = self.path.with_name(self.path.name + ".partial")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.zip = zipfile.ZipFile(self.partial, "w", allowZip64=True)
+        self.entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _entry_info(self, name, compression):
+        info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+        info.compress_type = compression
+        info.external_attr = 0o644 << 16
+        return info
+
+    def _record(self, info, sha256, meta):
+        stored = self.zip.getinfo(info.filename)
+        entry = {
+            "filename": info.filename,
+            "size": stored.file_size,
+            "stored_size": stored.compress_size,
+            "method": "deflated" if info.compress_type == zipfile.ZIP_DEFLATED else "stored",
+            "sha256": sha256,
+        }
+        entry.update(meta or {})
+        self.entries.append(entry)
+
+    def add(self, name, data, meta=None):
+        """
+        Add one certificate from memory
+
+        Args:
+            name: Entry name (e.g. D4PQ236599.pdf)
+            data: PDF bytes
+            meta: Extra manifest fields (serial, product, ...)
+        """
+        info = self._entry_info(name, choose_compression(probe_sample(data)))
+        self.zip.writestr(info, data)
+        self._record(info, hashlib.sha256(data).hexdigest(), meta)
+
+    def add_file(self, path, name=None, meta=None):
+        """Add one certificate from disk, streamed in chunks"""
+        path = Path(path)
+        digest = hashlib.sha256()
+        with open(path, "rb") as source:
+            info = self._entry_info(name or path.name, choose_compression(probe_sample(source)))
+            with self.zip.open(info, "w", force_zip64=True) as target:
+                for chunk in iter(lambda: source.read(STREAM_CHUNK), b""):
+                    digest.update(chunk)
+                    target.write(chunk)
+        self._record(info, digest.hexdigest(), meta)
+
+    def close(self):
+        """Write the manifest and move the finished ZIP into place"""
+        manifest = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "certificates": len(self.entries),
+            "total_size": sum(entry["size"] for entry in self.entries),
+            "stored_size": sum(entry["stored_size"] for entry in self.entries),
+            "entries": self.entries,
+        }
+        self.zip.writestr(self._entry_info(MANIFEST_NAME, zipfile.ZIP_DEFLATED),
+                          json.dumps(manifest, indent=2))
+        self.zip.close()
+        os.replace(self.partial, self.path)
+
+    def abort(self):
+        """Discard an unfinished archive"""
+        self.zip.close()
+        if self.partial.exists():
+            self.partial.unlink()
+
+
+def zip_folder(folder, zip_path=None, files=None):
+    """
+    Package an invoice folder's certificates, one file at a time
+
+    Args:
+        files: Certificates to package instead of the folder's PDFs
+            (sharded layouts keep them outside the invoice folder)
+
+    Returns:
+        Path: The ZIP written (default: next to the folder, <folder>.zip)
+    """
+    folder = Path(folder)
+    zip_path = Path(zip_path) if zip_path else folder.with_name(folder.name + ".zip")
+    with InvoiceZipWriter(zip_path) as package:
+        for pdf in sorted(files if files is not None else folder.glob("*.pdf")):
+            package.add_file(pdf, meta={"serial": Path(pdf).stem})
+    return zip_path
+
+
+def main():
+    """Package existing invoice folders"""
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+
+    print("=" * 70)
+    print("Invoice ZIP Package")
+    print("=" * 70)
+    for folder in sys.argv[1:]:
+        zip_path = zip_folder(folder)
+        with zipfile.ZipFile(zip_path) as package:
+            manifest = json.loads(package.read(MANIFEST_NAME))
+        print(f"✓ {zip_path}: {manifest['certificates']} certificates, "
+              f"{manifest['total_size'] / 1024:.0f} KB → {manifest['stored_size'] / 1024:.0f} KB")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Lazy certificate archive
+The only unique content of a certificate is its record - six strings over
+one of the product templates. Archived certificates can be compacted into a
+stub (<serial>.lazy.json, about 500 bytes) holding the record, the SHA-256
+of the template it was rendered on, the overlay layout version and the hash
+of the PDF. The PDF is re-rendered through the overlay engine on demand and
+checked against that hash; recently materialized certificates are kept in an
+LRU cache (output/.materialized/).
+
+A PDF is only replaced by a stub after it has been re-rendered byte for byte,
+so nothing is compacted that could not be reproduced. Template revisions are
+kept by hash in output/.templates/.
+
+Usage:
+    python lazy_archive.py compact output/invoices [--older-than 90]
+    python lazy_archive.py get D4PQ236599 [--to D4PQ236599.pdf]
+    python lazy_archive.py rerender reissue/ [--prefix D4PQ]   # after a template revision
+"""
+
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+from certificate_engine import PRODUCTS, TEMPLATES_DIR, OverlayMergeEngine, overlay_layout_version
+from certificate_ledger import LEDGER_FILE, CertificateLedger, template_hash
+from invoice_manifest import LAZY_SUFFIX, file_hash, write_hashed
+from invoice_zip import read_location, split_location
+from output_layout import SerialIndex
+from output_profiles import PROFILES, profile_template
+from pdf_output import finish_pdf
+
+TEMPLATE_STORE = ".templates"
+CACHE_DIR = ".materialized"
+CACHE_BYTES = 512 * 1024 * 1024
+
+RECORD_KEYS = ("prefix", "serial", "activation", "lot", "gas_prod", "calibration", "calibration_exp")
+
+# Finishing a stored PDF may have had (see pdf_output.finish_pdf), cheapest first
+FINISH_VARIANTS = [(False, False), (False, True), (True, False), (True, True)]
+
+
+def stub_path(pdf_path):
+    """Stub that stands in for a compacted certificate"""
+    pdf_path = Path(pdf_path)
+    return pdf_path.with_name(pdf_path.stem + LAZY_SUFFIX)
+
+
+class TemplateStore:
+    """Template revisions by SHA-256 (output/.templates/<hash>.pdf)"""
+
+    def __init__(self, root):
+        self.path = Path(root) / TEMPLATE_STORE
+        self._loaded = {}
+
+    def add(self, template):
+        """Keep a template file; returns its hash"""
+        digest = template_hash(template)
+        target = self.path / f"{digest}.pdf"
+        if not target.exists():
+            self.path.mkdir(parents=True, exist_ok=True)
+            partial = target.with_name(f".{target.name}.partial")
+            shutil.copyfile(template, partial)
+            os.replace(partial, target)
+        return digest
+
+    def get(self, digest):
+        """Template bytes for a hash, or None if that revision was never stored"""
+        if digest not in self._loaded:
+            path = self.path / f"{digest}.pdf"
+            if not path.exists():
+                return None
+            self._loaded[digest] = path.read_bytes()
+        return self._loaded[digest]
+
+
+class MaterializedCache:
+    """
+    Size-bounded LRU cache of re-rendered certificates on disk
+
+    Recency is the file's modification time, so the order survives restarts.
+    """
+
+    def __init__(self, path, max_bytes=CACHE_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.path.glob("*.pdf"), key=lambda file: file.stat().st_mtime)
+        self._sizes = OrderedDict((file.name, file.stat().st_size) for file in files)
+        self.size = sum(self._sizes.values())
+
+    def get(self, name):
+        """Cached bytes (marked as recently used), or None"""
+        if name not in self._sizes:
+            return None
+        path = self.path / name
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            self.size -= self._sizes.pop(name)
+            return None
+        os.utime(path)
+        self._sizes.move_to_end(name)
+        return data
+
+    def put(self, name, data):
+        """Add bytes, evicting the least recently used files over max_bytes"""
+        if name in self._sizes:
+            self.size -= self._sizes.pop(name)
+        write_hashed(self.path / name, data)
+        self._sizes[name] = len(data)
+        self.size += len(data)
+        while self.size > self.max_bytes and len(self._sizes) > 1:
+            oldest, size = self._sizes.popitem(last=False)
+            (self.path / oldest).unlink(missing_ok=True)
+            self.size -= size
+
+
+class LazyArchive:
+    """Compact certificates into stubs and re-render them on demand"""
+
+    def __init__(self, root, ledger_path=LEDGER_FILE, cache_bytes=CACHE_BYTES):
+        self.root = Path(root)
+        self.ledger_path = ledger_path
+        self.templates = TemplateStore(self.root)
+        self.cache = MaterializedCache(self.root / CACHE_DIR, cache_bytes)
+        # Only the pikepdf merge reproduces its output byte for byte
+        self.engine = OverlayMergeEngine("pikepdf")
+
+    def _template(self, prefix, digest):
+        """Template bytes with the given hash, storing the current revision if it matches"""
+        data = self.templates.get(digest)
+        if data is None:
+            for profile in PROFILES:
+                template = profile_template(TEMPLATES_DIR / PRODUCTS[prefix]["template"], profile)
+                if template_hash(template) == digest:
+                    self.templates.add(template)
+                    return self.templates.get(digest)
+        return data
+
+    def compact(self, paths, progress=None):
+        """
+        Replace certificates by stubs where a re-render reproduces them exactly
+
+        Args:
+            paths: Certificate PDFs
+            progress: Optional callback(done, total)
+
+        Returns:
+            tuple: (stubbed paths, [(path, reason) not compacted])
+        """
+        paths = [Path(path) for path in paths]
+        stubbed, kept = [], []
+        with CertificateLedger(self.ledger_path) as ledger:
+            for done, path in enumerate(paths, 1):
+                row = ledger.lookup(path.stem)
+                reason = None
+                if row is None:
+                    reason = "not in the ledger"
+                else:
+                    record = {key: row[key] for key in RECORD_KEYS}
+                    template = self._template(row["prefix"], row["template_hash"])
+                    if template is None:
+                        reason = "template revision not available"
+                    else:
+                        finish = self._reproduce(record, template, file_hash(path))
+                        if finish is None:
+                            reason = "re-render differs"
+                if reason:
+                    kept.append((path, reason))
+                else:
+                    self._write_stub(path, row, record, finish)
+                    stubbed.append(path)
+                if progress:
+                    progress(done, len(paths))
+        return stubbed, kept
+
+    def _reproduce(self, record, template, sha256):
+        """(linearize, compact) that re-renders to sha256, or None"""
+        rendered = self.engine.render_with_template(record, template)
+        for linearize, compact in FINISH_VARIANTS:
+            finished = finish_pdf(rendered, linearize, compact)
+            if hashlib.sha256(finished).hexdigest() == sha256:
+                return {"linearize": linearize, "compact": compact}
+        return None
+
+    def _write_stub(self, path, row, record, finish):
+        stub = {
+            "serial": row["serial"],
+            "product": row["product"],
+            "invoice": row["invoice"],
+            "record": record,
+            "template_hash": row["template_hash"],
+            "layout_version": overlay_layout_version(row["prefix"]),
+            "finish": finish,
+            "sha256": file_hash(path),
+            "size": path.stat().st_size,
+        }
+        target = stub_path(path)
+        partial = target.with_name(f".{target.name}.partial")
+        partial.write_text(json.dumps(stub, indent=2), encoding="utf-8")
+        os.replace(partial, target)
+        path.unlink()
+
+    def locate(self, serial):
+        """Certificate path of a serial (serial index, then ledger), or None"""
+        path = None
+        if any(self.root.glob(".serial_index*")):
+            with SerialIndex(self.root) as index:
+                path = index.lookup(serial)
+        if path is None:
+            with CertificateLedger(self.ledger_path) as ledger:
+                row = ledger.lookup(serial)
+            path = Path(row["output_path"]) if row and row["output_path"] else None
+        return path
+
+    def materialize(self, serial):
+        """
+        PDF bytes of a certificate, re-rendered from its stub if compacted
+
+        Raises:
+            FileNotFoundError: Neither the PDF nor a stub exists
+            ValueError: The stub's template revision or layout is not
+                available, or the re-render does not match its hash
+        """
+        path = self.locate(serial)
+        if path is None:
+            raise FileNotFoundError(f"{serial} is not in the archive")
+        if split_location(path)[1] is not None:
+            return read_location(path)  # delivered inside an invoice ZIP
+        if path.exists():
+            return path.read_bytes()
+        stub_file = stub_path(path)
+        if not stub_file.exists():
+            raise FileNotFoundError(f"{path} is missing and has no stub")
+        stub = json.loads(stub_file.read_text(encoding="utf-8"))
+
+        cached = self.cache.get(f"{serial}.pdf")
+        if cached is not None and hashlib.sha256(cached).hexdigest() == stub["sha256"]:
+            return cached
+
+        record = stub["record"]
+        if stub["layout_version"] != overlay_layout_version(record["prefix"]):
+            raise ValueError(f"{serial}: the overlay layout changed since it was compacted")
+        template = self._template(record["prefix"], stub["template_hash"])
+        if template is None:
+            raise ValueError(f"{serial}: template revision {stub['template_hash'][:12]} not available")
+        pdf = finish_pdf(self.engine.render_with_template(record, template),
+                         stub["finish"]["linearize"], stub["finish"]["compact"])
+        if hashlib.sha256(pdf).hexdigest() != stub["sha256"]:
+            raise ValueError(f"{serial}: re-rendered PDF does not match the archived hash")
+        self.cache.put(f"{serial}.pdf", pdf)
+        return pdf
+
+    def stubs(self, prefix=None):
+        """All stubs below the root (hidden folders skipped)"""
+        found = []
+        for folder, dirs, files in os.walk(self.root):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            found.extend(Path(folder) / name for name in files if name.endswith(LAZY_SUFFIX))
+        stubs = [json.loads(path.read_text(encoding="utf-8")) for path in sorted(found)]
+        return [stub for stub in stubs if prefix is None or stub["record"]["prefix"] == prefix]
+
+    def rerender(self, output_dir, prefix=None, progress=None):
+        """
+        Render every compacted certificate issued on an older template
+        revision again, on the current template, into output_dir
+
+        The stubs keep describing the certificates as issued. Rendering is
+        batched (OverlayMergeEngine.render_many).
+
+        Returns:
+            list: Paths written
+        """
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        current = {code: template_hash(self.engine.template_path(code)) for code in PRODUCTS}
+        records = [stub["record"] for stub in self.stubs(prefix)
+                   if stub["template_hash"] != current[stub["record"]["prefix"]]]
+        written = []
+        for record, pdf in self.engine.render_many(records):
+            path = output_dir / f"{record['serial']}.pdf"
+            write_hashed(path, pdf)
+            written.append(path)
+            if progress:
+                progress(len(written), len(records))
+        return written
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Lazy certificate archive")
+    parser.add_argument("--root", default="output", help="Output folder (default: output)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact_args = commands.add_parser("compact", help="Replace reproducible certificates by stubs")
+    compact_args.add_argument("folders", nargs="+")
+    compact_args.add_argument("--older-than", type=int, default=0, metavar="DAYS",
+                              help="Only certificates not modified for DAYS days")
+    get_args = commands.add_parser("get", help="Materialize a certificate")
+    get_args.add_argument("serial")
+    get_args.add_argument("--to", help="Write the PDF here (default: <serial>.pdf)")
+    rerender_args = commands.add_parser("rerender", help="Re-render on the current templates")
+    rerender_args.add_argument("output_dir")
+    rerender_args.add_argument("--prefix", choices=sorted(PRODUCTS))
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("Lazy Certificate Archive")
+    print("=" * 70)
+    archive = LazyArchive(args.root)
+
+    if args.command == "compact":
+        cutoff = time.time() - timedelta(days=args.older_than).total_seconds()
+        paths = [path for folder in args.folders for path in sorted(Path(folder).rglob("*.pdf"))
+                 if not any(part.startswith(".") for part in path.parts)
+                 and path.name != f"{path.parent.name}.pdf" and path.stat().st_mtime <= cutoff]
+        before = sum(path.stat().st_size for path in paths)
+        stubbed, kept = archive.compact(paths)
+        after = sum(stub_path(path).stat().st_size for path in stubbed)
+        saved = sum(path.stat().st_size for path, _ in kept)
+        print(f"✓ {len(stubbed)} certificate(s) compacted: "
+              f"{(before - saved) / 1024:.0f} KB → {after / 1024:.1f} KB")
+        for path, reason in kept:
+            print(f"  kept {path.name}: {reason}")
+    elif args.command == "get":
+        start = time.perf_counter()
+        pdf = archive.materialize(args.serial.upper())
+        target = Path(args.to or f"{args.serial.upper()}.pdf")
+        write_hashed(target, pdf)
+        print(f"✓ {target} ({len(pdf) / 1024:.0f} KB) in {time.perf_counter() - start:.2f}s")
+    else:
+        written = archive.rerender(args.output_dir, args.prefix)
+        print(f"✓ {len(written)} certificate(s) re-rendered into {args.output_dir}")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Output folder layout
+By default finished certificates live in output/Invoice_<number>/. For large
+archives engine_config.json can shard them instead:
+
+    {"output": {"layout": "{prefix}/{yyyy}/{shard}"}}
+
+Fields: {prefix}, {serial}, {shard} (last 3 digits of the serial), {yyyy} and
+{mm} (calibration date) and {invoice}. With a sharded layout the invoice
+folder (output/invoices/Invoice_<number>/) keeps only the manifest and the
+optional bundle. Every finished certificate is recorded in a serial index
+(output/.serial_index, dbm) so a serial resolves to its file in O(1) without
+listing folders.
+
+Usage:
+    python output_layout.py migrate [output] [--workers 8] [--dry-run]
+    python output_layout.py find SERIAL [...]
+"""
+
+from datetime import datetime
+from pathlib import Path
+import argparse
+import dbm
+import os
+import sys
+
+from certificate_engine import PRODUCTS, output_options
+from certificate_ledger import LEDGER_FILE, CertificateLedger
+from invoice_manifest import (MANIFEST_CSV, MANIFEST_JSON, certificate_files, load_manifest,
+                              write_manifest)
+from invoice_staging import COPY_WORKERS, STAGING_PREFIX, place_files
+
+DEFAULT_LAYOUT = "Invoice_{invoice}"
+INVOICES_DIR = "invoices"
+INDEX_NAME = ".serial_index"
+
+
+def serial_prefix(serial):
+    """Product prefix of a full serial (longest matching prefix), or None"""
+    matches = [prefix for prefix in PRODUCTS if serial.startswith(prefix)]
+    return max(matches, key=len) if matches else None
+
+
+class SerialIndex:
+    """Persistent serial -> certificate path map (dbm), paths relative to the output folder"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db = dbm.open(str(self.root / INDEX_NAME), "c")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return len(self.db)
+
+    def update(self, paths):
+        """Record serial -> path pairs"""
+        for serial, path in paths.items():
+            path = Path(path)
+            try:
+                path = path.relative_to(self.root)
+            except ValueError:
+                pass
+            self.db[serial] = str(path)
+
+    def lookup(self, serial):
+        """Path of a serial's certificate, or None if it is not indexed"""
+        value = self.db.get(serial)
+        if value is None:
+            return None
+        return self.root / value.decode()
+
+
+class OutputLayout:
+    """Where finished certificates and invoice folders go below the output folder"""
+
+    def __init__(self, root, pattern=None):
+        self.root = Path(root)
+        self.pattern = pattern or output_options()["layout"]
+
+    @property
+    def sharded(self):
+        return self.pattern != DEFAULT_LAYOUT
+
+    def invoice_dir(self, invoice):
+        """Invoice folder: the certificates' folder, or only its manifest when sharded"""
+        if self.sharded:
+            return self.root / INVOICES_DIR / f"Invoice_{invoice}"
+        return self.root / f"Invoice_{invoice}"
+
+    def directory(self, record, invoice=None):
+        """Folder of one certificate (record as in certificate_engine.make_record)"""
+        if not self.sharded:
+            return self.invoice_dir(invoice) if invoice else self.root
+        serial = record["serial"]
+        if record.get("calibration"):
+            _, month, year = record["calibration"].split("/")
+        else:
+            month, year = f"{datetime.now():%m}", f"{datetime.now():%Y}"
+        return self.root / self.pattern.format(prefix=record["prefix"], serial=serial, shard=serial[-3:],
+                                               yyyy=year, mm=month, invoice=invoice or "unassigned")
+
+    def path(self, record, invoice=None):
+        return self.directory(record, invoice) / f"{record['serial']}.pdf"
+
+    def placement(self, entries, invoice):
+        """{filename: target path} for session journal entries, or None if not sharded"""
+        if not self.sharded:
+            return None
+        return {entry["filename"]: self.path(entry["data"], invoice) for entry in entries}
+
+    def finish_invoice(self, staging, entries, invoice, progress=None):
+        """
+        Move a staging session's certificates to their final place
+
+        The invoice manifest is written and the serial index updated.
+
+        Args:
+            staging: StagingSession holding the certificates
+            entries: Its session journal entries (SessionJournal.load)
+            invoice: Invoice number
+            progress: Optional callback(done, total)
+
+        Returns:
+            list: Paths of the certificates (invoice_dir(invoice) holds the manifest)
+        """
+        invoice_folder = self.invoice_dir(invoice)
+        moved = staging.finalize(invoice_folder, progress, self.placement(entries, invoice))
+        self.write_manifest(invoice_folder, entries, moved)
+        with SerialIndex(self.root) as index:
+            index.update({path.stem: path for path in moved})
+        return moved
+
+    def write_manifest(self, invoice_folder, entries, paths):
+        """Invoice manifest for certificates now at paths (see invoice_manifest.py)"""
+        if not self.sharded:
+            write_manifest(invoice_folder, entries)
+            return
+        located = {Path(path).name: Path(path) for path in paths}
+        write_manifest(invoice_folder,
+                       [dict(entry, filename=located[entry["filename"]].relative_to(self.root).as_posix())
+                        for entry in entries if entry["filename"] in located],
+                       os.path.relpath(self.root, invoice_folder))
+
+
+def archived_certificates(root):
+    """
+    Certificates already below the output folder, with the invoice each belongs to
+
+    Staging folders, hidden files and invoice bundles are skipped.
+
+    Returns:
+        list: (path, invoice or None) pairs
+    """
+    root = Path(root)
+    found = []
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        folder = Path(folder)
+        if folder.name.startswith(STAGING_PREFIX):
+            continue
+        invoice = folder.name[len("Invoice_"):] if folder.name.startswith("Invoice_") else None
+        for path in certificate_files(folder):
+            if not path.name.startswith("."):
+                found.append((path, invoice))
+    return found
+
+
+def migrate(root, layout, workers=COPY_WORKERS, ledger_path=LEDGER_FILE, dry_run=False, progress=None):
+    """
+    Reorganize an existing output folder into layout, in parallel
+
+    The record of each certificate (prefix, calibration date, invoice) comes
+    from the ledger; certificates the ledger doesn't know are placed by the
+    serial's prefix, the file date and the invoice folder they are in.
+    Invoice manifests are rewritten for the new paths, bundles move to the
+    new invoice folders, and the serial index and ledger paths are updated.
+
+    Returns:
+        dict: serial -> new path of every certificate that was moved
+    """
+    root = Path(root)
+    found = archived_certificates(root)
+    ledger = CertificateLedger(ledger_path) if Path(ledger_path).exists() else None
+
+    moves = []
+    for path, invoice in found:
+        row = ledger.lookup(path.stem) if ledger else None
+        if row is not None:
+            record = {"serial": row["serial"], "prefix": row["prefix"], "calibration": row["calibration"]}
+            invoice = row["invoice"] or invoice
+        else:
+            issued = datetime.fromtimestamp(path.stat().st_mtime)
+            record = {"serial": path.stem, "prefix": serial_prefix(path.stem) or "other",
+                      "calibration": f"{issued:%d/%m/%Y}"}
+        target = layout.path(record, invoice)
+        if target != path:
+            moves.append((path, target, invoice))
+
+    moved = {target.stem: target for _, target, _ in moves}
+    if dry_run:
+        if ledger:
+            ledger.close()
+        return moved
+
+    invoice_folders = [folder for folder in (*root.glob("Invoice_*"), *(root / INVOICES_DIR).glob("Invoice_*"))
+                       if folder.is_dir()]
+    place_files([(source, target) for source, target, _ in moves], progress, workers)
+    relocated = {source: target for source, target, _ in moves}
+
+    # Invoice folders follow: manifest rows point at the new paths, bundles move along
+    for folder in invoice_folders:
+        new_folder = layout.invoice_dir(folder.name[len("Invoice_"):])
+        manifest = load_manifest(folder)
+        for name in (MANIFEST_JSON, MANIFEST_CSV):
+            if (folder / name).exists():
+                (folder / name).unlink()
+        if new_folder != folder:
+            new_folder.mkdir(parents=True, exist_ok=True)
+            for leftover in folder.iterdir():
+                if leftover.is_file():
+                    os.replace(leftover, new_folder / leftover.name)
+            if not any(folder.iterdir()):
+                folder.rmdir()
+        if manifest:
+            base = folder / manifest.get("root", ".")
+            paths = [Path(os.path.normpath(base / row["filename"])) for row in manifest["certificates"]]
+            paths = [relocated.get(path, path) for path in paths]
+            layout.write_manifest(new_folder, [dict(row, filename=path.name) for row, path
+                                               in zip(manifest["certificates"], paths)], paths)
+
+    # Shard and invoice folders left empty by the move
+    for folder in sorted({source.parent for source in relocated} | {root / INVOICES_DIR},
+                         key=lambda folder: len(folder.parts), reverse=True):
+        while folder != root and folder.is_dir() and not any(folder.iterdir()):
+            folder.rmdir()
+            folder = folder.parent
+
+    with SerialIndex(root) as index:
+        index.update({path.stem: path for path, _ in found})
+        index.update(moved)
+    if ledger:
+        ledger.set_paths(moved)
+        ledger.close()
+    return moved
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Sharded output layout tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_args = commands.add_parser("migrate", help="Reorganize an output folder into the configured layout")
+    migrate_args.add_argument("output", nargs="?", default="output")
+    migrate_args.add_argument("--layout", help="Layout pattern (default: engine_config.json)")
+    migrate_args.add_argument("--workers", type=int, default=COPY_WORKERS)
+    migrate_args.add_argument("--dry-run", action="store_true", help="Only count what would move")
+    find_args = commands.add_parser("find", help="Path of a certificate from the serial index")
+    find_args.add_argument("serials", nargs="+")
+    find_args.add_argument("--output", default="output")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("Output Layout")
+    print("=" * 70)
+
+    if args.command == "find":
+        with SerialIndex(args.output) as index:
+            for serial in args.serials:
+                path = index.lookup(serial.upper())
+                print(f"{serial}: {path if path else 'not indexed'}")
+        print("=" * 70)
+        return 0
+
+    layout = OutputLayout(args.output, args.layout)
+    print(f"Layout: {layout.pattern}")
+
+    def show_progress(done, total):
+        if done == total or done % 1000 == 0:
+            print(f"  {done}/{total} moved")
+
+    moved = migrate(args.output, layout, args.workers, dry_run=args.dry_run, progress=show_progress)
+    verb = "would move" if args.dry_run else "moved"
+    print(f"✓ {len(moved)} certificate(s) {verb}")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
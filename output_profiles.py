@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Output profiles for certificate templates
+Derives a lighter variant of each template once per profile, so certificates
+can be generated for print, e-mail or long-term archive at no extra cost per
+certificate.
+
+Most of a clean template's 1.3 MB is not artwork: Illustrator keeps its
+private document data (/PieceInfo), an XMP metadata packet and page
+thumbnails in the PDF. The profiles drop what their use does not need and
+downsample images larger than they can show.
+
+Usage:
+    python output_profiles.py [profile]   # derive every template, print sizes
+"""
+
+from pathlib import Path
+import hashlib
+import io
+import json
+import os
+import sys
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+BASE_DIR = Path(__file__).parent
+VARIANTS_DIR = BASE_DIR / "template_variants"
+
+# Profile parameters. "print" is the template as designed.
+PROFILES = {
+    "print": {},
+    "email": {
+        "strip_private_data": True,
+        "strip_metadata": True,
+        "strip_thumbnails": True,
+        "max_image_pixels": 1200,
+        "jpeg_quality": 75,
+    },
+    "archive": {
+        "strip_private_data": True,
+        "strip_thumbnails": True,
+    },
+}
+
+_VARIANT_CACHE = {}
+
+
+def profile_key(template_bytes, params):
+    """Cache key for a template variant: template hash plus profile parameters"""
+    digest = hashlib.sha256(template_bytes)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def _downsample_images(pdf, max_pixels, quality):
+    """Re-encode 8-bit RGB/gray images whose long edge exceeds max_pixels as JPEG"""
+    from PIL import Image
+    from pikepdf import Name, PdfImage
+
+    for page in pdf.pages:
+        xobjects = page.obj.get("/Resources", {}).get("/XObject", {})
+        for raw_image in xobjects.values():
+            if raw_image.get("/Subtype") != "/Image":
+                continue
+            if max(raw_image.Width, raw_image.Height) <= max_pixels:
+                continue
+            if raw_image.get("/BitsPerComponent") != 8 or "/SMask" in raw_image or "/Decode" in raw_image:
+                continue
+
+            image = PdfImage(raw_image).as_pil_image()
+            if image.mode not in ("RGB", "L"):
+                continue
+            image.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+
+            jpeg = io.BytesIO()
+            image.save(jpeg, format="JPEG", quality=quality)
+            raw_image.write(jpeg.getvalue(), filter=Name.DCTDecode)
+            raw_image.Width, raw_image.Height = image.size
+            if "/DecodeParms" in raw_image:
+                del raw_image["/DecodeParms"]
+
+
+def derive_variant(template, output, params):
+    """
+    Write a profile variant of a template
+
+    The variant keeps a classic cross-reference table so the incremental
+    engine can still append to it.
+    """
+    if pikepdf is None:
+        raise RuntimeError("Output profiles need pikepdf: pip install pikepdf")
+
+    with pikepdf.open(str(template)) as pdf:
+        if params.get("strip_private_data"):
+            for obj in [pdf.Root] + [page.obj for page in pdf.pages]:
+                if "/PieceInfo" in obj:
+                    del obj["/PieceInfo"]
+        if params.get("strip_metadata") and "/Metadata" in pdf.Root:
+            del pdf.Root["/Metadata"]
+        if params.get("strip_thumbnails"):
+            for page in pdf.pages:
+                if "/Thumb" in page.obj:
+                    del page.obj["/Thumb"]
+        if params.get("max_image_pixels"):
+            _downsample_images(pdf, params["max_image_pixels"], params.get("jpeg_quality", 75))
+
+        pdf.save(str(output), compress_streams=True, recompress_flate=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.disable)
+
+
+def profile_template(template, profile="print"):
+    """
+    Template file to render from for an output profile
+
+    Variants are built on first use into template_variants/ and reused while
+    the template and the profile parameters are unchanged.
+
+    Returns:
+        Path: The template itself for "print", otherwise its variant
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown output profile: {profile}")
+    template = Path(template)
+    params = PROFILES[profile]
+    if not params:
+        return template
+
+    stat = template.stat()
+    memo_key = (template.resolve(), stat.st_mtime, stat.st_size, profile)
+    if memo_key in _VARIANT_CACHE:
+        return _VARIANT_CACHE[memo_key]
+
+    key = profile_key(template.read_bytes(), params)
+    variant = VARIANTS_DIR / f"{template.stem}.{profile}.{key}.pdf"
+    if not variant.exists():
+        VARIANTS_DIR.mkdir(exist_ok=True)
+        partial = variant.with_name(f"{variant.name}.{os.getpid()}.tmp")
+        derive_variant(template, partial, params)
+        partial.replace(variant)
+
+    _VARIANT_CACHE[memo_key] = variant
+    return variant
+
+
+def main():
+    """Derive the variants for every product template and report sizes"""
+    from certificate_engine import PRODUCTS, TEMPLATES_DIR
+
+    profiles = sys.argv[1:] or [name for name in PROFILES if PROFILES[name]]
+    print("=" * 70)
+    print("Template Output Profiles")
+    print("=" * 70)
+
+    for prefix, product in PRODUCTS.items():
+        template = TEMPLATES_DIR / product["template"]
+        sizes = [f"print: {template.stat().st_size / 1024:7.0f} KB"]
+        for profile in profiles:
+            variant = profile_template(template, profile)
+            sizes.append(f"{profile}: {variant.stat().st_size / 1024:7.0f} KB")
+        print(f"{prefix}: " + "  ".join(sizes))
+
+    print(f"\n✓ Variants in: {VARIANTS_DIR}")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Finishing steps for certificate PDFs
+Linearized ("fast web view") output for single certificates and invoice
+bundles, with a check of the linearization hint tables, so portal viewers can
+show page 1 before the whole file has downloaded. Compact output packs
+objects into PDF 1.5 object streams with a cross-reference stream and keeps
+one copy of identical objects - in a bundle every certificate repeats the
+same template objects.
+
+Usage:
+    python pdf_output.py check file.pdf [...]            # verify linearization
+    python pdf_output.py bundle out.pdf in1.pdf [...]    # linearized bundle
+    python pdf_output.py compact file.pdf [...]          # report compact sizes
+"""
+
+from pathlib import Path
+import hashlib
+import io
+import sys
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+
+def _require_pikepdf(feature):
+    if pikepdf is None:
+        raise RuntimeError(f"{feature} needs pikepdf: pip install pikepdf")
+
+
+def check_linearization(pdf):
+    """
+    Verify a PDF's linearization dictionary and hint tables
+
+    Args:
+        pdf: PDF bytes or path
+
+    Returns:
+        tuple: (is_valid, problems) - problems is a list of qpdf messages
+    """
+    _require_pikepdf("Checking linearization")
+    source = io.BytesIO(pdf) if isinstance(pdf, (bytes, bytearray)) else str(pdf)
+    with pikepdf.open(source) as document:
+        if not document.is_linearized:
+            return False, ["file is not linearized"]
+        report = io.StringIO()
+        try:
+            valid = document.check_linearization(report)
+        except pikepdf.PdfError as e:
+            return False, [str(e)]
+    problems = [line for line in report.getvalue().splitlines() if line.strip()]
+    return valid and not problems, problems
+
+
+def _object_key(obj):
+    """Identity of an indirect object's content, or None if it must stay unique"""
+    if isinstance(obj, pikepdf.Stream):
+        return b"S" + hashlib.sha256(obj.read_raw_bytes()).digest() + obj.stream_dict.unparse()
+    if isinstance(obj, pikepdf.Dictionary):
+        if obj.get("/Type") in ("/Page", "/Pages", "/Catalog"):
+            return None
+        return b"D" + obj.unparse()
+    if isinstance(obj, pikepdf.Array):
+        return b"A" + obj.unparse()
+    return None
+
+
+def _redirect_references(obj, replacements):
+    """Replace references to duplicate objects inside obj's direct contents"""
+    if isinstance(obj, pikepdf.Stream):
+        obj = obj.stream_dict
+    if isinstance(obj, pikepdf.Dictionary):
+        items = list(obj.items())
+    elif isinstance(obj, pikepdf.Array):
+        items = list(enumerate(obj))
+    else:
+        return
+    for key, value in items:
+        if not isinstance(value, pikepdf.Object):
+            continue
+        if value.is_indirect:
+            if value.objgen in replacements:
+                obj[key] = replacements[value.objgen]
+        else:
+            _redirect_references(value, replacements)
+
+
+def dedupe_objects(document, max_passes=10):
+    """
+    Keep one copy of identical streams, dictionaries and arrays
+
+    References to duplicates are pointed at the first copy, so qpdf drops
+    the duplicates when saving. Repeats until nothing changes, since merging
+    e.g. font files can make their font dictionaries identical.
+
+    Returns:
+        int: Number of duplicate objects removed
+    """
+    removed = 0
+    for _ in range(max_passes):
+        canonical = {}
+        replacements = {}
+        for obj in document.objects:
+            key = _object_key(obj)
+            if key is None:
+                continue
+            if key in canonical:
+                replacements[obj.objgen] = canonical[key]
+            else:
+                canonical[key] = obj
+        if not replacements:
+            break
+        for obj in document.objects:
+            _redirect_references(obj, replacements)
+        _redirect_references(document.trailer, replacements)
+        removed += len(replacements)
+    return removed
+
+
+def _save(document, output, linearize=False, compact=False):
+    """Save with the requested layout (same input, same bytes - see lazy_archive.py)"""
+    if compact:
+        dedupe_objects(document)
+        document.save(output, linearize=linearize, compress_streams=True,
+                      object_stream_mode=pikepdf.ObjectStreamMode.generate, deterministic_id=True)
+    else:
+        document.save(output, linearize=linearize, deterministic_id=True)
+
+
+def compact_pdf(pdf):
+    """
+    Rewrite PDF bytes with object streams, a cross-reference stream and no
+    duplicate objects
+
+    Returns:
+        bytes: The compact PDF
+    """
+    _require_pikepdf("Compact output")
+    output = io.BytesIO()
+    with pikepdf.open(io.BytesIO(pdf)) as document:
+        _save(document, output, compact=True)
+    return output.getvalue()
+
+
+def linearize_pdf(pdf, verify=True, compact=False):
+    """
+    Rewrite PDF bytes as a linearized file (also compact if asked)
+
+    Raises:
+        RuntimeError: If verify is set and the hint tables do not check out
+    """
+    _require_pikepdf("Linearized output")
+    output = io.BytesIO()
+    with pikepdf.open(io.BytesIO(pdf)) as document:
+        _save(document, output, linearize=True, compact=compact)
+    data = output.getvalue()
+
+    if verify:
+        valid, problems = check_linearization(data)
+        if not valid:
+            raise RuntimeError("Linearization check failed: " + "; ".join(problems))
+    return data
+
+
+def finish_pdf(pdf, linearize=False, compact=False):
+    """
+    Apply the configured finishing steps to a rendered certificate
+
+    Args:
+        pdf: Certificate PDF bytes (see CertificateEngine.render)
+        linearize: Write it linearized, with the hint tables verified
+        compact: Use object streams and a cross-reference stream, and drop
+            duplicate objects
+
+    Returns:
+        bytes: The PDF to write
+    """
+    if linearize:
+        return linearize_pdf(pdf, compact=compact)
+    if compact:
+        return compact_pdf(pdf)
+    return pdf
+
+
+def bundle_pdfs(pdfs, output, linearize=False, compact=False):
+    """
+    Combine certificates into one invoice PDF
+
+    Args:
+        pdfs: Certificate paths (or PDF bytes), in order
+        output: Path for the bundle
+        linearize: Write the bundle linearized, with the hint tables verified
+        compact: Share the objects the certificates have in common and use
+            object streams (see finish_pdf)
+    """
+    if pikepdf is None:
+        if linearize or compact:
+            _require_pikepdf("Linearized or compact output")
+        from PyPDF2 import PdfMerger
+
+        merger = PdfMerger()
+        for pdf in pdfs:
+            merger.append(io.BytesIO(pdf) if isinstance(pdf, (bytes, bytearray)) else str(pdf))
+        merger.write(str(output))
+        merger.close()
+        return
+
+    sources = []
+    bundle = pikepdf.new()
+    try:
+        for pdf in pdfs:
+            source = pikepdf.open(io.BytesIO(pdf) if isinstance(pdf, (bytes, bytearray)) else str(pdf))
+            sources.append(source)
+            bundle.pages.extend(source.pages)
+        _save(bundle, str(output), linearize=linearize, compact=compact)
+    finally:
+        bundle.close()
+        for source in sources:
+            source.close()
+
+    if linearize:
+        valid, problems = check_linearization(Path(output))
+        if not valid:
+            raise RuntimeError("Linearization check failed: " + "; ".join(problems))
+
+
+def main():
+    """Command line entry point"""
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ("check", "bundle", "compact"):
+        print(__doc__)
+        return 1
+
+    print("=" * 70)
+    print("Certificate PDF Output")
+    print("=" * 70)
+
+    if args[0] == "bundle":
+        if len(args) < 3:
+            print(__doc__)
+            return 1
+        bundle_pdfs(args[2:], args[1], linearize=True)
+        print(f"✓ Linearized bundle of {len(args) - 2} certificates: {args[1]}")
+        print("=" * 70)
+        return 0
+
+    if args[0] == "compact":
+        total_before = total_after = 0
+        for path in args[1:]:
+            data = Path(path).read_bytes()
+            compacted = compact_pdf(data)
+            total_before += len(data)
+            total_after += len(compacted)
+            print(f"{path}: {len(data) / 1024:8.0f} KB → {len(compacted) / 1024:8.0f} KB")
+        print(f"\nTotal: {total_before / 1024:.0f} KB → {total_after / 1024:.0f} KB "
+              f"({100 * (1 - total_after / max(total_before, 1)):.1f}% smaller)")
+        print("=" * 70)
+        return 0
+
+    failed = 0
+    for path in args[1:]:
+        valid, problems = check_linearization(Path(path))
+        if valid:
+            print(f"✓ {path}: linearized, hint tables valid")
+        else:
+            failed += 1
+            print(f"✗ {path}: {'; '.join(problems)}")
+    print("=" * 70)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
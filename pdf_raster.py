@@ -0,0 +1,76 @@
+"""
+PDF rasterization helpers for the calibration and checking tools
+Uses pdf2image (poppler) like coordinate_calibrator.py, and falls back to
+pypdfium2 when poppler is not installed.
+"""
+
+import numpy as np
+
+
+def _rasterize_pdf2image(pdf, dpi, first_page, last_page):
+    from pdf2image import convert_from_bytes, convert_from_path
+
+    kwargs = {"dpi": dpi, "grayscale": True}
+    if first_page is not None:
+        kwargs["first_page"] = first_page + 1
+    if last_page is not None:
+        kwargs["last_page"] = last_page + 1
+
+    if isinstance(pdf, (bytes, bytearray)):
+        images = convert_from_bytes(bytes(pdf), **kwargs)
+    else:
+        images = convert_from_path(str(pdf), **kwargs)
+    return [np.asarray(image.convert("L")) for image in images]
+
+
+def _rasterize_pdfium(pdf, dpi, first_page, last_page):
+    import pypdfium2 as pdfium
+
+    document = pdfium.PdfDocument(bytes(pdf) if isinstance(pdf, (bytes, bytearray)) else str(pdf))
+    try:
+        first = first_page or 0
+        last = len(document) - 1 if last_page is None else last_page
+        images = []
+        for index in range(first, last + 1):
+            bitmap = document[index].render(scale=dpi / 72, grayscale=True)
+            images.append(np.asarray(bitmap.to_pil().convert("L")))
+        return images
+    finally:
+        document.close()
+
+
+def rasterize_pdf(pdf, dpi=144, first_page=None, last_page=None, rasterizer=None):
+    """
+    Rasterize PDF pages to grayscale arrays
+
+    Args:
+        pdf: Path to a PDF file, or the PDF as bytes
+        dpi: Render resolution
+        first_page, last_page: Optional 0-indexed page range (inclusive)
+        rasterizer: "poppler" or "pdfium" to use only that one (e.g. for
+            pixel comparisons that must not depend on what is installed);
+            default: poppler, falling back to pdfium
+
+    Returns:
+        list: One uint8 array (height x width, 0 = black) per page
+    """
+    if rasterizer == "pdfium":
+        return _rasterize_pdfium(pdf, dpi, first_page, last_page)
+    if rasterizer == "poppler":
+        return _rasterize_pdf2image(pdf, dpi, first_page, last_page)
+    if rasterizer is not None:
+        raise ValueError(f"Unknown rasterizer: {rasterizer}")
+    try:
+        return _rasterize_pdf2image(pdf, dpi, first_page, last_page)
+    except Exception as pdf2image_error:
+        try:
+            return _rasterize_pdfium(pdf, dpi, first_page, last_page)
+        except ImportError:
+            raise RuntimeError(
+                "No PDF rasterizer available. Install poppler for pdf2image "
+                f"or run: pip install pypdfium2 ({pdf2image_error})")
+
+
+def ink_mask(image, threshold=128):
+    """Boolean mask of dark (inked) pixels in a grayscale raster"""
+    return image < threshold
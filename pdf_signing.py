@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+Digital signatures for certificates
+Signs finished certificates with a local PKCS#12 key (adbe.pkcs7.detached,
+the signature Acrobat shows in its signature panel). The key is loaded once
+per process and everything of the CMS signature that does not depend on the
+document - certificate, issuer and algorithm identifiers - is encoded once;
+signing a certificate then hashes its ByteRange in two parts without
+copying the file, signs the digest and appends a small incremental update
+(signature dictionary, signature field, page and catalog) in the file's own
+cross-reference format. An optional appearance shows the signer and time at
+SIGNATURE_BOX on page 1.
+
+batch_generate.py --sign KEY.p12 signs while writing, so the ledger and the
+manifest hash the signed files. The password comes from
+$GASCLIP_SIGN_PASSWORD or a prompt. Needs the cryptography package.
+
+Usage:
+    python pdf_signing.py sign KEY.p12 FILE_OR_FOLDER... --output signed [--appearance] [--workers N]
+    python pdf_signing.py verify FILE...
+    python pdf_signing.py create-key KEY.p12 --name "GasClip QA"   # self-signed, for testing
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+import argparse
+import getpass
+import hashlib
+import io
+import os
+import re
+import sys
+import time
+
+from certificate_engine import _serialize, pdf_string
+from invoice_manifest import write_hashed
+from product_coordinates import SIGNATURE_BOX
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+except ImportError:
+    x509 = None
+
+PASSWORD_ENV = "GASCLIP_SIGN_PASSWORD"
+
+# Bytes reserved for the CMS signature in /Contents
+SIGNATURE_SPACE = 8192
+# Files per task when signing in worker processes
+SIGN_CHUNK = 16
+
+# The signer loaded by a worker process (see sign_files)
+_SIGNER = None
+
+
+def _require_cryptography():
+    if x509 is None:
+        raise RuntimeError("Signing needs the cryptography package: pip install cryptography")
+
+
+# DER ------------------------------------------------------------------------
+
+def _der(tag, content):
+    """One DER element"""
+    if len(content) < 0x80:
+        return bytes([tag, len(content)]) + content
+    length = len(content).to_bytes((len(content).bit_length() + 7) // 8, "big")
+    return bytes([tag, 0x80 | len(length)]) + length + content
+
+
+def _der_sequence(*items):
+    return _der(0x30, b"".join(items))
+
+
+def _der_set(*items):
+    # DER orders SET OF by encoding
+    return _der(0x31, b"".join(sorted(items)))
+
+
+def _der_integer(value):
+    return _der(0x02, value.to_bytes(value.bit_length() // 8 + 1, "big", signed=True))
+
+
+def _der_oid(dotted):
+    numbers = [int(part) for part in dotted.split(".")]
+    body = bytearray([40 * numbers[0] + numbers[1]])
+    for number in numbers[2:]:
+        chunk = [number & 0x7F]
+        while number > 0x7F:
+            number >>= 7
+            chunk.append(0x80 | (number & 0x7F))
+        body += bytes(reversed(chunk))
+    return _der(0x06, bytes(body))
+
+
+def _der_items(data, start=0, end=None):
+    """(tag, element start, content start, end) of the DER elements in data[start:end]"""
+    end = len(data) if end is None else end
+    while start < end:
+        tag, length, content = data[start], data[start + 1], start + 2
+        if length & 0x80:
+            count = length & 0x7F
+            length = int.from_bytes(data[content:content + count], "big")
+            content += count
+        yield tag, start, content, content + length
+        start = content + length
+
+
+OID_DATA = _der_oid("1.2.840.113549.1.7.1")
+OID_SIGNED_DATA = _der_oid("1.2.840.113549.1.7.2")
+OID_CONTENT_TYPE = _der_oid("1.2.840.113549.1.9.3")
+OID_MESSAGE_DIGEST = _der_oid("1.2.840.113549.1.9.4")
+OID_SIGNING_TIME = _der_oid("1.2.840.113549.1.9.5")
+SHA256_ALGORITHM = _der_sequence(_der_oid("2.16.840.1.101.3.4.2.1"), b"\x05\x00")
+RSA_ALGORITHM = _der_sequence(_der_oid("1.2.840.113549.1.1.1"), b"\x05\x00")
+ECDSA_SHA256_ALGORITHM = _der_sequence(_der_oid("1.2.840.10045.4.3.2"))
+
+
+# Signing --------------------------------------------------------------------
+
+class Signer:
+    """
+    A private key and its certificate, ready to sign certificates
+
+    Args:
+        key: RSA or EC private key (cryptography)
+        certificate: The signing certificate (x509.Certificate)
+        chain: Further certificates to embed (intermediates)
+        appearance: Draw the signature at SIGNATURE_BOX on page 1
+            (otherwise the signature field is invisible)
+        reason: Optional /Reason of the signature
+    """
+
+    def __init__(self, key, certificate, chain=(), appearance=False, reason=None):
+        _require_cryptography()
+        if not isinstance(key, (rsa.RSAPrivateKey, ec.EllipticCurvePrivateKey)):
+            raise ValueError("Only RSA and EC keys can sign certificates")
+        self.key = key
+        self.appearance = appearance
+        self.reason = reason
+        names = certificate.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+        self.name = names[0].value if names else certificate.subject.rfc4514_string()
+
+        # Everything that does not depend on the document, encoded once
+        self._certificates = _der(0xA0, b"".join(cert.public_bytes(serialization.Encoding.DER)
+                                                 for cert in [certificate, *chain]))
+        self._signer_id = _der_sequence(certificate.issuer.public_bytes(),
+                                        _der_integer(certificate.serial_number))
+        self._signature_algorithm = RSA_ALGORITHM if isinstance(key, rsa.RSAPrivateKey) \
+            else ECDSA_SHA256_ALGORITHM
+        self._content_type = _der_sequence(OID_CONTENT_TYPE, _der_set(OID_DATA))
+
+    @classmethod
+    def from_pkcs12(cls, path, password=None, appearance=False, reason=None):
+        """Load a .p12/.pfx key file"""
+        _require_cryptography()
+        key, certificate, chain = pkcs12.load_key_and_certificates(
+            Path(path).read_bytes(), password.encode() if password else None)
+        if key is None or certificate is None:
+            raise ValueError(f"{Path(path).name} holds no private key and certificate")
+        return cls(key, certificate, chain or (), appearance, reason)
+
+    def signature(self, digest, signing_time):
+        """DER CMS SignedData over a SHA-256 document digest"""
+        signed_attributes = [
+            self._content_type,
+            _der_sequence(OID_SIGNING_TIME, _der_set(_der(0x17, signing_time.strftime("%y%m%d%H%M%SZ").encode()))),
+            _der_sequence(OID_MESSAGE_DIGEST, _der_set(_der(0x04, digest))),
+        ]
+        to_sign = _der_set(*signed_attributes)
+        if isinstance(self.key, rsa.RSAPrivateKey):
+            signature = self.key.sign(to_sign, padding.PKCS1v15(), hashes.SHA256())
+        else:
+            signature = self.key.sign(to_sign, ec.ECDSA(hashes.SHA256()))
+        signer_info = _der_sequence(_der_integer(1), self._signer_id, SHA256_ALGORITHM,
+                                    b"\xA0" + to_sign[1:], self._signature_algorithm,
+                                    _der(0x04, signature))
+        signed_data = _der_sequence(_der_integer(1), _der_set(SHA256_ALGORITHM), _der_sequence(OID_DATA),
+                                    self._certificates, _der_set(signer_info))
+        return _der_sequence(OID_SIGNED_DATA, _der(0xA0, signed_data))
+
+    def sign(self, pdf, signing_time=None):
+        """
+        Sign a certificate
+
+        Args:
+            pdf: Finished certificate PDF bytes
+            signing_time: Time of the signature (default: now, UTC)
+
+        Returns:
+            bytes: The signed PDF (pdf plus an incremental update)
+        """
+        signing_time = signing_time or datetime.now(timezone.utc)
+        update, contents_start, contents_end = self._update(pdf, signing_time)
+        length = len(pdf) + len(update)
+        byte_range = b"[0 %010d %010d %010d]" % (contents_start, contents_end, length - contents_end)
+        placeholder = update.index(b"[0 0000000000 0000000000 0000000000]")
+        update[placeholder:placeholder + len(byte_range)] = byte_range
+
+        # Hash the ByteRange - the file around /Contents - without joining it
+        digest = hashlib.sha256(pdf)
+        local_start, local_end = contents_start - len(pdf), contents_end - len(pdf)
+        digest.update(memoryview(update)[:local_start])
+        digest.update(memoryview(update)[local_end:])
+        contents = self.signature(digest.digest(), signing_time).hex().encode()
+        if len(contents) > 2 * SIGNATURE_SPACE:
+            raise ValueError(f"Signature needs {len(contents) // 2} bytes, more than SIGNATURE_SPACE")
+        update[local_start + 1:local_start + 1 + len(contents)] = contents
+        return pdf + bytes(update)
+
+    def _update(self, pdf, signing_time):
+        """Incremental update with a placeholder signature; (update, contents start, contents end)"""
+        reader = PdfReader(io.BytesIO(pdf))
+        trailer = reader.trailer
+        tail = pdf[-1024:]
+        startxref = int(tail[tail.rindex(b"startxref") + 9:].split()[0])
+        if "/Size" in trailer:
+            next_number = int(trailer["/Size"])
+        else:
+            # PyPDF2 leaves /Size out of the trailer of cross-reference streams
+            next_number = int(re.search(rb"/Size\s+(\d+)", pdf[startxref:startxref + 4096]).group(1))
+        page = reader.pages[0]
+        page_ref = page.indirect_reference
+        root_ref = trailer.raw_get("/Root")
+        root = trailer["/Root"]
+
+        numbers = {"signature": next_number, "field": next_number + 1, "appearance": next_number + 2}
+        next_number += 3 if self.appearance else 2
+        date = signing_time.strftime("D:%Y%m%d%H%M%S+00'00'").encode()
+        signature = (b"<< /Type /Sig /Filter /Adobe.PPKLite /SubFilter /adbe.pkcs7.detached "
+                     b"/ByteRange [0 0000000000 0000000000 0000000000] /Contents <"
+                     + b"0" * (2 * SIGNATURE_SPACE) + b"> /M (" + date + b") /Name "
+                     + pdf_string(self.name)
+                     + (b" /Reason " + pdf_string(self.reason) if self.reason else b"") + b" >>")
+
+        if self.appearance:
+            x, y, width, height = SIGNATURE_BOX
+            rect = b"[%g %g %g %g]" % (x, y, x + width, y + height)
+            appearance_ref = b" /AP << /N %d 0 R >>" % numbers["appearance"]
+        else:
+            rect, appearance_ref = b"[0 0 0 0]", b""
+        field = (b"<< /Type /Annot /Subtype /Widget /FT /Sig /T (Signature%d) /V %d 0 R /F 132 "
+                 b"/Rect %s /P %d 0 R%s >>" % (numbers["signature"], numbers["signature"], rect,
+                                              page_ref.idnum, appearance_ref))
+        field_ref = IndirectObject(numbers["field"], 0, None)
+
+        new_page = DictionaryObject({key: page.raw_get(key) for key in page})
+        new_page[NameObject("/Annots")] = ArrayObject([*page.get("/Annots", []), field_ref])
+        new_root = DictionaryObject({key: root.raw_get(key) for key in root})
+        form = root.get("/AcroForm")
+        new_form = DictionaryObject({key: form.raw_get(key) for key in form}) if form else DictionaryObject()
+        new_form[NameObject("/Fields")] = ArrayObject([*new_form.get("/Fields", []), field_ref])
+        new_form[NameObject("/SigFlags")] = NumberObject(3)
+        new_root[NameObject("/AcroForm")] = new_form
+
+        objects = [(numbers["signature"], 0, signature), (numbers["field"], 0, field)]
+        if self.appearance:
+            objects.append((numbers["appearance"], 0, self._appearance_stream(signing_time)))
+        objects += [(page_ref.idnum, page_ref.generation, _serialize(new_page)),
+                    (root_ref.idnum, root_ref.generation, _serialize(new_root))]
+
+        update = bytearray(b"" if pdf.endswith(b"\n") else b"\n")
+        offsets = {}
+        for number, generation, body in objects:
+            offsets[(number, generation)] = len(pdf) + len(update)
+            update += b"%d %d obj\n" % (number, generation) + body + b"\nendobj\n"
+        contents_start = len(pdf) + update.index(b"/Contents <") + len(b"/Contents ")
+        contents_end = contents_start + 2 * SIGNATURE_SPACE + 2
+
+        trailer_entries = b"/Root " + _serialize(root_ref)
+        for key in ("/Info", "/ID"):
+            if key in trailer:
+                trailer_entries += b" " + key.encode() + b" " + _serialize(trailer.raw_get(key))
+        if pdf[startxref:startxref + 4] == b"xref":
+            update += _xref_table(offsets, len(pdf) + len(update), next_number, trailer_entries, startxref)
+        else:
+            update += _xref_stream(offsets, len(pdf) + len(update), next_number, trailer_entries, startxref)
+        return update, contents_start, contents_end
+
+    def _appearance_stream(self, signing_time):
+        """Form XObject with a frame, the signer and the time"""
+        _, _, width, height = SIGNATURE_BOX
+        lines = [f"Digitally signed by {self.name}", f"Date: {signing_time:%Y-%m-%d %H:%M} UTC"]
+        if self.reason:
+            lines.append(f"Reason: {self.reason}")
+        text = b" T* ".join(pdf_string(line) + b" Tj" for line in lines)
+        ops = (b"q 0.5 w 0 0 0.6 RG 0.25 0.25 %g %g re S Q\n"
+               b"BT /GCSig 8 Tf 10 TL 0 g 6 %g Td %s ET\n" % (width - 0.5, height - 0.5, height - 14, text))
+        resources = (b"/Resources << /Font << /GCSig << /Type /Font /Subtype /Type1 "
+                     b"/BaseFont /Helvetica /Encoding /WinAnsiEncoding >> >> >>")
+        return (b"<< /Type /XObject /Subtype /Form /BBox [0 0 %g %g] %s /Length %d >>\nstream\n"
+                % (width, height, resources, len(ops)) + ops + b"\nendstream")
+
+
+def _xref_table(offsets, position, size, trailer_entries, prev):
+    """Classic cross-reference section and trailer for an update starting at position"""
+    section = bytearray(b"xref\n")
+    entries = sorted(offsets.items())
+    start = 0
+    while start < len(entries):
+        end = start
+        while end + 1 < len(entries) and entries[end + 1][0][0] == entries[end][0][0] + 1:
+            end += 1
+        section += b"%d %d\n" % (entries[start][0][0], end - start + 1)
+        for (number, generation), offset in entries[start:end + 1]:
+            section += b"%010d %05d n \n" % (offset, generation)
+        start = end + 1
+    section += b"trailer\n<< /Size %d %s /Prev %d >>\nstartxref\n%d\n%%%%EOF\n" % (
+        size, trailer_entries, prev, position)
+    return bytes(section)
+
+
+def _xref_stream(offsets, position, size, trailer_entries, prev):
+    """Cross-reference stream for an update of a file that uses one (compact output)"""
+    offsets = dict(offsets)
+    offsets[(size, 0)] = position
+    entries = sorted(offsets.items())
+    index = b" ".join(b"%d 1" % number for (number, _), _ in entries)
+    data = b"".join(b"\x01" + offset.to_bytes(4, "big") + generation.to_bytes(2, "big")
+                    for (_, generation), offset in entries)
+    header = (b"<< /Type /XRef /Size %d /W [1 4 2] /Index [%s] %s /Prev %d /Length %d >>"
+              % (size + 1, index, trailer_entries, prev, len(data)))
+    return (b"%d 0 obj\n" % size + header + b"\nstream\n" + data + b"\nendstream\nendobj\n"
+            b"startxref\n%d\n%%%%EOF\n" % position)
+
+
+def load_signer(signing):
+    """Signer from signing options {"key": .p12 path, "password", "appearance", "reason"}"""
+    return Signer.from_pkcs12(signing["key"], signing.get("password"), signing.get("appearance", False),
+                              signing.get("reason"))
+
+
+def signing_password(env=PASSWORD_ENV):
+    """Key password from the environment, or asked for on the terminal"""
+    if env in os.environ:
+        return os.environ[env]
+    if sys.stdin.isatty():
+        return getpass.getpass("Signing key password: ")
+    return None
+
+
+def _init_worker(signing):
+    global _SIGNER
+    _SIGNER = load_signer(signing)
+
+
+def _sign_file(task):
+    source, target = task
+    write_hashed(target, _SIGNER.sign(Path(source).read_bytes()))
+    return target
+
+
+def sign_files(tasks, signing, workers=None):
+    """
+    Sign PDF files in worker processes, each loading the key once
+
+    Args:
+        tasks: (source path, target path) pairs
+        signing: Signing options (see load_signer)
+        workers: Processes (default: CPU count; 1 signs in this process)
+
+    Yields:
+        str: Each signed file, in order
+    """
+    global _SIGNER
+    tasks = [(str(source), str(target)) for source, target in tasks]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _SIGNER = load_signer(signing)
+        yield from map(_sign_file, tasks)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(signing,)) as pool:
+        yield from pool.map(_sign_file, tasks, chunksize=SIGN_CHUNK)
+
+
+# Verification ---------------------------------------------------------------
+
+def verify_signature(pdf):
+    """
+    Check the last signature of a PDF
+
+    Returns:
+        dict: "signer" (common name), "time" (signing time as written),
+        "valid" (digest and signature match) and "whole_file" (nothing
+        was appended after the signature)
+
+    Raises:
+        ValueError: The PDF is not signed
+    """
+    _require_cryptography()
+    match = None
+    for match in re.finditer(rb"/ByteRange\s*\[\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s*\]", pdf):
+        pass
+    if match is None:
+        raise ValueError("Not signed")
+    start1, length1, start2, length2 = (int(value) for value in match.groups())
+    digest = hashlib.sha256(memoryview(pdf)[start1:start1 + length1])
+    digest.update(memoryview(pdf)[start2:start2 + length2])
+    cms = bytes.fromhex(pdf[start1 + length1 + 1:start2 - 1].decode("ascii"))
+
+    def children(element):
+        return list(_der_items(cms, element[2], element[3]))
+
+    # ContentInfo -> [0] -> SignedData; the signer's certificate comes first
+    _, explicit = children(next(_der_items(cms)))
+    signed_data = children(children(explicit)[0])
+    certificates = next(item for item in signed_data if item[0] == 0xA0)
+    first = children(certificates)[0]
+    certificate = x509.load_der_x509_certificate(cms[first[1]:first[3]])
+    signer_info = children(children(signed_data[-1])[0])
+    attributes = signer_info[3]
+    to_sign = b"\x31" + cms[attributes[1] + 1:attributes[3]]
+    message_digest = signing_time = None
+    for attribute in children(attributes):
+        oid, values = children(attribute)
+        if cms[oid[1]:oid[3]] == OID_MESSAGE_DIGEST:
+            value = children(values)[0]
+            message_digest = cms[value[2]:value[3]]
+        elif cms[oid[1]:oid[3]] == OID_SIGNING_TIME:
+            value = children(values)[0]
+            signing_time = cms[value[2]:value[3]].decode("ascii")
+    signature = cms[signer_info[5][2]:signer_info[5][3]]
+
+    valid = message_digest == digest.digest()
+    try:
+        key = certificate.public_key()
+        if isinstance(key, rsa.RSAPublicKey):
+            key.verify(signature, to_sign, padding.PKCS1v15(), hashes.SHA256())
+        else:
+            key.verify(signature, to_sign, ec.ECDSA(hashes.SHA256()))
+    except Exception:
+        valid = False
+    names = certificate.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+    return {
+        "signer": names[0].value if names else certificate.subject.rfc4514_string(),
+        "time": signing_time,
+        "valid": valid,
+        "whole_file": start2 + length2 == len(pdf),
+    }
+
+
+def create_self_signed(path, password=None, name="GasClip Certificates", days=3650):
+    """Write a self-signed RSA key and certificate as PKCS#12 (for testing)"""
+    _require_cryptography()
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    subject = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, name)])
+    now = datetime.now(timezone.utc)
+    certificate = (x509.CertificateBuilder().subject_name(subject).issuer_name(subject)
+                   .public_key(key.public_key()).serial_number(x509.random_serial_number())
+                   .not_valid_before(now - timedelta(days=1)).not_valid_after(now + timedelta(days=days))
+                   .add_extension(x509.KeyUsage(True, True, False, False, False, False, False, False, False),
+                                  critical=True)
+                   .sign(key, hashes.SHA256()))
+    encryption = serialization.BestAvailableEncryption(password.encode()) if password \
+        else serialization.NoEncryption()
+    Path(path).write_bytes(pkcs12.serialize_key_and_certificates(name.encode(), key, certificate, None,
+                                                                 encryption))
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Sign and verify certificate PDFs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sign = commands.add_parser("sign", help="Sign certificates into an output folder")
+    sign.add_argument("key", help="PKCS#12 key file (.p12/.pfx)")
+    sign.add_argument("inputs", nargs="+", help="Certificate PDFs or folders of them")
+    sign.add_argument("--output", required=True, help="Folder for the signed certificates")
+    sign.add_argument("--appearance", action="store_true", help="Show the signature on page 1")
+    sign.add_argument("--reason", help="Reason shown with the signature")
+    sign.add_argument("--workers", type=int, help="Signing processes (default: CPU count)")
+    verify = commands.add_parser("verify", help="Check signed certificates")
+    verify.add_argument("inputs", nargs="+")
+    create = commands.add_parser("create-key", help="Write a self-signed key for testing")
+    create.add_argument("key")
+    create.add_argument("--name", default="GasClip Certificates")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("Certificate Signing")
+    print("=" * 70)
+    if args.command == "create-key":
+        create_self_signed(args.key, signing_password(), args.name)
+        print(f"✓ Self-signed key for '{args.name}' written to {args.key}")
+        print("=" * 70)
+        return 0
+
+    paths = []
+    for item in map(Path, args.inputs):
+        paths += sorted(item.glob("*.pdf")) if item.is_dir() else [item]
+    if args.command == "verify":
+        failed = 0
+        for path in paths:
+            try:
+                result = verify_signature(path.read_bytes())
+            except ValueError as e:
+                result = {"valid": False, "error": str(e)}
+            ok = result["valid"] and result.get("whole_file")
+            failed += not ok
+            print(f"{'✓' if ok else '✗'} {path.name}: " + (
+                result["error"] if "error" in result else
+                f"signed by {result['signer']} at {result['time']}"
+                + ("" if result["whole_file"] else " (changed after signing)")
+                + ("" if result["valid"] else " - INVALID")))
+        print("=" * 70)
+        return 1 if failed else 0
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    signing = {"key": args.key, "password": signing_password(), "appearance": args.appearance,
+               "reason": args.reason}
+    start = time.perf_counter()
+    count = sum(1 for _ in sign_files([(path, output / path.name) for path in paths], signing, args.workers))
+    elapsed = time.perf_counter() - start
+    print(f"✓ Signed {count} certificates into {output} in {elapsed:.1f}s")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
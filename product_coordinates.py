@@ -84,6 +84,13 @@ PRODUCT_COORDINATES = {
 }
 
 
+# White box (x, y, width, height) hiding the "O2 18%" placeholder in the lot area
+LOT_PLACEHOLDER_COVER = (195, 405, 50, 15)
+
+# Signature appearance (x, y, width, height) on page 1, right of the footer logo
+SIGNATURE_BOX = (320, 95, 190, 42)
+
+
 def get_coordinates(prefix):
     """
     Get coordinates for a specific product prefix
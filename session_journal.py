@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Crash-safe session journal
+Every generated certificate is appended to output/.session.jsonl as one JSON
+line (with the SHA-256 of the PDF written), so a session interrupted before
+the invoice was finished can be rebuilt on restart and an interrupted batch
+can resume without re-rendering what is already on disk.
+
+Lines are flushed to the OS as they are written, which survives a crash of
+the application; fsync (which also survives a power cut) is batched every
+FSYNC_EVERY entries or FSYNC_INTERVAL seconds.
+"""
+
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import json
+import os
+import time
+
+JOURNAL_NAME = ".session.jsonl"
+
+FSYNC_EVERY = 16
+FSYNC_INTERVAL = 1.0
+
+
+def pdf_hash(data):
+    """SHA-256 hex digest of PDF bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class SessionJournal:
+    """Append-only journal of the certificates generated in a session"""
+
+    def __init__(self, output_dir, fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL):
+        self.path = Path(output_dir) / JOURNAL_NAME
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._completed = None
+
+    def load(self):
+        """
+        Entries of an unfinished session, in order
+
+        A torn last line (crash mid-write) is ignored. Later entries for the
+        same serial replace earlier ones.
+        """
+        if not self.path.exists():
+            return []
+        entries = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries.pop(entry["serial"], None)
+                entries[entry["serial"]] = entry
+        return list(entries.values())
+
+    def append(self, entry, sha256, size=None):
+        """
+        Record a generated certificate
+
+        Args:
+            entry: generated_certificates entry (filename, path, serial, product, data)
+            sha256: Hash of the PDF bytes written (see invoice_manifest.write_hashed)
+            size: Bytes written, for the invoice manifest
+        """
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            torn = self.path.exists() and not self.path.read_bytes().endswith(b"\n")
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if torn and self.path.stat().st_size:
+                self._file.write("\n")  # start after a line torn by a crash
+        line = {key: entry[key] for key in ("filename", "path", "serial", "product", "data")}
+        line["sha256"] = sha256
+        line["size"] = size
+        line["generated"] = datetime.now().isoformat(timespec="seconds")
+        self._completed = None
+        self._file.write(json.dumps(line) + "\n")
+        self._file.flush()
+
+        self._unsynced += 1
+        if (self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """fsync pending entries"""
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """End the session (invoice finished): the journal is no longer needed"""
+        self.close()
+        if self.path.exists():
+            self.path.unlink()
+
+    def completed(self):
+        """
+        Certificates from the journal that are on disk and unchanged
+
+        The files are hashed once; the result is kept until the next append.
+
+        Returns:
+            dict: serial -> journal entry (with its "data" record)
+        """
+        if self._completed is None:
+            self._completed = {entry["serial"]: entry for entry in self.load()
+                               if Path(entry["path"]).exists()
+                               and pdf_hash(Path(entry["path"]).read_bytes()) == entry["sha256"]}
+        return self._completed
+
+    def restore(self):
+        """
+        Rebuild generated_certificates after a crash
+
+        Only certificates whose PDF is still on disk unchanged are kept.
+
+        Returns:
+            list: generated_certificates entries
+        """
+        return [{key: entry[key] for key in ("filename", "path", "serial", "product", "data")}
+                for entry in self.completed().values()]
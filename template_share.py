@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Templates shared by worker processes through shared memory
+Every render process used to read its own copy of each template (about
+1.3 MB per product) and keep it for its whole life. SharedTemplates loads
+the raw template bytes once, in the parent, into one
+multiprocessing.shared_memory block; attach_templates() - the pool
+initializer - maps that block in a worker and installs read-only
+memoryviews of it (certificate_engine.install_template_buffers). The
+engines then parse from the shared pages when a template is first used,
+and a template that changes on disk is read from the file again.
+
+Usage:
+    python template_share.py [--backend B] [--profile P] [--workers N] [--count N]
+        # render with private and shared templates and compare worker memory
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+import argparse
+import os
+import sys
+import time
+
+from certificate_engine import PRODUCTS, get_engine, install_template_buffers, make_record
+
+# The block a worker attached to, kept open for the life of the worker
+_ATTACHED = None
+
+
+class SharedTemplates:
+    """
+    Template files loaded once into a shared memory block
+
+    descriptor is what a worker needs to attach (block name and the
+    offset, size and mtime of each template); pass it to attach_templates.
+    The parent owns the block: close() releases and removes it.
+    """
+
+    def __init__(self, paths):
+        paths = sorted({Path(path).resolve() for path in paths if Path(path).exists()})
+        stats = [path.stat() for path in paths]
+        self.size = sum(stat.st_size for stat in stats)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(self.size, 1))
+        index = {}
+        offset = 0
+        for path, stat in zip(paths, stats):
+            with open(path, "rb") as f, self.memory.buf[offset:offset + stat.st_size] as view:
+                f.readinto(view)
+            index[str(path)] = (offset, stat.st_size, stat.st_mtime)
+            offset += stat.st_size
+        self.descriptor = (self.memory.name, index)
+
+    @classmethod
+    def for_backend(cls, backend=None, profile=None, prefixes=None):
+        """Every template the engines of a backend and profile render from"""
+        paths = []
+        for prefix in prefixes or PRODUCTS:
+            engine = get_engine(prefix, backend, profile)
+            paths.append(engine.template_path(prefix))
+        return cls(paths)
+
+    def __len__(self):
+        return len(self.descriptor[1])
+
+    def close(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_templates(descriptor):
+    """Process pool initializer: render from the parent's shared templates"""
+    global _ATTACHED
+    if descriptor is None:
+        return
+    name, index = descriptor
+    _ATTACHED = shared_memory.SharedMemory(name)
+    buffer = _ATTACHED.buf.toreadonly()
+    install_template_buffers({path: (mtime, buffer[offset:offset + size])
+                              for path, (offset, size, mtime) in index.items()})
+
+
+def worker_memory(pid="self"):
+    """
+    Memory of a process from /proc, in bytes
+
+    Returns:
+        dict: rss (VmRSS), private (RssAnon), shared (RssShmem: shared
+        memory pages it has touched) and pss (its proportional share of
+        everything, where /proc/<pid>/smaps_rollup exists); empty where
+        there is no /proc
+    """
+    fields = {"VmRSS:": "rss", "RssAnon:": "private", "RssShmem:": "shared"}
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                key = fields.get(line.split(":")[0] + ":")
+                if key:
+                    memory[key] = int(line.split()[1]) * 1024
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    memory["pss"] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return memory
+
+
+def render_and_measure(task):
+    """Render records, then report this worker's memory (runs in a worker)"""
+    records, backend, profile = task
+    for record in records:
+        get_engine(record["prefix"], backend, profile).render(record)
+    time.sleep(0.2)  # keep this worker busy so the next task goes to another one
+    return os.getpid(), worker_memory()
+
+
+def compare(backend=None, profile=None, workers=4, count=40):
+    """
+    Render count certificates in a pool with private, then shared templates
+
+    Returns:
+        dict: {"private" / "shared": {pid: worker_memory()}}
+    """
+    records = [make_record(prefix, str(100000 + i), "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+               for i, prefix in zip(range(count), list(PRODUCTS) * count)]
+    per_task = max(1, count // (workers * 2))
+    tasks = [(records[start:start + per_task], backend, profile) for start in range(0, count, per_task)]
+    results = {}
+    for mode in ("private", "shared"):
+        templates = SharedTemplates.for_backend(backend, profile) if mode == "shared" else None
+        try:
+            with ProcessPoolExecutor(workers, initializer=attach_templates,
+                                     initargs=(templates.descriptor if templates else None,)) as pool:
+                measured = {}
+                for pid, memory in pool.map(render_and_measure, tasks):
+                    measured[pid] = memory
+            results[mode] = measured
+        finally:
+            if templates is not None:
+                templates.close()
+    return results
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Compare worker memory with private and shared templates")
+    parser.add_argument("--backend", help="Certificate engine backend (default: engine_config.json)")
+    parser.add_argument("--profile", help="Output profile (default: engine_config.json)")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes (default: 4)")
+    parser.add_argument("--count", type=int, default=40, help="Certificates to render (default: 40)")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("Shared Templates")
+    print("=" * 70)
+    with SharedTemplates.for_backend(args.backend, args.profile) as templates:
+        print(f"{len(templates)} templates, {templates.size / 1024 / 1024:.1f} MB in one shared block")
+    results = compare(args.backend, args.profile, args.workers, args.count)
+    if not any(results.values()) or not any(results["private"].values()):
+        print("✗ No /proc here; worker memory cannot be measured")
+        return 1
+
+    totals = {}
+    for mode, measured in results.items():
+        print(f"\n{mode.capitalize()} templates ({len(measured)} workers):")
+        for pid, memory in sorted(measured.items()):
+            print(f"  pid {pid}: RSS {memory['rss'] / 1024 / 1024:6.1f} MB, "
+                  f"private {memory['private'] / 1024 / 1024:6.1f} MB, "
+                  f"shared {memory['shared'] / 1024 / 1024:5.1f} MB"
+                  + (f", PSS {memory['pss'] / 1024 / 1024:6.1f} MB" if "pss" in memory else ""))
+        totals[mode] = sum(memory["private"] for memory in measured.values()) / len(measured)
+    print(f"\nPrivate memory per worker: {totals['private'] / 1024 / 1024:.1f} MB -> "
+          f"{totals['shared'] / 1024 / 1024:.1f} MB "
+          f"({(totals['private'] - totals['shared']) / 1024 / 1024:.1f} MB saved per worker)")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
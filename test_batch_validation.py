@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test whole-batch validation against the single-form validator
+"""
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from batch_generate import parse_record, read_records
+from batch_validation import calculate_expiration_dates, check_columns, validate_columns
+from certificate_engine import RECORD_FIELDS, calculate_expiration_date
+
+DATES = ["02/10/2025", "31/02/2025", "29/02/2024", "29/02/2025", "00/01/2025", "13/13/2025",
+         "01/13/2025", "01/01/1999", "0101202", "ab/cd/efgh", "", " 05/06/2030 ", "31/04/2026",
+         "02102025", "０２/１０/２０２５"]
+
+ROWS = [{"prefix": prefix, "serial": serial, "activation": activation, "lot": lot,
+         "gas_prod": DATES[(index * 7) % len(DATES)], "calibration": DATES[(index * 5) % len(DATES)]}
+        for index, (prefix, serial, activation, lot) in enumerate(
+            (prefix, serial, activation, lot)
+            for prefix in ("D4PQ", "sosp", "XXXX", "")
+            for serial in ("236599", "D4PQ236599", "xxxx12", "12a", "")
+            for activation in DATES
+            for lot in ("LOT1", ""))]
+
+
+def columns_of(rows):
+    return {field: [row[field] for row in rows] for field in RECORD_FIELDS}
+
+
+def differences(rows):
+    """Rows where validate_columns and parse_record disagree: (row number, expected, got)"""
+    records, errors = validate_columns(columns_of(rows), duplicates=False)
+    records = iter(records)
+    found = {}
+    for row_number, message in errors:
+        found.setdefault(row_number, []).append(message)
+    different = []
+    for index, row in enumerate(rows):
+        record, messages = parse_record(row)
+        got = found.get(index + 2, [])
+        if messages != got or (record is not None and (got or next(records, None) != record)):
+            different.append((index + 2, messages or record, got))
+    return different
+
+
+def test_same_as_single_form():
+    """Test that every row gets the messages and record parse_record gives"""
+    print("Testing parity with the single-form validator...")
+    different = differences(ROWS)
+    if not different:
+        print(f"  ✓ {len(ROWS)} rows: records and messages identical")
+        return True
+    print(f"  ✗ {len(different)} rows differ, first {different[0]}")
+    return False
+
+
+def test_unicode_rows():
+    """Test random rows with non-ASCII digits and letters against parse_record, row by row"""
+    print("\nTesting random rows with Unicode digits...")
+    rng = random.Random(44)
+    characters = "0123456789/ ab" + "０１２３４５６７８９" + "٠١٢٣٤٥٦٧٨٩" + "²³¹" + "ſıßé"
+
+    def text(length):
+        return "".join(rng.choice(characters) for _ in range(length))
+
+    def date():
+        day, month, year = rng.randint(0, 32), rng.randint(0, 13), rng.randint(1999, 2101)
+        value = f"{day:02d}/{month:02d}/{year}"
+        if rng.random() < 0.7:  # swap some digits for another script's
+            digits = rng.choice(["0123456789", "０１２３４５６７８９", "٠١٢٣٤٥٦٧٨٩"])
+            value = "".join(digits[int(char)] if char.isdigit() and rng.random() < 0.5 else char
+                            for char in value)
+        return value if rng.random() < 0.8 else text(rng.randint(6, 10))
+
+    rows = [{"prefix": rng.choice(["D4PQ", "sosp", "ſosp", "SCSQ", text(4)]),
+             "serial": rng.choice([str(rng.randint(1, 999999)), "٢٣٦٥٩٩", "１２３", "12²", text(5)]),
+             "activation": date(), "lot": rng.choice(["LOT1", ""]), "gas_prod": date(), "calibration": date()}
+            for _ in range(5000)]
+    different = differences(rows)
+    valid = sum(parse_record(row)[0] is not None for row in rows)
+    if not different:
+        print(f"  ✓ 5000 rows ({valid} valid): every row gets parse_record's messages and record")
+        return True
+    print(f"  ✗ {len(different)} rows differ, first {different[0]}")
+    return False
+
+
+def test_expiry_and_duplicates():
+    """Test vectorized expiry dates and duplicate serials"""
+    print("\nTesting expiry dates and duplicates...")
+    all_passed = True
+    activation = ["02/10/2025", "29/02/2024", "31/12/2099"]
+    expected = [calculate_expiration_date(date, 1095) for date in activation]
+    if calculate_expiration_dates(activation, 1095).tolist() == expected:
+        print(f"  ✓ Expiry dates match calculate_expiration_date ({expected[1]})")
+    else:
+        print(f"  ✗ {calculate_expiration_dates(activation, 1095)} != {expected}")
+        all_passed = False
+
+    rows = [dict(ROWS[0], serial="100"), dict(ROWS[0], serial="D4PQ100"), dict(ROWS[0], serial="101")]
+    rows = [dict(row, gas_prod="21/03/2024", calibration="02/10/2025") for row in rows]
+    records, errors = validate_columns(columns_of(rows))
+    if len(records) == 2 and errors == [(3, "D4PQ100 appears twice in this batch")]:
+        print("  ✓ The second occurrence of a serial is reported")
+    else:
+        print(f"  ✗ Errors {errors}")
+        all_passed = False
+    return all_passed
+
+
+def test_large_batch():
+    """Test a 100k-row order is checked in well under a second"""
+    print("\nTesting a 100k-row batch...")
+    count = 100000
+    columns = {"prefix": ["D4PQ", "SOSP"] * (count // 2), "serial": [str(100000 + i) for i in range(count)],
+               "activation": ["02/10/2025"] * count, "lot": ["LOT1"] * count,
+               "gas_prod": ["21/03/2024"] * count, "calibration": ["02/10/2025"] * count}
+    columns["activation"][500] = "31/02/2025"
+    start = time.perf_counter()
+    errors, arrays = check_columns(columns)
+    elapsed = time.perf_counter() - start
+    if errors == [(502, "Activation Date: Invalid date (e.g., 31/02/2025 doesn't exist)")] \
+            and arrays["calibration_exp"][1] == "02/10/2027" and elapsed < 2:
+        print(f"  ✓ Error report for {count} rows in {elapsed * 1000:.0f} ms")
+        return True
+    print(f"  ✗ {len(errors)} errors in {elapsed:.2f}s")
+    return False
+
+
+def test_read_records():
+    """Test read_records on a CSV with a product column and blank lines"""
+    print("\nTesting read_records...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "order.csv"
+        path.write_text("Product,Serial,Activation,Lot,Gas_Prod,Calibration\n"
+                        "d4pq,236599,02/10/2025,LOT1,21/03/2024,02/10/2025\n\n"
+                        "SOSP,1x,02/10/2025,LOT1,21/03/2024,02/10/2025\n", encoding="utf-8")
+        records, errors = read_records(path)
+    if [record["serial"] for record in records] == ["D4PQ236599"] \
+            and errors == [(3, "Serial number must contain only digits")]:
+        print("  ✓ Records and row-numbered errors as before")
+        return True
+    print(f"  ✗ {records} {errors}")
+    return False
+
+
+def main():
+    print("=" * 70)
+    print("Batch Validation Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_same_as_single_form(), test_unicode_rows(), test_expiry_and_duplicates(), test_large_batch(),
+               test_read_records()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All batch validation tests passed")
+    else:
+        print("✗ Some batch validation tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Test the shared certificate engine and its backends
+"""
+
+import io
+import sys
+from pathlib import Path
+from PyPDF2 import PdfReader
+from output_profiles import profile_template
+from pdf_output import bundle_pdfs, check_linearization, compact_pdf, finish_pdf
+from certificate_verify import operations
+from certificate_engine import (
+    ENGINES,
+    OVERLAY_PAGE_COUNT,
+    OverlayMergeEngine,
+    create_batch_overlay,
+    calculate_expiration_date,
+    get_engine,
+    make_record,
+    validate_inputs,
+)
+
+
+def test_validation():
+    """Test input validation and expiry calculation"""
+    print("Testing validation...")
+    all_passed = True
+    
+    cases = [
+        (("SOSP", "55555", "02/10/2025", "LOT1", "21/03/2024", "02/10/2025"), []),
+        ((None, "55555", "02/10/2025", "LOT1", "21/03/2024", "02/10/2025"), ["product"]),
+        (("SOSP", "55A55", "31/02/2025", "", "21/03/2024", "02/13/2025"),
+         ["serial", "activation", "lot", "calibration"]),
+    ]
+    for inputs, expected in cases:
+        fields = [field for field, _ in validate_inputs(*inputs)]
+        if fields == expected:
+            print(f"  ✓ {inputs[:2]} → {fields or 'valid'}")
+        else:
+            print(f"  ✗ {inputs[:2]} → {fields} (expected {expected})")
+            all_passed = False
+    
+    expiry = calculate_expiration_date("02/10/2025", 730)
+    if expiry == "02/10/2027":
+        print(f"  ✓ 02/10/2025 + 730 days → {expiry}")
+    else:
+        print(f"  ✗ 02/10/2025 + 730 days → {expiry}")
+        all_passed = False
+
+    # Dates validate_date accepts without slashes are printed as DD/MM/YYYY
+    inputs = ("SOSP", "55555", "02102025", "LOT1", "21032024", "02/10/2025")
+    record = make_record(*inputs) if not validate_inputs(*inputs) else None
+    if record is not None and (record["activation"], record["gas_prod"], record["calibration_exp"]) \
+            == ("02/10/2025", "21/03/2024", "02/10/2027"):
+        print("  ✓ 02102025 → 02/10/2025, expires 02/10/2027")
+    else:
+        print(f"  ✗ 02102025 → {record}")
+        all_passed = False
+    
+    return all_passed
+
+
+def test_backends():
+    """Test that every available backend renders the certificate text"""
+    print("\nTesting engine backends...")
+    record = make_record("SOSP", "55555", "02/10/2025", "TEST123456", "21/03/2024", "02/10/2025")
+    all_passed = True
+    
+    for name, engine_class in ENGINES.items():
+        available, reason = engine_class.available()
+        if not available:
+            print(f"  - {name}: skipped ({reason})")
+            continue
+        
+        engine = get_engine(backend=name)
+        reader = PdfReader(io.BytesIO(engine.render(record)))
+        text = reader.pages[0].extract_text() + reader.pages[1].extract_text()
+        missing = [record[key] for key in ("serial", "activation", "lot", "gas_prod", "calibration")
+                   if record[key] not in text]
+        if len(reader.pages) == 2 and not missing:
+            print(f"  ✓ {name}")
+        else:
+            print(f"  ✗ {name}: {len(reader.pages)} pages, missing {missing}")
+            all_passed = False
+    
+    return all_passed
+
+
+def test_incremental_update():
+    """Test that the incremental backend keeps the template bytes intact"""
+    print("\nTesting incremental update...")
+    engine = get_engine(backend="incremental")
+    record = make_record("D4PQ", "12345", "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+    template = engine.template_path("D4PQ").read_bytes()
+    pdf = engine.render(record)
+    
+    if not (pdf.startswith(template) and pdf.count(b"%%EOF") == template.count(b"%%EOF") + 1):
+        print("  ✗ Output is not an incremental update of the template")
+        return False
+    print(f"  ✓ Template copied verbatim, {len(pdf) - len(template)} bytes appended")
+
+    # The template is wrapped in q/Q, so the text is drawn outside any state it sets
+    all_passed = True
+    for number, page in enumerate(PdfReader(io.BytesIO(pdf)).pages, 1):
+        streams = [stream.get_object().get_data() for stream in page["/Contents"].get_object()]
+        depth = lowest = 0
+        text_depth = None
+        for index, data in enumerate(streams):
+            for _, operator in operations(data):
+                if operator == "q":
+                    depth += 1
+                elif operator == "Q":
+                    depth -= 1
+                    lowest = min(lowest, depth)
+                elif operator == "BT" and index == len(streams) - 1 and text_depth is None:
+                    text_depth = depth
+        if depth == 0 and lowest == 0 and text_depth == 0:
+            print(f"  ✓ Page {number}: q/Q balanced, text drawn outside the template's state")
+        else:
+            print(f"  ✗ Page {number}: q/Q depth {depth} at the end (lowest {lowest}), text at {text_depth}")
+            all_passed = False
+    return all_passed
+
+
+def test_overlay_pdf_libraries():
+    """Test that the overlay merge gives the same pages on PyPDF2 and pikepdf"""
+    print("\nTesting overlay PDF libraries...")
+    engine = OverlayMergeEngine("auto")
+    if engine.pdf_library != "pikepdf":
+        print("  - pikepdf not installed, PyPDF2 only")
+        return True
+    
+    record = make_record("SCSQ", "24680", "02/10/2025", "LOT9", "21/03/2024", "02/10/2025")
+    pages = {}
+    for library in ("pypdf2", "pikepdf"):
+        reader = PdfReader(io.BytesIO(OverlayMergeEngine(library).render(record)))
+        pages[library] = [(page.mediabox, "".join(page.extract_text().split()))
+                          for page in reader.pages]
+    
+    if pages["pypdf2"] == pages["pikepdf"]:
+        print(f"  ✓ {len(pages['pikepdf'])} pages with matching boxes and text")
+        return True
+    print("  ✗ pikepdf merge differs from PyPDF2 merge")
+    return False
+
+
+def test_batch_overlay():
+    """Test that render_many slices one shared overlay into the right certificates"""
+    print("\nTesting batch overlay...")
+    records = [make_record(prefix, f"{i:05d}", "02/10/2025", f"LOT{i}", "21/03/2024", "02/10/2025")
+               for i, prefix in enumerate(["SOSP", "D4PQ", "SOSP"], start=1)]
+    all_passed = True
+    
+    overlay_pages = len(PdfReader(create_batch_overlay(records)).pages)
+    if overlay_pages == len(records) * OVERLAY_PAGE_COUNT:
+        print(f"  ✓ {len(records)} certificates → {overlay_pages} overlay pages")
+    else:
+        print(f"  ✗ {len(records)} certificates → {overlay_pages} overlay pages")
+        all_passed = False
+    
+    for record, pdf in get_engine(backend="overlay").render_many(records):
+        text = "".join(page.extract_text() for page in PdfReader(io.BytesIO(pdf)).pages)
+        if record["serial"] in text and record["lot"] in text:
+            print(f"  ✓ {record['serial']} / {record['lot']}")
+        else:
+            print(f"  ✗ {record['serial']} missing its own overlay")
+            all_passed = False
+    
+    return all_passed
+
+
+def test_output_profiles():
+    """Test that profile variants are smaller, cached and still render"""
+    print("\nTesting output profiles...")
+    try:
+        import pikepdf  # noqa: F401
+    except ImportError:
+        print("  - pikepdf not installed, print profile only")
+        return True
+    
+    template = get_engine(backend="overlay").template_path("SHSP")
+    variant = profile_template(template, "email")
+    all_passed = True
+    
+    if variant != template and variant.stat().st_size < template.stat().st_size:
+        print(f"  ✓ email variant: {template.stat().st_size // 1024} KB → {variant.stat().st_size // 1024} KB")
+    else:
+        print("  ✗ email variant is not smaller than the template")
+        all_passed = False
+    
+    if profile_template(template, "email") == variant and profile_template(template, "print") == template:
+        print("  ✓ Variant reused, print profile uses the template itself")
+    else:
+        print("  ✗ Variant paths are not stable")
+        all_passed = False
+    
+    record = make_record("SHSP", "13579", "02/10/2025", "LOT7", "21/03/2024", "02/10/2025")
+    text = PdfReader(io.BytesIO(get_engine(backend="incremental", profile="email").render(record))).pages[0].extract_text()
+    if record["serial"] in text:
+        print("  ✓ Incremental engine renders from the email variant")
+    else:
+        print("  ✗ Incremental engine failed on the email variant")
+        all_passed = False
+    
+    return all_passed
+
+
+def test_linearized_output():
+    """Test linearized certificates and invoice bundles pass the hint table check"""
+    print("\nTesting linearized output...")
+    try:
+        import pikepdf  # noqa: F401
+    except ImportError:
+        print("  - pikepdf not installed, skipped")
+        return True
+    
+    import tempfile
+    engine = get_engine(backend="incremental")
+    records = [make_record(prefix, "11223", "02/10/2025", "LOT5", "21/03/2024", "02/10/2025")
+               for prefix in ("SOSP", "D4SQ")]
+    plain = engine.render(records[0])
+    linearized = finish_pdf(plain, linearize=True)
+    all_passed = True
+    
+    if check_linearization(linearized)[0] and not check_linearization(plain)[0]:
+        print("  ✓ Certificate linearized, hint tables valid")
+    else:
+        print("  ✗ Linearization check gave the wrong answer")
+        all_passed = False
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        bundle = Path(tmp) / "Invoice_1.pdf"
+        bundle_pdfs([engine.render(record) for record in records], bundle, linearize=True)
+        pages = len(PdfReader(str(bundle)).pages)
+        if check_linearization(bundle)[0] and pages == 4:
+            print(f"  ✓ Invoice bundle linearized, {pages} pages")
+        else:
+            print(f"  ✗ Invoice bundle: {pages} pages, {check_linearization(bundle)[1]}")
+            all_passed = False
+    
+    return all_passed
+
+
+def test_compact_output():
+    """Test object stream output and sharing of template objects in bundles"""
+    print("\nTesting compact output...")
+    try:
+        import pikepdf
+    except ImportError:
+        print("  - pikepdf not installed, skipped")
+        return True
+    
+    import tempfile
+    engine = get_engine(backend="incremental")
+    pdfs = [engine.render(make_record("SCSQ", f"{i:05d}", "02/10/2025", "LOT3", "21/03/2024", "02/10/2025"))
+            for i in range(3)]
+    compact = compact_pdf(pdfs[0])
+    all_passed = True
+    
+    with pikepdf.open(io.BytesIO(compact)) as document:
+        has_xref_stream = document.trailer.get("/Type") == "/XRef"
+    if has_xref_stream and len(compact) < len(pdfs[0]):
+        print(f"  ✓ Certificate: {len(pdfs[0]) // 1024} KB → {len(compact) // 1024} KB, xref stream")
+    else:
+        print("  ✗ Compact certificate has no xref stream or is not smaller")
+        all_passed = False
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        bundle = Path(tmp) / "Invoice_2.pdf"
+        bundle_pdfs(pdfs, bundle, compact=True)
+        size = bundle.stat().st_size
+        if size < 2 * len(pdfs[0]) and len(PdfReader(str(bundle)).pages) == 6:
+            print(f"  ✓ Bundle of 3 shares the template: {size // 1024} KB")
+        else:
+            print(f"  ✗ Bundle of 3 is {size // 1024} KB")
+            all_passed = False
+    
+    return all_passed
+
+
+def main():
+    """Run all tests"""
+    results = [test_validation(), test_backends(), test_incremental_update(),
+               test_overlay_pdf_libraries(), test_batch_overlay(), test_output_profiles(),
+               test_linearized_output(), test_compact_output()]
+    print("\n" + ("✓ All engine tests passed!" if all(results) else "✗ Some engine tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
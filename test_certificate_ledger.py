@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test the SQLite certificate ledger
+"""
+
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from certificate_engine import TEMPLATES_DIR, PRODUCTS, make_record
+from certificate_ledger import CertificateLedger, ledger_entry
+
+
+def make_entries(count, prefix="D4PQ", invoice=None):
+    template = TEMPLATES_DIR / PRODUCTS[prefix]["template"]
+    entries = []
+    for i in range(count):
+        record = make_record(prefix, f"{i:05d}", "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+        entries.append(ledger_entry(record, PRODUCTS[prefix]["name"], template,
+                                    Path("output") / f"{record['serial']}.pdf", invoice))
+    return entries
+
+
+def test_duplicate_detection():
+    """Test that a serial can only be recorded once unless replaced"""
+    print("Testing duplicate detection...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp, CertificateLedger(Path(tmp) / "ledger.db") as ledger:
+        mode = ledger.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        if mode == "wal":
+            print("  ✓ Ledger in WAL mode")
+        else:
+            print(f"  ✗ Journal mode is {mode}")
+            all_passed = False
+
+        entry = make_entries(1)[0]
+        ledger.record(entry)
+        try:
+            ledger.record(entry)
+            print("  ✗ Second issue of the same serial was accepted")
+            all_passed = False
+        except sqlite3.IntegrityError:
+            print(f"  ✓ {entry['serial']} rejected the second time")
+
+        ledger.record(dict(entry, lot="LOT2"), replace=True)
+        if ledger.lookup(entry["serial"])["lot"] == "LOT2" and ledger.count() == 1:
+            print("  ✓ Reissue replaces the record")
+        else:
+            print("  ✗ Reissue did not replace the record")
+            all_passed = False
+
+    return all_passed
+
+
+def test_batch_recording():
+    """Test batched inserts, bulk serial checks and invoice assignment"""
+    print("\nTesting batch recording...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp, CertificateLedger(Path(tmp) / "ledger.db") as ledger:
+        entries = make_entries(1200)
+        ledger.record_many(entries)
+
+        serials = [entries[0]["serial"], entries[-1]["serial"], "D4PQ99999"]
+        issued = ledger.issued_serials(serials)
+        if ledger.count() == 1200 and issued == set(serials[:2]):
+            print(f"  ✓ 1200 certificates recorded, {len(issued)}/3 serials found issued")
+        else:
+            print(f"  ✗ count {ledger.count()}, issued {issued}")
+            all_passed = False
+
+        plan = " ".join(row[3] for row in ledger.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM certificates WHERE serial = ?", ("D4PQ00001",)))
+        if "USING INDEX" in plan:
+            print("  ✓ Serial lookup uses the unique index")
+        else:
+            print(f"  ✗ Serial lookup plan: {plan}")
+            all_passed = False
+
+        ledger.set_invoice(serials[:2], "12345", Path("output") / "Invoice_12345")
+        row = ledger.lookup(serials[0])
+        if row["invoice"] == "12345" and "Invoice_12345" in row["output_path"]:
+            print("  ✓ Invoice assigned on finish")
+        else:
+            print("  ✗ Invoice not assigned")
+            all_passed = False
+
+    return all_passed
+
+
+def main():
+    """Run all tests"""
+    results = [test_duplicate_detection(), test_batch_recording()]
+    print("\n" + ("✓ All ledger tests passed!" if all(results) else "✗ Some ledger tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Test the NDJSON-to-tar certificate pipeline
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tracemalloc
+from certificate_pipe import run_pipe
+
+
+def ndjson(count, start=100000):
+    lines = [json.dumps({"prefix": "D4PQ", "serial": str(start + i), "activation": "02/10/2025",
+                         "lot": "LOT1", "gas_prod": "21/03/2024", "calibration": "02/10/2025"})
+             for i in range(count)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def check_archive(data, count):
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r|") as tar:
+        members = {}
+        for member in tar:
+            members[member.name] = tar.extractfile(member).read()
+    names = list(members)
+    manifest = list(csv.DictReader(io.StringIO(members["manifest.csv"].decode())))
+    in_order = names[:-1] == [f"D4PQ{100000 + i}.pdf" for i in range(count)] and names[-1] == "manifest.csv"
+    hashes = all(hashlib.sha256(members[row["filename"]]).hexdigest() == row["sha256"] for row in manifest)
+    return in_order and len(manifest) == count and hashes
+
+
+def test_pipeline():
+    """Test the tar stream, its order and the trailing manifest"""
+    print("Testing the pipeline...")
+    all_passed = True
+    for workers in (1, 3):
+        target, errors = io.BytesIO(), io.StringIO()
+        source = io.BytesIO(ndjson(12) + b"not json\n" + b'{"prefix": "D4PQ", "serial": "1"}\n')
+        count, invalid = run_pipe(source, target, backend="incremental", workers=workers,
+                                  lookahead=4, errors=errors)
+        if count == 12 and invalid == 2 and check_archive(target.getvalue(), 12):
+            print(f"  ✓ {workers} worker(s): PDFs in input order, then manifest.csv with matching hashes")
+        else:
+            print(f"  ✗ {workers} worker(s): {count} written, {invalid} invalid")
+            all_passed = False
+    if "Line 13: Invalid JSON" in errors.getvalue() and "Line 14" in errors.getvalue():
+        print("  ✓ Invalid lines are reported with their line numbers")
+    else:
+        print(f"  ✗ Errors: {errors.getvalue()!r}")
+        all_passed = False
+    return all_passed
+
+
+def test_constant_memory():
+    """Test that peak memory does not grow with the number of records"""
+    print("\nTesting memory use...")
+    peaks = {}
+    for count in (10, 80):
+        with open(os.devnull, "wb") as target:
+            tracemalloc.start()
+            run_pipe(io.BytesIO(ndjson(count)), target, backend="incremental")
+            peaks[count] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    # Input held in BytesIO for the test grows by ~10 KB; certificates are ~1 MB each
+    if peaks[80] < peaks[10] + 512 * 1024:
+        print(f"  ✓ Peak {peaks[10] / 1024 / 1024:.1f} MB for 10 records, "
+              f"{peaks[80] / 1024 / 1024:.1f} MB for 80")
+        return True
+    print(f"  ✗ Peaks {peaks}")
+    return False
+
+
+def test_command_line():
+    """Test stdin to stdout through the command line"""
+    print("\nTesting the command line...")
+    result = subprocess.run([sys.executable, "certificate_pipe.py", "--backend", "incremental"],
+                            input=ndjson(3), capture_output=True, timeout=120)
+    if result.returncode == 0 and check_archive(result.stdout, 3) and b"3 certificates" in result.stderr:
+        print("  ✓ python certificate_pipe.py < records.ndjson > certificates.tar")
+        return True
+    print(f"  ✗ Exit {result.returncode}: {result.stderr.decode()}")
+    return False
+
+
+def main():
+    print("=" * 70)
+    print("Certificate Pipeline Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_pipeline(), test_constant_memory(), test_command_line()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All pipeline tests passed")
+    else:
+        print("✗ Some pipeline tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Test the certificate HTTP service against localhost
+"""
+
+import asyncio
+import http.client
+import io
+import json
+import socket
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from certificate_service import CertificateService
+
+RECORD = {"prefix": "D4PQ", "serial": "236599", "activation": "02/10/2025", "lot": "LOT1",
+          "gas_prod": "21/03/2024", "calibration": "02/10/2025"}
+
+
+class RunningService:
+    """CertificateService on its own event loop thread"""
+
+    def __init__(self, **options):
+        self.service = CertificateService(**options)
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.port = self.loop.run_until_complete(self.service.start("127.0.0.1", 0))
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait(60)
+
+    def request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        payload = json.dumps(body).encode() if body is not None else None
+        connection.request(method, path, payload, headers or {})
+        response = connection.getresponse()
+        data = response.read()
+        connection.close()
+        return response.status, dict(response.getheaders()), data
+
+    def raw(self, data):
+        """Status of a hand-written request"""
+        with socket.create_connection(("127.0.0.1", self.port), timeout=60) as connection:
+            connection.sendall(data)
+            return int(connection.makefile("rb").readline().split()[1])
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.service.close(), self.loop).result(60)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+
+
+def test_endpoints():
+    """Test single certificates, invoice ZIPs, validation, health and metrics"""
+    print("Testing service endpoints...")
+    all_passed = True
+    running = RunningService(workers=2, backend="incremental")
+    try:
+        status, headers, pdf = running.request("POST", "/certificates", RECORD)
+        if status == 200 and pdf.startswith(b"%PDF") and "D4PQ236599.pdf" in headers["Content-Disposition"]:
+            print(f"  ✓ POST /certificates returned a {len(pdf) // 1024} KB PDF")
+        else:
+            print(f"  ✗ POST /certificates: {status} {pdf[:80]}")
+            all_passed = False
+
+        records = [dict(RECORD, serial=str(100000 + i)) for i in range(3)]
+        status, _, package = running.request("POST", "/invoices", {"invoice": "77", "records": records})
+        names = zipfile.ZipFile(io.BytesIO(package)).namelist() if status == 200 else []
+        if len(names) == 4 and names[-1] == "manifest.json":
+            print("  ✓ POST /invoices returned an invoice ZIP with 3 certificates")
+        else:
+            print(f"  ✗ POST /invoices: {status} {names}")
+            all_passed = False
+
+        status, _, body = running.request("POST", "/certificates", dict(RECORD, activation="31/02/2025"))
+        if status == 400 and b"Activation" in body:
+            print("  ✓ Invalid record rejected with 400")
+        else:
+            print(f"  ✗ Invalid record: {status} {body}")
+            all_passed = False
+
+        status, _, pdf = running.request("POST", "/certificates", dict(RECORD, activation="02102025"))
+        if status == 200 and pdf.startswith(b"%PDF"):
+            print("  ✓ A date without slashes is accepted")
+        else:
+            print(f"  ✗ Date without slashes: {status} {pdf[:80]}")
+            all_passed = False
+
+        statuses = [running.raw(b"POST /certificates HTTP/1.1\r\nHost: x\r\n\r\n"),
+                    running.raw(b"POST /certificates HTTP/1.1\r\nContent-Length: ten\r\n\r\n"),
+                    running.raw(b"POST /certificates HTTP/1.1\r\nContent-Length: -1\r\n\r\n")]
+        if statuses == [411, 400, 400]:
+            print("  ✓ Missing or invalid Content-Length answered 411 / 400")
+        else:
+            print(f"  ✗ Content-Length statuses {statuses}")
+            all_passed = False
+
+        health = json.loads(running.request("GET", "/health")[2])
+        metrics = json.loads(running.request("GET", "/metrics")[2])
+        if health["status"] == "ok" and metrics["certificates"] == 5 and metrics["latency_p50"]:
+            print(f"  ✓ /health and /metrics report ({metrics['certificates']} certificates rendered)")
+        else:
+            print(f"  ✗ health {health}, metrics {metrics}")
+            all_passed = False
+    finally:
+        running.stop()
+    return all_passed
+
+
+def test_backpressure_and_priority():
+    """Test 429 when the queue is full and that rush requests jump the queue"""
+    print("\nTesting backpressure and priority...")
+    all_passed = True
+
+    running = RunningService(workers=1, max_pending=2, backend="overlay")
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            statuses = list(executor.map(
+                lambda i: running.request("POST", "/certificates", dict(RECORD, serial=str(i)))[0], range(8)))
+        if statuses.count(429) and statuses.count(200):
+            print(f"  ✓ {statuses.count(429)}/8 requests answered 429 with 2 allowed in flight")
+        else:
+            print(f"  ✗ Statuses {statuses}")
+            all_passed = False
+    finally:
+        running.stop()
+
+    running = RunningService(workers=1, max_pending=10, backend="overlay")
+    try:
+        finished = {}
+
+        def send(name, priority):
+            if name == "first":  # keeps the only worker busy while the others queue
+                running.request("POST", "/invoices", {"records": [dict(RECORD, serial=str(i)) for i in range(5)]})
+            else:
+                running.request("POST", "/certificates", dict(RECORD, priority=priority))
+            finished[name] = time.perf_counter()
+
+        with ThreadPoolExecutor(4) as executor:
+            for name, priority in (("first", "normal"), ("normal1", "normal"),
+                                   ("normal2", "normal"), ("rush", "rush")):
+                executor.submit(send, name, priority)
+                time.sleep(0.05)
+        if finished["rush"] < finished["normal1"] and finished["rush"] < finished["normal2"]:
+            print("  ✓ Rush request finished before normal requests queued earlier")
+        else:
+            print(f"  ✗ Completion order {sorted(finished, key=finished.get)}")
+            all_passed = False
+    finally:
+        running.stop()
+    return all_passed
+
+
+def main():
+    """Run all tests"""
+    results = [test_endpoints(), test_backpressure_and_priority()]
+    print("\n" + ("✓ All service tests passed!" if all(results) else "✗ Some service tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Test reading written certificates back and checking their text
+"""
+
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from batch_generate import run_batch
+from certificate_engine import ENGINES, PRODUCTS, IncrementalUpdateEngine, OverlayMergeEngine, get_engine, make_record
+from certificate_verify import Verifier, verify_certificate
+from pdf_output import finish_pdf
+from product_coordinates import PRODUCT_COORDINATES
+
+RECORD = make_record("SOSP", "236599", "02/10/2025", "25-3348", "21/03/2024", "02/10/2025")
+
+
+def records(count, start=700000):
+    return [make_record("D4PQ", str(start + i), "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+            for i in range(count)]
+
+
+def test_backends_pass():
+    """Test certificates from every PDF backend and finishing option verify"""
+    print("Testing certificates from every backend...")
+    engines = [OverlayMergeEngine("pypdf2")]
+    engines += [get_engine(None, name) for name in ("overlay", "incremental", "acroform")
+                if ENGINES[name].available()[0]]
+    all_passed = True
+    for engine in engines:
+        label = f"{engine.name} ({engine.pdf_library})" if engine.name == "overlay" else engine.name
+        problems = []
+        for prefix in PRODUCTS:
+            record = dict(RECORD, prefix=prefix, serial=prefix + "236599")
+            pdf = engine.render(record)
+            problems += verify_certificate(pdf, record)
+            try:
+                problems += verify_certificate(finish_pdf(pdf, linearize=True), record)
+            except RuntimeError:
+                pass  # no pikepdf
+        if problems:
+            print(f"  ✗ {label}: {problems}")
+            all_passed = False
+        else:
+            print(f"  ✓ {label}: all products verify")
+    return all_passed
+
+
+def test_problems_found():
+    """Test wrong text, a moved field, a wrong size and a wrong font are reported"""
+    print("\nTesting wrong certificates...")
+    engine = IncrementalUpdateEngine()
+    right = engine.render(RECORD)
+    lot = PRODUCT_COORDINATES["SOSP"]["page1"]["lot"]
+    lot["y"] += 0.5
+    try:
+        moved = engine.render(RECORD)
+    finally:
+        lot["y"] -= 0.5
+    lot["size"] += 1
+    try:
+        larger = engine.render(RECORD)
+    finally:
+        lot["size"] -= 1
+    engine.FONT_NAMES = {"Helvetica": "/GCHeBo", "Helvetica-Bold": "/GCHelv"}
+    swapped = engine.render(RECORD)
+
+    cases = [
+        ("wrong serial", verify_certificate(right, dict(RECORD, serial="SOSP236598")),
+         ["page 1 serial: 'SOSP236598' not found ('SOSP236599' drawn instead)",
+          "page 2 serial: 'SOSP236598' not found ('SOSP236599' drawn instead)"]),
+        ("moved lot", verify_certificate(moved, RECORD), ["page 1 lot: at (95.75, 410.08), expected (95.75, 409.58)"]),
+        ("larger lot", verify_certificate(larger, RECORD), ["page 1 lot: size 14, expected 13"]),
+        ("swapped fonts", len(verify_certificate(swapped, RECORD)), 6),
+        ("not a PDF", verify_certificate(b"not a pdf", RECORD)[0].startswith("cannot read"), True),
+    ]
+    all_passed = True
+    for label, found, expected in cases:
+        if found == expected:
+            print(f"  ✓ {label}: reported")
+        else:
+            print(f"  ✗ {label}: {found}")
+            all_passed = False
+    return all_passed
+
+
+def test_background_verifier():
+    """Test the verifier thread checks every or a sample of the certificates"""
+    print("\nTesting the background verifier...")
+    engine = get_engine("D4PQ", "incremental")
+    rendered = [(engine.render(record), record) for record in records(10)]
+    reported = []
+    verifier = Verifier(1.0, on_failure=lambda record, problems: reported.append(record["serial"]))
+    for pdf, record in rendered:
+        verifier.submit(pdf, record)
+    verifier.submit(lambda: rendered[0][0], rendered[1][1])
+    counts = verifier.close()
+    all_passed = True
+    if counts == {"submitted": 11, "checked": 11, "failed": 1, "skipped": 0} \
+            and reported == [rendered[1][1]["serial"]] and len(verifier.failures) == 1:
+        print(f"  ✓ Every certificate checked, the wrong one reported ({verifier.seconds * 1000 / 11:.1f} ms each)")
+    else:
+        print(f"  ✗ {counts}, reported {reported}")
+        all_passed = False
+
+    none = Verifier(0.0)
+    half = Verifier(0.5, on_failure=None)
+    sampled = sum(half.submit(rendered[0][0], rendered[0][1]) for _ in range(100))
+    none.submit(rendered[0][0], rendered[0][1])
+    if none.close()["checked"] == 0 and 25 <= sampled <= 75 and half.close()["checked"] == sampled:
+        print(f"  ✓ Sample rate 0.5 checked {sampled} of 100, 0 checked none")
+    else:
+        print(f"  ✗ Sampled {sampled} of 100")
+        all_passed = False
+
+    try:
+        Verifier(1.5)
+        print("  ✗ A sample rate above 1 was accepted")
+        all_passed = False
+    except ValueError:
+        print("  ✓ A sample rate above 1 is rejected")
+    return all_passed
+
+
+def test_verifier_errors():
+    """Test a raising pdf() or on_failure counts as failed and keeps the thread running"""
+    print("\nTesting verifier errors...")
+    rendered = [(get_engine("D4PQ", "incremental").render(record), record) for record in records(4, 720000)]
+
+    def unreadable():
+        raise FileNotFoundError("member gone")
+
+    def unwritable(record, problems):
+        raise PermissionError("output/ is read-only")
+
+    verifier = Verifier(1.0, max_pending=2, on_failure=unwritable)
+
+    def submit_all():
+        for _ in range(3):
+            verifier.submit(unreadable, rendered[0][1])
+            verifier.submit(rendered[0][0], rendered[1][1])
+            verifier.submit(rendered[2][0], rendered[2][1])
+        verifier.wait()
+
+    submitter = threading.Thread(target=submit_all, daemon=True)
+    submitter.start()
+    submitter.join(30)
+    if submitter.is_alive():
+        print("  ✗ submit() or wait() hung after an error on the verifier thread")
+        return False
+    counts = verifier.close()
+    if counts == {"submitted": 9, "checked": 9, "failed": 6, "skipped": 0} \
+            and verifier.failures[0][1] == ["cannot read the certificate: member gone"]:
+        print("  ✓ Errors are counted as failed checks and the thread keeps running")
+        return True
+    print(f"  ✗ {counts}, failures {verifier.failures[:2]}")
+    return False
+
+
+def test_batch_verify():
+    """Test run_batch(verify=True) checks every certificate it writes"""
+    print("\nTesting batch verification...")
+    lines = []
+    with tempfile.TemporaryDirectory() as tmp:
+        summary = run_batch(records(20, 710000), Path(tmp) / "output", "V1", "incremental",
+                            ledger_path=Path(tmp) / "certificates.db", verify=True, log=lines.append)
+    verified = [line for line in lines if "Verified" in line]
+    if summary["verify_failures"] == [] and verified and verified[0].startswith("✓ Verified 20 certificate(s): 0 failed"):
+        print(f"  {verified[0]}")
+        return True
+    print(f"  ✗ {summary['verify_failures']}, log {lines}")
+    return False
+
+
+def main():
+    print("=" * 70)
+    print("Certificate Verification Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_backends_pass(), test_problems_found(), test_background_verifier(), test_verifier_errors(),
+               test_batch_verify()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All verification tests passed")
+    else:
+        print("✗ Some verification tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test distributed batch generation with local processes as nodes
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from certificate_engine import make_record
+from certificate_ledger import CertificateLedger
+from distributed_batch import Job, Lease, collect, process_chunk, split_order, work
+from invoice_manifest import verify_folder
+
+
+def records(count, start=800000):
+    return [make_record("D4PQ", str(start + i), "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+            for i in range(count)]
+
+
+def test_local_nodes():
+    """Test three worker processes sharing a job, then collecting it"""
+    print("Testing three local nodes...")
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        job = split_order(records(24), root / "job", "900", chunk_size=3, backend="incremental",
+                          lease_seconds=10)
+        nodes = [subprocess.Popen([sys.executable, "distributed_batch.py", "work", str(job.path)],
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                 for _ in range(3)]
+        outputs = [node.communicate(timeout=300)[0].decode() for node in nodes]
+        markers = [json.loads(job.marker(chunk).read_text()) for chunk in job.chunks()]
+        if all(node.returncode == 0 for node in nodes) and job.status()["done"] == 8:
+            print(f"  ✓ 8 chunks done by {len({marker['node'] for marker in markers})} node(s)")
+        else:
+            print(f"  ✗ Status {job.status()}: {outputs}")
+            all_passed = False
+
+        paths = collect(job.path, root / "output", root / "certificates.db")
+        result = verify_folder(root / "output" / "Invoice_900")
+        with CertificateLedger(root / "certificates.db") as ledger:
+            recorded = ledger.issued_serials(path.stem for path in paths)
+        if len(result["ok"]) == 24 and len(recorded) == 24:
+            print("  ✓ Collected into Invoice_900: manifest verifies, ledger has all 24")
+        else:
+            print(f"  ✗ Verify {result}, ledger {len(recorded)}")
+            all_passed = False
+    return all_passed
+
+
+def test_leases():
+    """Test O_EXCL claims, reclaiming expired leases and discarding lost ones"""
+    print("\nTesting leases...")
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        job = split_order(records(4), Path(tmp) / "job", "901", chunk_size=2, backend="incremental",
+                          lease_seconds=1)
+
+        first = Lease.acquire(job, "chunk-00000", "node-a")
+        if first is not None and Lease.acquire(job, "chunk-00000", "node-b") is None:
+            print("  ✓ A held chunk cannot be claimed a second time")
+        else:
+            print("  ✗ Chunk claimed twice")
+            all_passed = False
+
+        # node-a stops heartbeating: its lease expires and node-b takes over
+        os.utime(first.path, (time.time() - 5, time.time() - 5))
+        second = Lease.acquire(job, "chunk-00000", "node-b")
+        if second is not None and second.generation == 1 and not first.held():
+            print("  ✓ An expired lease is reclaimed as generation 1")
+        else:
+            print(f"  ✗ Reclaim gave {second}")
+            all_passed = False
+
+        if not process_chunk(job, first) and not job.is_done("chunk-00000") \
+                and not list(job.results_dir.glob("*.partial")):
+            print("  ✓ The node that lost its lease discards its results")
+        else:
+            print("  ✗ A lost lease published results")
+            all_passed = False
+
+        # Leave chunk-00001 with a dead node's stale lease; a worker finishes both
+        stale = Lease.acquire(job, "chunk-00001", "node-dead")
+        os.utime(stale.path, (time.time() - 5, time.time() - 5))
+        os.utime(second.path, (time.time() - 5, time.time() - 5))
+        work(job.path, node="node-c", poll=0.1, log=lambda line: None)
+        markers = {chunk: json.loads(job.marker(chunk).read_text()) for chunk in job.chunks()}
+        if all(marker["node"] == "node-c" and marker["generation"] >= 1 for marker in markers.values()):
+            print("  ✓ A live node takes over and finishes chunks of dead nodes")
+        else:
+            print(f"  ✗ Markers {markers}")
+            all_passed = False
+    return all_passed
+
+
+def test_crash_before_marker():
+    """Test a chunk published without its marker is finished by the next node"""
+    print("\nTesting a node that dies between publishing and its marker...")
+    with tempfile.TemporaryDirectory() as tmp:
+        job = split_order(records(2), Path(tmp) / "job", "902", chunk_size=2, backend="incremental",
+                          lease_seconds=1)
+        dead = Lease.acquire(job, "chunk-00000", "node-dead")
+        process_chunk(job, dead)
+        # As if node-dead had died after the rename, before creating the marker
+        job.marker("chunk-00000").unlink()
+        os.utime(dead.path, (time.time() - 5, time.time() - 5))
+
+        lines = []
+        worker = threading.Thread(target=work, args=(job.path,),
+                                  kwargs={"node": "node-b", "poll": 0.1, "log": lines.append}, daemon=True)
+        worker.start()
+        worker.join(30)
+        if worker.is_alive():
+            print(f"  ✗ The worker never finished: {lines[:3]}")
+            return False
+        marker = json.loads(job.marker("chunk-00000").read_text())
+        missing = [entry["path"] for entry in marker["certificates"] if not (job.path / entry["path"]).exists()]
+        if marker["node"] == "node-b" and len(marker["certificates"]) == 2 and not missing \
+                and not list(job.results_dir.glob("*.stale")):
+            print("  ✓ The next lease holder replaces the unmarked results and writes the marker")
+            return True
+        print(f"  ✗ Marker {marker}, missing {missing}")
+        return False
+
+
+def main():
+    print("=" * 70)
+    print("Distributed Batch Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_local_nodes(), test_leases(), test_crash_before_marker()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All distributed batch tests passed")
+    else:
+        print("✗ Some distributed batch tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -132,7 +132,59 @@ def test_form_filling():
         traceback.print_exc()
         return False
 
+def test_form_engine():
+    """Test the form_filler engine: filled fields and flattened output"""
+    print("=" * 70)
+    print("Testing AcroForm Fill-and-Flatten Engine")
+    print("=" * 70)
+    
+    from form_filler import fill_certificate, form_values, FORMS_DIR, FORM_TEMPLATES
+    import io
+    
+    if not (FORMS_DIR / FORM_TEMPLATES["SOSP"]).exists():
+        print(f"\n✗ ERROR: Form template not found in {FORMS_DIR}")
+        print("Please run: python create_form_templates.py")
+        return False
+    
+    data = {
+        "serial": "SOSP55555",
+        "activation": "02/10/2025",
+        "lot": "TEST (123)",
+        "gas_prod": "21/03/2024",
+        "calibration": "02/10/2025",
+        "calibration_exp": "02/10/2027"
+    }
+    
+    all_passed = True
+    
+    # Filled but not flattened: values readable as form fields
+    filled = io.BytesIO()
+    fill_certificate("SOSP", data, filled, flatten=False)
+    fields = PdfReader(filled).get_form_text_fields() or {}
+    if fields == form_values(data):
+        print(f"✓ Filled {len(fields)} form fields")
+    else:
+        print(f"✗ Unexpected field values: {fields}")
+        all_passed = False
+    
+    # Flattened: no form left, values part of the page text
+    flat = io.BytesIO()
+    fill_certificate("SOSP", data, flat, flatten=True)
+    reader = PdfReader(flat)
+    text = reader.pages[0].extract_text() + reader.pages[1].extract_text()
+    if "/AcroForm" in reader.trailer["/Root"] or "/Annots" in reader.pages[0]:
+        print("✗ Flattened output still has form fields")
+        all_passed = False
+    missing = [value for value in form_values(data).values() if value not in text]
+    if missing:
+        print(f"✗ Flattened text missing: {missing}")
+        all_passed = False
+    else:
+        print("✓ Flattened values found in page content")
+    
+    return all_passed
+
 if __name__ == "__main__":
     import sys
-    success = test_form_filling()
+    success = test_form_filling() and test_form_engine()
     sys.exit(0 if success else 1)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test hash-on-write and invoice checksum manifests
+"""
+
+import csv
+import hashlib
+import os
+import sys
+import tempfile
+from pathlib import Path
+from invoice_manifest import MANIFEST_CSV, verify_folder, write_hashed, write_manifest
+from session_journal import SessionJournal
+
+
+def issue_certificates(folder, count):
+    """Write certificates the way the GUIs do: hashed on write, recorded in the journal"""
+    journal = SessionJournal(folder)
+    for i in range(count):
+        path = folder / f"D4PQ{i:05d}.pdf"
+        size, sha256 = write_hashed(path, b"%PDF-1.5 " + os.urandom(64 * 1024))
+        journal.append({"filename": path.name, "path": str(path), "serial": path.stem,
+                        "product": "MGC-S+", "data": {}}, sha256, size)
+    journal.close()
+    return journal.load()
+
+
+def test_hash_on_write():
+    """Test that the tee hash matches the bytes on disk"""
+    print("Testing hash-on-write...")
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        path = Path(tmp) / "SOSP00001.pdf"
+        size, sha256 = write_hashed(path, data)
+        if size == len(data) and sha256 == hashlib.sha256(path.read_bytes()).hexdigest():
+            print("  ✓ Size and SHA-256 computed while writing match the file")
+            return True
+        print("  ✗ Tee hash does not match the file")
+        return False
+
+
+def test_manifest_and_verify():
+    """Test the CSV/JSON manifest and detection of altered certificates"""
+    print("\nTesting manifest and verify...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "Invoice_200"
+        folder.mkdir()
+        write_manifest(folder, issue_certificates(folder, 200))
+
+        with open(folder / MANIFEST_CSV, newline="") as f:
+            rows = list(csv.DictReader(f))
+        if len(rows) == 200 and rows[0]["product"] == "MGC-S+" and rows[0]["generated"]:
+            print("  ✓ manifest.csv lists serial, product, size, hash and time")
+        else:
+            print(f"  ✗ manifest.csv has {len(rows)} rows")
+            all_passed = False
+
+        result = verify_folder(folder)
+        if len(result["ok"]) == 200:
+            print("  ✓ Untouched invoice verifies")
+        else:
+            print(f"  ✗ Verify of untouched invoice: { {k: len(v) for k, v in result.items()} }")
+            all_passed = False
+
+        # Alter one byte without changing the size, remove one, add one
+        altered = folder / "D4PQ00007.pdf"
+        data = bytearray(altered.read_bytes())
+        data[-1] ^= 0xFF
+        altered.write_bytes(bytes(data))
+        (folder / "D4PQ00008.pdf").unlink()
+        (folder / "D4PQ99999.pdf").write_bytes(b"%PDF-1.5")
+        (folder / "Invoice_200.pdf").write_bytes(b"%PDF-1.5 bundle")
+
+        result = verify_folder(folder)
+        if (result["modified"] == ["D4PQ00007.pdf"] and result["missing"] == ["D4PQ00008.pdf"]
+                and result["unlisted"] == ["D4PQ99999.pdf"] and len(result["ok"]) == 198):
+            print("  ✓ Modified, missing and unlisted certificates reported")
+        else:
+            print(f"  ✗ Verify result: { {k: v[:3] for k, v in result.items()} }")
+            all_passed = False
+
+    return all_passed
+
+
+def main():
+    """Run all tests"""
+    results = [test_hash_on_write(), test_manifest_and_verify()]
+    print("\n" + ("✓ All manifest tests passed!" if all(results) else "✗ Some manifest tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
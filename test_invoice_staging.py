@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test staged invoice finalization
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from invoice_staging import StagingSession
+from session_journal import JOURNAL_NAME, SessionJournal
+
+
+def stage_certificates(session, count):
+    journal = SessionJournal(session.path)
+    for i in range(count):
+        path = session.path / f"D4PQ{i:05d}.pdf"
+        path.write_bytes(b"%PDF-1.5 certificate")
+        journal.append({"filename": path.name, "path": str(path), "serial": path.stem,
+                        "product": "MGC-S+", "data": {}}, "0" * 64)
+    journal.close()
+
+
+def test_atomic_finalize():
+    """Test that finishing an invoice is one rename, even for 1,000 certificates"""
+    print("Testing atomic finalize...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        session = StagingSession.resume_or_create(output_dir)
+        stage_certificates(session, 1000)
+
+        if StagingSession.resume_or_create(output_dir).path == session.path:
+            print("  ✓ Unfinished staging folder is resumed")
+        else:
+            print("  ✗ A new staging folder was started")
+            all_passed = False
+
+        start = time.perf_counter()
+        moved = session.finalize(output_dir / "Invoice_1000")
+        elapsed = time.perf_counter() - start
+
+        invoice = output_dir / "Invoice_1000"
+        if (len(moved) == 1000 and len(list(invoice.iterdir())) == 1000
+                and not session.path.exists() and not (invoice / JOURNAL_NAME).exists()):
+            print(f"  ✓ 1000 certificates finalized in {elapsed * 1000:.1f} ms")
+        else:
+            print(f"  ✗ {len(moved)} moved, staging left: {session.path.exists()}")
+            all_passed = False
+
+        if elapsed >= 1.0:
+            print(f"  ✗ Finalize took {elapsed:.2f}s")
+            all_passed = False
+
+        # Same invoice number again: files are merged into the existing folder
+        second = StagingSession.create(output_dir)
+        (second.path / "SOSP00001.pdf").write_bytes(b"%PDF-1.5")
+        second.finalize(invoice)
+        if (invoice / "SOSP00001.pdf").exists() and not second.path.exists():
+            print("  ✓ Existing invoice folder receives the new certificates")
+        else:
+            print("  ✗ Merge into existing invoice folder failed")
+            all_passed = False
+
+    return all_passed
+
+
+def test_cross_filesystem():
+    """Test the parallel copy fallback when the invoice folder is on another filesystem"""
+    print("\nTesting cross-filesystem finalize...")
+    shm = Path("/dev/shm")
+    if not shm.is_dir():
+        print("  - no second filesystem available, skipped")
+        return True
+
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory(dir=shm) as other:
+        if os.stat(tmp).st_dev == os.stat(other).st_dev:
+            print("  - /dev/shm is on the same filesystem, skipped")
+            return True
+
+        session = StagingSession.create(tmp)
+        stage_certificates(session, 50)
+        updates = []
+        moved = session.finalize(Path(other) / "Invoice_50", lambda done, total: updates.append(done))
+
+        invoice = Path(other) / "Invoice_50"
+        if len(moved) == 50 and len(list(invoice.iterdir())) == 50 and updates[-1] == 50:
+            print(f"  ✓ 50 certificates copied with {len(updates)} progress updates")
+            return True
+        print(f"  ✗ {len(moved)} moved, progress {updates[-1:]}")
+        return False
+
+
+def main():
+    """Run all tests"""
+    results = [test_atomic_finalize(), test_cross_filesystem()]
+    print("\n" + ("✓ All staging tests passed!" if all(results) else "✗ Some staging tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
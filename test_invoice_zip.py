@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Test streaming invoice ZIP packages
+"""
+
+import json
+import os
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+from batch_generate import run_batch
+from certificate_engine import make_record
+from certificate_ledger import CertificateLedger
+from invoice_zip import MANIFEST_NAME, InvoiceZipWriter, probe_sample, read_location, split_location, zip_folder
+
+
+def test_streaming_package():
+    """Test entries, compression choice and the manifest"""
+    print("Testing streaming invoice ZIP...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        zip_path = Path(tmp) / "Invoice_1.zip"
+        compressible = b"%PDF-1.5 " + b"0 0 m 595 842 l S\n" * 5000
+        incompressible = b"%PDF-1.5 " + os.urandom(200 * 1024)
+
+        with InvoiceZipWriter(zip_path) as package:
+            package.add("D4PQ00001.pdf", compressible, {"serial": "D4PQ00001"})
+            package.add("D4PQ00002.pdf", incompressible, {"serial": "D4PQ00002"})
+            if zip_path.exists() or not package.partial.exists():
+                print("  ✗ Final ZIP visible before close")
+                all_passed = False
+
+        with zipfile.ZipFile(zip_path) as archive:
+            infos = archive.infolist()
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+            if archive.testzip() is None and archive.read("D4PQ00002.pdf") == incompressible:
+                print("  ✓ ZIP readable and entries intact")
+            else:
+                print("  ✗ ZIP entries corrupted")
+                all_passed = False
+
+        methods = [info.compress_type for info in infos[:2]]
+        if methods == [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED]:
+            print("  ✓ Compressible entry deflated, incompressible entry stored")
+        else:
+            print(f"  ✗ Compression methods {methods}")
+            all_passed = False
+
+        if infos[-1].filename == MANIFEST_NAME and manifest["certificates"] == 2:
+            print("  ✓ Manifest written last")
+        else:
+            print("  ✗ Manifest missing or not last")
+            all_passed = False
+
+        if not list(Path(tmp).glob("*.partial")):
+            print("  ✓ No partial file left behind")
+        else:
+            print("  ✗ Partial file left behind")
+            all_passed = False
+
+    return all_passed
+
+
+def test_abort_and_folder():
+    """Test that a failed package leaves nothing and folders are zipped from disk"""
+    print("\nTesting abort and folder packaging...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        zip_path = Path(tmp) / "Invoice_2.zip"
+        try:
+            with InvoiceZipWriter(zip_path) as package:
+                package.add("D4PQ00001.pdf", b"%PDF-1.5")
+                raise RuntimeError("render failed")
+        except RuntimeError:
+            pass
+        if not list(Path(tmp).iterdir()):
+            print("  ✓ Aborted package removed")
+        else:
+            print("  ✗ Aborted package left files behind")
+            all_passed = False
+
+        folder = Path(tmp) / "Invoice_3"
+        folder.mkdir()
+        for serial in ("SOSP00001", "SOSP00002"):
+            (folder / f"{serial}.pdf").write_bytes(b"%PDF-1.5 " + serial.encode())
+        with zipfile.ZipFile(zip_folder(folder)) as archive:
+            names = archive.namelist()
+        if names == ["SOSP00001.pdf", "SOSP00002.pdf", MANIFEST_NAME]:
+            print("  ✓ Invoice folder packaged as Invoice_3.zip")
+        else:
+            print(f"  ✗ Packaged entries {names}")
+            all_passed = False
+
+    return all_passed
+
+
+def test_probe_buffers():
+    """Test the probe takes the same sample from bytes, bytearrays and memoryviews"""
+    print("\nTesting probe samples...")
+    data = os.urandom(200 * 1024)
+    samples = [probe_sample(buffer) for buffer in (data, bytearray(data), memoryview(data))]
+    if samples[0] == samples[1] == samples[2] and isinstance(samples[2], bytes):
+        print("  ✓ bytes, bytearray and memoryview probed alike")
+        return True
+    print("  ✗ Samples differ")
+    return False
+
+
+def test_batch_zip_locations():
+    """Test batch --zip records where each certificate is inside the ZIP"""
+    print("\nTesting ledger locations of zipped certificates...")
+    records = [make_record("D4PQ", str(730000 + i), "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+               for i in range(3)]
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger_path = Path(tmp) / "certificates.db"
+        summary = run_batch(records, Path(tmp) / "output", "7", "incremental", zip_package=True,
+                            ledger_path=ledger_path, log=lambda line: None)
+        with CertificateLedger(ledger_path) as ledger:
+            locations = [ledger.lookup(record["serial"])["output_path"] for record in records]
+        archives = {split_location(location)[0] for location in locations}
+        readable = all(read_location(location).startswith(b"%PDF") for location in locations)
+    if archives == {summary["location"]} and readable:
+        print(f"  ✓ Ledger points into the ZIP: {Path(locations[0]).parent.name}/{Path(locations[0]).name}")
+        return True
+    print(f"  ✗ Ledger locations {locations}")
+    return False
+
+
+def main():
+    """Run all tests"""
+    results = [test_streaming_package(), test_abort_and_folder(), test_probe_buffers(),
+               test_batch_zip_locations()]
+    print("\n" + ("✓ All invoice ZIP tests passed!" if all(results) else "✗ Some invoice ZIP tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test lazy (template-referenced) certificate storage
+"""
+
+import hashlib
+import sys
+import tempfile
+from pathlib import Path
+from certificate_engine import PRODUCTS, get_engine, make_record
+from certificate_ledger import CertificateLedger, ledger_entry
+from lazy_archive import CACHE_DIR, LazyArchive, MaterializedCache, stub_path
+
+
+def issue(root, ledger, backend, serial_digits):
+    record = make_record("D4PQ", serial_digits, "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+    engine = get_engine("D4PQ", backend)
+    path = root / "Invoice_1" / f"{record['serial']}.pdf"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(engine.render(record))
+    ledger.record(ledger_entry(record, PRODUCTS["D4PQ"]["name"], engine.template_path("D4PQ"), path, "1"))
+    return path
+
+
+def test_compact_and_materialize():
+    """Test that a compacted certificate comes back byte for byte"""
+    print("Testing lazy compaction...")
+    try:
+        import pikepdf  # noqa: F401
+    except ImportError:
+        print("  - pikepdf not installed, skipped")
+        return True
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "output"
+        ledger_path = Path(tmp) / "ledger.db"
+        with CertificateLedger(ledger_path) as ledger:
+            overlay = issue(root, ledger, "overlay", "00001")
+            incremental = issue(root, ledger, "incremental", "00002")
+        original = overlay.read_bytes()
+
+        archive = LazyArchive(root, ledger_path)
+        stubbed, kept = archive.compact([overlay, incremental])
+        stub_size = stub_path(overlay).stat().st_size
+        if stubbed == [overlay] and not overlay.exists() and stub_size * 1000 < len(original):
+            print(f"  ✓ {len(original) // 1024} KB certificate stored as a {stub_size} byte stub")
+        else:
+            print(f"  ✗ Stubbed {stubbed}, stub {stub_size} bytes")
+            all_passed = False
+
+        if [path for path, _ in kept] == [incremental] and incremental.exists():
+            print(f"  ✓ Certificate the overlay engine can't reproduce kept ({kept[0][1]})")
+        else:
+            print(f"  ✗ Kept {kept}")
+            all_passed = False
+
+        pdf = archive.materialize("D4PQ00001")
+        cached = root / CACHE_DIR / "D4PQ00001.pdf"
+        if hashlib.sha256(pdf).digest() == hashlib.sha256(original).digest() and cached.exists():
+            print("  ✓ Re-rendered PDF identical to the issued one, and cached")
+        else:
+            print("  ✗ Materialized PDF differs from the issued one")
+            all_passed = False
+
+    return all_passed
+
+
+def test_lru_cache():
+    """Test that the materialized cache evicts the least recently used file"""
+    print("\nTesting materialized LRU cache...")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = MaterializedCache(tmp, max_bytes=3000)
+        for name in ("a.pdf", "b.pdf", "c.pdf"):
+            cache.put(name, b"x" * 1000)
+        cache.get("a.pdf")
+        cache.put("d.pdf", b"x" * 1000)
+        remaining = sorted(path.name for path in Path(tmp).iterdir())
+        if remaining == ["a.pdf", "c.pdf", "d.pdf"] and cache.size == 3000:
+            print("  ✓ Least recently used entry evicted")
+            return True
+        print(f"  ✗ Cache holds {remaining}")
+        return False
+
+
+def main():
+    """Run all tests"""
+    results = [test_compact_and_materialize(), test_lru_cache()]
+    print("\n" + ("✓ All lazy archive tests passed!" if all(results) else "✗ Some lazy archive tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
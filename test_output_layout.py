@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test the sharded output layout, serial index and migration
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+from invoice_manifest import verify_folder, write_hashed, write_manifest
+from invoice_staging import StagingSession
+from output_layout import OutputLayout, SerialIndex, migrate
+from session_journal import SessionJournal
+
+SHARDED = "{prefix}/{yyyy}/{shard}"
+
+
+def record(serial):
+    return {"prefix": "D4PQ", "serial": serial, "calibration": "02/10/2025"}
+
+
+def stage(session, serials):
+    journal = SessionJournal(session.path)
+    for serial in serials:
+        path = session.path / f"{serial}.pdf"
+        size, sha256 = write_hashed(path, b"%PDF-1.5 " + serial.encode())
+        journal.append({"filename": path.name, "path": str(path), "serial": serial,
+                        "product": "MGC-S+", "data": record(serial)}, sha256, size)
+    journal.close()
+    return journal.load()
+
+
+def test_sharded_finish():
+    """Test that finishing an invoice places certificates in their shards"""
+    print("Testing sharded invoice finish...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        layout = OutputLayout(root, SHARDED)
+        session = StagingSession.create(root)
+        moved = layout.finish_invoice(session, stage(session, ["D4PQ236599", "D4PQ100599", "D4PQ100001"]), "42")
+
+        expected = root / "D4PQ" / "2025" / "599" / "D4PQ236599.pdf"
+        if expected in moved and expected.exists() and not session.path.exists():
+            print("  ✓ Certificates moved to <prefix>/<yyyy>/<serial[-3:]>/")
+        else:
+            print(f"  ✗ Certificates at {moved}")
+            all_passed = False
+
+        result = verify_folder(layout.invoice_dir("42"))
+        if len(result["ok"]) == 3:
+            print("  ✓ Invoice manifest in invoices/Invoice_42 verifies the sharded files")
+        else:
+            print(f"  ✗ Verify result {result}")
+            all_passed = False
+
+        with SerialIndex(root) as index:
+            if index.lookup("D4PQ100001") == root / "D4PQ" / "2025" / "001" / "D4PQ100001.pdf":
+                print("  ✓ Serial index resolves the path")
+            else:
+                print(f"  ✗ Index lookup: {index.lookup('D4PQ100001')}")
+                all_passed = False
+
+    return all_passed
+
+
+def test_migration():
+    """Test reorganizing a flat output tree in parallel"""
+    print("\nTesting migration of a flat output folder...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        for invoice in range(3):
+            folder = root / f"Invoice_{invoice}"
+            folder.mkdir()
+            entries = []
+            for i in range(100):
+                serial = f"D4PQ{invoice}{i:04d}"
+                size, sha256 = write_hashed(folder / f"{serial}.pdf", b"%PDF-1.5 " + serial.encode())
+                entries.append({"filename": f"{serial}.pdf", "serial": serial, "size": size, "sha256": sha256})
+            write_manifest(folder, entries)
+            (folder / f"Invoice_{invoice}.pdf").write_bytes(b"%PDF-1.5 bundle")
+
+        layout = OutputLayout(root, SHARDED)
+        moved = migrate(root, layout, ledger_path=root / "no-ledger.db")
+
+        shards = {path.parent for path in moved.values()}
+        if len(moved) == 300 and len(shards) == 100 and not list(root.glob("Invoice_*")):
+            print(f"  ✓ 300 certificates moved into {len(shards)} shard folders")
+        else:
+            print(f"  ✗ {len(moved)} moved into {len(shards)} shards")
+            all_passed = False
+
+        invoice = layout.invoice_dir("1")
+        result = verify_folder(invoice)
+        if len(result["ok"]) == 100 and (invoice / "Invoice_1.pdf").exists():
+            print("  ✓ Manifest rewritten and bundle kept with the invoice")
+        else:
+            print(f"  ✗ Invoice_1 after migration: { {k: len(v) for k, v in result.items()} }")
+            all_passed = False
+
+        with SerialIndex(root) as index:
+            if len(index) == 300 and index.lookup("D4PQ20042") == moved["D4PQ20042"]:
+                print("  ✓ Serial index covers the migrated archive")
+            else:
+                print(f"  ✗ Index has {len(index)} serials")
+                all_passed = False
+
+    return all_passed
+
+
+def main():
+    """Run all tests"""
+    results = [test_sharded_finish(), test_migration()]
+    print("\n" + ("✓ All layout tests passed!" if all(results) else "✗ Some layout tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test signing certificates with a PKCS#12 key
+"""
+
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+from PyPDF2 import PdfReader
+from batch_generate import generate_batch
+from certificate_engine import get_engine, make_record
+from pdf_output import finish_pdf
+from product_coordinates import SIGNATURE_BOX
+
+try:
+    from pdf_signing import Signer, create_self_signed, sign_files, verify_signature
+    import cryptography  # noqa: F401
+except ImportError:
+    cryptography = None
+
+RECORD = make_record("D4PQ", "236599", "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+
+
+def with_key(test):
+    """Run test(key path) with a fresh self-signed key (skipped without cryptography)"""
+    if cryptography is None:
+        print("  - cryptography not installed, skipped")
+        return True
+    with tempfile.TemporaryDirectory() as tmp:
+        key = Path(tmp) / "test.p12"
+        create_self_signed(key, "secret", "GasClip Test")
+        return test(key)
+
+
+def records(count, start=500000):
+    return [make_record("SOSP", str(start + i), "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+            for i in range(count)]
+
+
+def test_sign_and_verify():
+    """Test signatures on classic and cross-reference-stream PDFs, and tampering"""
+    print("Testing sign and verify...")
+    return with_key(check_sign_and_verify)
+
+
+def check_sign_and_verify(key):
+    all_passed = True
+    signer = Signer.from_pkcs12(key, "secret")
+    pdf = get_engine("D4PQ", "incremental").render(RECORD)
+    for label, compact in (("classic xref", False), ("xref stream", True)):
+        try:
+            unsigned = finish_pdf(pdf, compact=compact)
+        except RuntimeError:
+            print("  - pikepdf not installed, xref stream skipped")
+            continue
+        signed = signer.sign(unsigned)
+        result = verify_signature(signed)
+        if result["valid"] and result["whole_file"] and result["signer"] == "GasClip Test":
+            print(f"  ✓ {label}: signature verifies (+{(len(signed) - len(unsigned)) / 1024:.0f} KB)")
+        else:
+            print(f"  ✗ {label}: {result}")
+            all_passed = False
+
+    signed = signer.sign(pdf)
+    tampered = bytearray(signed)
+    tampered[1000] ^= 0x01
+    appended = signed + b"1 0 obj\n<< >>\nendobj\n"
+    if not verify_signature(bytes(tampered))["valid"] and not verify_signature(appended)["whole_file"]:
+        print("  ✓ A changed byte and an appended update are both detected")
+    else:
+        print("  ✗ Tampering not detected")
+        all_passed = False
+
+    try:
+        verify_signature(pdf)
+        print("  ✗ An unsigned PDF passed")
+        all_passed = False
+    except ValueError:
+        print("  ✓ An unsigned PDF is reported as not signed")
+    return all_passed
+
+
+def test_appearance():
+    """Test the signature field is visible at SIGNATURE_BOX only when asked for"""
+    print("\nTesting the signature appearance...")
+    return with_key(check_appearance)
+
+
+def check_appearance(key):
+    pdf = get_engine("D4PQ", "incremental").render(RECORD)
+    all_passed = True
+    for appearance in (False, True):
+        signed = Signer.from_pkcs12(key, "secret", appearance=appearance, reason="Calibration").sign(pdf)
+        reader = PdfReader(io.BytesIO(signed))
+        widget = reader.pages[0]["/Annots"][-1].get_object()
+        fields = reader.trailer["/Root"]["/AcroForm"]["/Fields"]
+        x, y, width, height = SIGNATURE_BOX
+        expected = [x, y, x + width, y + height] if appearance else [0, 0, 0, 0]
+        if [float(value) for value in widget["/Rect"]] == expected and ("/AP" in widget) == appearance \
+                and widget["/FT"] == "/Sig" and len(fields) == 1 and len(reader.pages) == 2:
+            print(f"  ✓ {'Visible' if appearance else 'Invisible'} signature field on page 1")
+        else:
+            print(f"  ✗ Widget {widget}")
+            all_passed = False
+    return all_passed
+
+
+def test_batch_signing():
+    """Test generate_batch signs in this process and in workers, and sign_files"""
+    print("\nTesting batch signing...")
+    return with_key(check_batch_signing)
+
+
+def check_batch_signing(key):
+    all_passed = True
+    signing = {"key": str(key), "password": "secret", "appearance": True}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for workers in (None, 2):
+            start = time.perf_counter()
+            generated = generate_batch(records(20), tmp / f"signed-{workers}", "incremental",
+                                       workers=workers, signing=signing)
+            elapsed = time.perf_counter() - start
+            results = [verify_signature(Path(entry["path"]).read_bytes()) for entry in generated]
+            sizes = all(Path(entry["path"]).stat().st_size == entry["size"] for entry in generated)
+            if len(results) == 20 and all(result["valid"] for result in results) and sizes:
+                print(f"  ✓ workers={workers}: 20 signed certificates in {elapsed:.2f}s")
+            else:
+                print(f"  ✗ workers={workers}: {len(results)} certificates, sizes {sizes}")
+                all_passed = False
+
+        plain = generate_batch(records(10, 510000), tmp / "plain", "incremental")
+        tasks = [(entry["path"], tmp / "signed-files" / entry["filename"]) for entry in plain]
+        (tmp / "signed-files").mkdir()
+        signed = list(sign_files(tasks, {"key": str(key), "password": "secret"}, workers=2))
+        if len(signed) == 10 and all(verify_signature(Path(path).read_bytes())["valid"] for path in signed):
+            print("  ✓ sign_files signs existing certificates into another folder")
+        else:
+            print(f"  ✗ sign_files gave {signed}")
+            all_passed = False
+    return all_passed
+
+
+def main():
+    print("=" * 70)
+    print("Signing Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_sign_and_verify(), test_appearance(), test_batch_signing()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All signing tests passed")
+    else:
+        print("✗ Some signing tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
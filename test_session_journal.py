@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test the crash-safe session journal and batch resume
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+from batch_generate import generate_batch, resumable
+from certificate_engine import make_record
+from session_journal import JOURNAL_NAME, SessionJournal, pdf_hash
+
+
+def test_restore_after_crash():
+    """Test that an unfinished session is rebuilt from the journal"""
+    print("Testing session restore...")
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        journal = SessionJournal(output_dir, fsync_every=2)
+        for i in range(3):
+            path = output_dir / f"SOSP0000{i}.pdf"
+            path.write_bytes(b"%PDF-1.5 certificate " + bytes([48 + i]))
+            journal.append({"filename": path.name, "path": str(path), "serial": path.stem,
+                            "product": "SGC-O", "data": {"serial": path.stem}},
+                           pdf_hash(path.read_bytes()))
+
+        # Crash: the journal is never closed, the last line is torn and one PDF was edited
+        with open(output_dir / JOURNAL_NAME, 'a') as f:
+            f.write('{"filename": "SOSP0000')
+        (output_dir / "SOSP00002.pdf").write_bytes(b"changed")
+
+        restored = SessionJournal(output_dir).restore()
+        if [entry["serial"] for entry in restored] == ["SOSP00000", "SOSP00001"]:
+            print("  ✓ 2 unchanged certificates restored, torn line and edited PDF ignored")
+        else:
+            print(f"  ✗ Restored {[entry['serial'] for entry in restored]}")
+            all_passed = False
+
+        SessionJournal(output_dir).append(dict(restored[0], serial="SOSP00009"), "0" * 64)
+        if "SOSP00009" in [entry["serial"] for entry in SessionJournal(output_dir).load()]:
+            print("  ✓ Appending after a torn line starts a new line")
+        else:
+            print("  ✗ Entry appended after a torn line was lost")
+            all_passed = False
+
+        journal.finish()
+        if not (output_dir / JOURNAL_NAME).exists() and not SessionJournal(output_dir).restore():
+            print("  ✓ Finished session leaves no journal")
+        else:
+            print("  ✗ Journal still present after finish")
+            all_passed = False
+
+    return all_passed
+
+
+def test_batch_resume():
+    """Test that a rerun batch skips certificates already on disk"""
+    print("\nTesting batch resume...")
+    records = [make_record("SHSP", f"{i:05d}", "02/10/2025", "LOT4", "21/03/2024", "02/10/2025")
+               for i in range(4)]
+    all_passed = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        generate_batch(records[:2], output_dir, backend="incremental", journal=SessionJournal(output_dir))
+        first_mtimes = [(output_dir / f"{r['serial']}.pdf").stat().st_mtime_ns for r in records[:2]]
+
+        # Rerun with the full order and one changed row
+        records[1] = dict(records[1], lot="LOT5")
+        journal = SessionJournal(output_dir)
+        resumed = resumable(records, journal, output_dir)
+        generated = generate_batch(records, output_dir, backend="incremental", journal=journal)
+
+        mtimes = [(output_dir / f"{r['serial']}.pdf").stat().st_mtime_ns for r in records[:2]]
+        if resumed == {records[0]["serial"]} and mtimes[0] == first_mtimes[0] and len(generated) == 4:
+            print("  ✓ Unchanged row skipped, changed and new rows rendered")
+        else:
+            print(f"  ✗ Resumed {resumed}, {len(generated)} generated")
+            all_passed = False
+
+    return all_passed
+
+
+def main():
+    """Run all tests"""
+    results = [test_restore_after_crash(), test_batch_resume()]
+    print("\n" + ("✓ All journal tests passed!" if all(results) else "✗ Some journal tests failed."))
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test templates shared with worker processes through shared memory
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from certificate_engine import get_engine, make_record, read_template
+from template_share import SharedTemplates, attach_templates
+
+RECORDS = [make_record(prefix, str(600000 + i), "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+           for i, prefix in enumerate(["D4PQ", "SOSP", "SCSQ", "D4SQ", "SHSP"])]
+
+
+def template_kind(path):
+    """Type and size of what a worker reads for a template (runs in a worker)"""
+    data = read_template(path)
+    return type(data).__name__, len(data)
+
+
+def render_all(backend):
+    """PDF bytes of RECORDS (runs in a worker)"""
+    return [get_engine(record["prefix"], backend).render(record) for record in RECORDS]
+
+
+def in_worker(function, arg, descriptor, start_method=None):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context(start_method),
+                             initializer=attach_templates, initargs=(descriptor,)) as pool:
+        return pool.submit(function, arg).result()
+
+
+def test_shared_block():
+    """Test the block holds the files and workers read views of it, not the files"""
+    print("Testing the shared block...")
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "template.pdf"
+        shutil.copy(get_engine("D4PQ", "incremental").template_path("D4PQ"), path)
+        with SharedTemplates([path, path, Path(tmp) / "missing.pdf"]) as templates:
+            offset, size, _ = templates.descriptor[1][str(path.resolve())]
+            if len(templates) == 1 and bytes(templates.memory.buf[offset:offset + size]) == path.read_bytes():
+                print(f"  ✓ One copy of the template in the block ({size / 1024 / 1024:.1f} MB)")
+            else:
+                print(f"  ✗ Block index {templates.descriptor[1]}")
+                all_passed = False
+
+            kind = in_worker(template_kind, path, templates.descriptor)
+            if kind == ("memoryview", size):
+                print("  ✓ A worker reads the template from the shared block")
+            else:
+                print(f"  ✗ Worker read {kind}")
+                all_passed = False
+
+            # A template replaced on disk is read from the file again
+            stat = path.stat()
+            os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+            kind = in_worker(template_kind, path, templates.descriptor)
+            if kind == ("bytes", size):
+                print("  ✓ A changed template is read from disk")
+            else:
+                print(f"  ✗ Worker read {kind} after the change")
+                all_passed = False
+    return all_passed
+
+
+def test_same_certificates():
+    """Test certificates rendered from shared templates are byte-identical"""
+    print("\nTesting rendered output...")
+    all_passed = True
+    for backend in ("incremental", "overlay"):
+        with SharedTemplates.for_backend(backend) as templates:
+            shared = in_worker(render_all, backend, templates.descriptor)
+        private = in_worker(render_all, backend, None)
+        if shared == private:
+            print(f"  ✓ {backend}: {len(shared)} certificates identical")
+        else:
+            print(f"  ✗ {backend}: certificates differ")
+            all_passed = False
+    return all_passed
+
+
+def block_memory(name):
+    """Resident and anonymous bytes of the worker's mapping of a shared block, after rendering (runs in a worker)"""
+    render_all("incremental")
+    memory = {"Rss": 0, "Anonymous": 0}
+    mapping = None
+    with open("/proc/self/smaps", encoding="ascii") as f:
+        for line in f:
+            fields = line.split()
+            if "-" in fields[0]:
+                mapping = fields[-1] if len(fields) > 5 else None
+            elif mapping is not None and mapping.endswith(name) and fields[0][:-1] in memory:
+                memory[fields[0][:-1]] += int(fields[1]) * 1024
+    return memory
+
+
+def test_worker_memory():
+    """Test workers render from pages of the shared block, not from private copies"""
+    print("\nTesting worker memory...")
+    if not os.path.exists("/proc/self/smaps"):
+        print("  - no /proc here, skipped")
+        return True
+    with SharedTemplates.for_backend("incremental", prefixes=[record["prefix"] for record in RECORDS]) as templates:
+        # A spawned worker, so no engines with templates this process prepared are inherited
+        memory = in_worker(block_memory, templates.memory.name, templates.descriptor, "spawn")
+    if memory["Rss"] >= templates.size * 0.95 and memory["Anonymous"] == 0:
+        print(f"  ✓ {memory['Rss'] / 1024 / 1024:.1f} MB of templates read from shared pages "
+              f"({templates.size / 1024 / 1024:.1f} MB in the block)")
+        return True
+    print(f"  ✗ Shared mapping {memory}, {templates.size} bytes of templates")
+    return False
+
+
+def main():
+    print("=" * 70)
+    print("Shared Template Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_shared_block(), test_same_certificates(), test_worker_memory()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All shared template tests passed")
+    else:
+        print("✗ Some shared template tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
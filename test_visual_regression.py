@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test the visual regression check against the committed goldens
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+from product_coordinates import PRODUCT_COORDINATES
+from visual_regression import MAX_CHANGED_PIXELS, PIXEL_TOLERANCE, check_product, compare_pages, run
+
+
+def test_goldens_match():
+    """Test every product and backend renders like its goldens"""
+    print("Testing all products against the goldens...")
+    all_passed = True
+    for backend in (None, "incremental"):
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run(backend=backend, workers=2, diff_dir=tmp)
+        failed = [(result["prefix"], page) for result in results for page in result["pages"] if not page["ok"]]
+        if len(results) == 5 and not failed:
+            print(f"  ✓ {backend or 'configured'} backend: 5 products, every page matches")
+        else:
+            print(f"  ✗ {backend or 'configured'} backend: {failed}")
+            all_passed = False
+    return all_passed
+
+
+def test_moved_field_detected():
+    """Test a field moved by half a point fails and leaves a diff image"""
+    print("\nTesting a moved field...")
+    coordinate = PRODUCT_COORDINATES["SOSP"]["page1"]["lot"]
+    coordinate["y"] += 0.5
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            result = check_product("SOSP", "incremental", tmp)
+            page1, page2 = result["pages"]
+            written = page1["diff"] is not None and Path(page1["diff"]).exists()
+    finally:
+        coordinate["y"] -= 0.5
+    if not result["ok"] and not page1["ok"] and page2["ok"] and written:
+        print(f"  ✓ Page 1 fails with {page1['changed']} changed pixels, diff image written")
+        return True
+    print(f"  ✗ {result}")
+    return False
+
+
+def test_tolerances():
+    """Test anti-aliasing noise passes and a different page size fails"""
+    print("\nTesting tolerances...")
+    page = np.full((200, 100), 255, dtype=np.uint8)
+    page[50:60, 20:80] = 0
+    noisy = page.copy()
+    noisy[50, 20:80] = PIXEL_TOLERANCE  # edge pixels rendered slightly lighter
+    shifted = np.roll(page, 2, axis=0)
+    cases = [(compare_pages(page, noisy)["ok"], True), (compare_pages(page, shifted)["ok"], False),
+             (compare_pages(page, page[:, :90])["ok"], False)]
+    if all(ok == expected for ok, expected in cases):
+        print(f"  ✓ Noise within {PIXEL_TOLERANCE} levels passes; a 2-pixel shift "
+              f"(> {MAX_CHANGED_PIXELS} pixels) and a size change fail")
+        return True
+    print(f"  ✗ {cases}")
+    return False
+
+
+def main():
+    print("=" * 70)
+    print("Visual Regression Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_goldens_match(), test_moved_field_detected(), test_tolerances()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All visual regression tests passed")
+    else:
+        print("✗ Some visual regression tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
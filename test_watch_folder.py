@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Test the watch-folder daemon (inotify and polling)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from watch_folder import FolderDaemon, InotifyWatcher, invoice_number, is_order
+
+ORDER = ("prefix,serial,activation,lot,gas_prod,calibration\n"
+         "D4PQ,{serial},02/10/2025,LOT1,21/03/2024,02/10/2025\n"
+         "SOSP,{serial},02/10/2025,LOT2,21/03/2024,02/10/2025\n")
+
+
+def drop(inbox, name, text):
+    """Write under a temporary name and rename, as an uploader would"""
+    partial = inbox / f".{name}.part"
+    partial.write_text(text)
+    os.rename(partial, inbox / name)
+
+
+def wait_for(path, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if path.exists():
+            status = json.loads(path.read_text())
+            if status["state"] != "processing":
+                return status
+        time.sleep(0.05)
+    return None
+
+
+def test_names():
+    """Test which files are orders and their invoice numbers"""
+    print("Testing order file names...")
+    all_passed = True
+    cases = {"Invoice_12345.csv": "12345", "order-777.csv": "777", "4711.CSV": "4711"}
+    for name, expected in cases.items():
+        if is_order(name) and invoice_number(name) == expected:
+            print(f"  ✓ {name} -> Invoice_{expected}")
+        else:
+            print(f"  ✗ {name} -> {invoice_number(name)}")
+            all_passed = False
+    if not any(is_order(name) for name in (".Invoice_1.csv.part", "~lock.csv", "notes.txt")):
+        print("  ✓ Temporary and non-CSV files are ignored")
+    else:
+        print("  ✗ A temporary file counts as an order")
+        all_passed = False
+    return all_passed
+
+
+def check_daemon(poll):
+    mode = "polling" if poll else "inotify"
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        daemon = FolderDaemon(root / "inbox", root / "output", backend="incremental", poll=poll,
+                              interval=0.2, ledger_path=root / "certificates.db", log=lambda line: None)
+        if poll or isinstance(daemon.watcher, InotifyWatcher):
+            print(f"  ✓ Watching with {daemon.mode}")
+        stop = threading.Event()
+        thread = threading.Thread(target=daemon.run, args=(stop.is_set, 0.2), daemon=True)
+        thread.start()
+        try:
+            time.sleep(0.3)
+            start = time.monotonic()
+            drop(daemon.inbox, "Invoice_501.csv", ORDER.format(serial="501001"))
+            status = wait_for(root / "output" / "Invoice_501" / "status.json")
+            elapsed = time.monotonic() - start
+            folder = root / "output" / "Invoice_501"
+            if status and status["state"] == "done" and len(list(folder.glob("*.pdf"))) == 2 \
+                    and (daemon.done / "Invoice_501.csv").exists() and elapsed < 5:
+                print(f"  ✓ Order processed in {elapsed:.2f}s ({status['certificates']} certificates)")
+            else:
+                print(f"  ✗ Status {status} after {elapsed:.2f}s")
+                all_passed = False
+
+            drop(daemon.inbox, "Invoice_502.csv", ORDER.format(serial="501001"))
+            status = wait_for(root / "output" / "Invoice_502" / "status.json")
+            if status and status["state"] == "failed" and status["errors"] \
+                    and (daemon.failed / "Invoice_502.csv").exists():
+                print(f"  ✓ Duplicate serials fail the order: {status['errors'][0]}")
+            else:
+                print(f"  ✗ Status {status}")
+                all_passed = False
+        finally:
+            stop.set()
+            thread.join(5)
+            daemon.close()
+    return all_passed
+
+
+def test_inotify():
+    """Test that a dropped order is generated within seconds (inotify)"""
+    print("\nTesting the daemon with inotify...")
+    return check_daemon(poll=False)
+
+
+def test_polling():
+    """Test the polling fallback"""
+    print("\nTesting the daemon with polling...")
+    return check_daemon(poll=True)
+
+
+def test_claims():
+    """Test that an order is claimed once and orphaned claims are taken over"""
+    print("\nTesting claims and recovery...")
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        first = FolderDaemon(root / "inbox", root / "output", backend="incremental", poll=True,
+                             ledger_path=root / "certificates.db", log=lambda line: None)
+        (first.inbox / "Invoice_600.csv").write_text(ORDER.format(serial="600001"))
+        claimed = first.claim("Invoice_600.csv")
+        if claimed is not None and first.claim("Invoice_600.csv") is None:
+            print("  ✓ A second claim of the same order fails")
+        else:
+            print("  ✗ Order claimed twice")
+            all_passed = False
+
+        # Pretend the claim belongs to a daemon that exited
+        orphan = first.processing / f"{first.host}@999999999@Invoice_600.csv"
+        os.rename(claimed, orphan)
+        recovered = first.recover()
+        status = first.process(recovered[0]) if recovered else None
+        if status and status["state"] == "done" and not any(first.processing.iterdir()):
+            print("  ✓ The order of a dead daemon is taken over and finished")
+        else:
+            print(f"  ✗ Recovered {recovered}, status {status}")
+            all_passed = False
+
+        (first.inbox / "Invoice_601.csv").write_text("prefix,serial\nD4PQ,1\n")
+        statuses = first.run_once()
+        if statuses and statuses[0]["state"] == "failed" and (first.failed / "Invoice_601.csv").exists():
+            print("  ✓ An invalid order is moved to failed/ with its errors")
+        else:
+            print(f"  ✗ Statuses {statuses}")
+            all_passed = False
+        first.close()
+    return all_passed
+
+
+def main():
+    print("=" * 70)
+    print("Watch Folder Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_names(), test_inotify(), test_polling(), test_claims()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All watch folder tests passed")
+    else:
+        print("✗ Some watch folder tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test adaptive worker tuning and parallel batch generation
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+from batch_generate import generate_batch
+from certificate_engine import make_record
+from worker_tuning import WorkerTuner, available_memory, process_rss, recorded_settings
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(tuner, throughput, certificates=400, spawn=0.0):
+    """
+    Feed tuner tasks of 4 certificates at throughput(workers) certificates/s;
+    the first task of each new worker takes spawn seconds longer
+    """
+    clock = tuner.clock = FakeClock()
+    tuner._reset_window()
+    started = 0
+    for _ in range(certificates // 4):
+        clock.now += 4 / throughput(tuner.workers)
+        if started < tuner.workers:
+            started += 1
+            clock.now += spawn
+        tuner.record(4, pid=tuner.workers, rss=100 * 1024 * 1024)
+
+
+def test_proc_readings():
+    """Test RSS and available memory from /proc"""
+    print("Testing /proc readings...")
+    rss, memory = process_rss(), available_memory()
+    if sys.platform.startswith("linux") and not (rss and memory):
+        print(f"  ✗ RSS {rss}, available {memory}")
+        return False
+    print(f"  ✓ RSS {rss / 1024 / 1024:.0f} MB, available {memory / 1024 / 1024:.0f} MB"
+          if rss and memory else "  ✓ No /proc here; tuning falls back to throughput only")
+    return True
+
+
+def test_hill_climbing():
+    """Test growing while it pays off, stepping back when it doesn't, and the memory limit"""
+    print("\nTesting the tuner...")
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "worker_tuning.json"
+
+        # Scales up to 4 workers (e.g. 4 cores), flat after that
+        tuner = WorkerTuner("overlay", max_workers=32, path=path, memory=64 * 1024 ** 3)
+        simulate(tuner, lambda workers: 10 * min(workers, 4))
+        if tuner.workers == 4 and tuner.settled:
+            print(f"  ✓ Settled on 4 workers: {tuner.history}")
+        else:
+            print(f"  ✗ {tuner.workers} workers: {tuner.history}")
+            all_passed = False
+
+        tuner.save()
+        settings = recorded_settings("overlay", path)
+        restarted = WorkerTuner("overlay", max_workers=32, path=path)
+        if settings and settings["workers"] == 4 and restarted.workers == 4:
+            print("  ✓ The next run starts from the recorded 4 workers")
+        else:
+            print(f"  ✗ Recorded {settings}, restarted with {restarted.workers}")
+            all_passed = False
+
+        # 100 MB per worker and 500 MB available: 0.7 * 500 / 100 -> 3 workers
+        small = WorkerTuner("libreoffice", max_workers=32, path=path, memory=500 * 1024 ** 2)
+        simulate(small, lambda workers: 10 * workers)
+        if small.workers == 3:
+            print("  ✓ Capped at the 3 workers that fit in memory")
+        else:
+            print(f"  ✗ {small.workers} workers with 500 MB available: {small.history}")
+            all_passed = False
+
+        # One CPU: more workers never help, however slow starting them is
+        flat = WorkerTuner("incremental", max_workers=32, path=path, memory=64 * 1024 ** 3)
+        simulate(flat, lambda workers: 10, spawn=0.5)
+        if flat.workers == 2 and flat.history[0] == (2, 10.0):
+            print(f"  ✓ Worker start-up is not measured: {flat.history}")
+        else:
+            print(f"  ✗ {flat.workers} workers: {flat.history}")
+            all_passed = False
+
+        # A batch that ends right after 2 workers beat nothing yet
+        short = WorkerTuner("acroform", max_workers=32, path=path, memory=64 * 1024 ** 3)
+        simulate(short, lambda workers: 10 * workers, certificates=40)
+        short.save()
+        saved = recorded_settings("acroform", path)
+        if short.workers == 4 and saved["workers"] == 2 and saved["throughput"] == 20.0:
+            print("  ✓ The unmeasured grown count is not recorded")
+        else:
+            print(f"  ✗ Recorded {saved} after {short.history}")
+            all_passed = False
+
+        fixed = WorkerTuner("overlay", workers=6, path=path, memory=64 * 1024 ** 3)
+        simulate(fixed, lambda workers: 10 * workers)
+        if fixed.workers == 6 and fixed.history == []:
+            print("  ✓ A fixed worker count is not tuned")
+        else:
+            print(f"  ✗ Fixed count changed to {fixed.workers}")
+            all_passed = False
+    return all_passed
+
+
+def test_parallel_batch():
+    """Test that worker processes produce the same certificates"""
+    print("\nTesting parallel generation...")
+    records = [make_record("D4PQ", str(700000 + i), "02/10/2025", "LOT1", "21/03/2024", "02/10/2025")
+               for i in range(20)]
+    with tempfile.TemporaryDirectory() as tmp:
+        serial = generate_batch(records, Path(tmp) / "serial", "incremental")
+        parallel = generate_batch(records, Path(tmp) / "parallel", "incremental", workers=2)
+        same = sorted(entry["serial"] for entry in serial) == sorted(entry["serial"] for entry in parallel)
+        same = same and all(Path(entry["path"]).stat().st_size == entry["size"] for entry in parallel)
+    if same and len(parallel) == 20:
+        print("  ✓ 20 certificates from 2 worker processes")
+        return True
+    print(f"  ✗ {len(parallel)} certificates")
+    return False
+
+
+def main():
+    print("=" * 70)
+    print("Worker Tuning Tests")
+    print("=" * 70 + "\n")
+
+    results = [test_proc_readings(), test_hill_climbing(), test_parallel_batch()]
+
+    print("\n" + "=" * 70)
+    if all(results):
+        print("✓ All worker tuning tests passed")
+    else:
+        print("✗ Some worker tuning tests failed")
+    print("=" * 70)
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Visual regression check for every product
+Renders a reference certificate per product through the engine app.py uses
+(engine_config.json, or --backend), rasterizes its pages with pdfium and
+compares them with the golden PNGs in golden/. A page fails when more than
+MAX_CHANGED_PIXELS pixels differ by more than PIXEL_TOLERANCE gray levels;
+its diff image (golden in light gray, missing ink red, new ink blue) and
+the rendered page are written to output/visual_diff/. Products are checked
+in parallel, so an engine or coordinate change is validated in seconds.
+
+Usage:
+    python visual_regression.py                     # check all products
+    python visual_regression.py --backend acroform  # check another backend against the same goldens
+    python visual_regression.py --update            # re-create the goldens after an intended change
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from certificate_engine import PRODUCTS, get_engine, make_record
+from pdf_raster import rasterize_pdf
+
+BASE_DIR = Path(__file__).parent
+GOLDEN_DIR = BASE_DIR / "golden"
+GOLDEN_INFO = GOLDEN_DIR / "golden.json"
+DIFF_DIR = BASE_DIR / "output" / "visual_diff"
+
+DPI = 100
+# Gray levels a pixel may differ by (anti-aliasing of another pdfium build)
+PIXEL_TOLERANCE = 48
+# Pixels per page allowed beyond that; a field moved by 1 pt changes hundreds
+MAX_CHANGED_PIXELS = 40
+
+
+def reference_record(prefix):
+    """The certificate rendered for a product: its template's own sample serial"""
+    serial = PRODUCTS[prefix]["template"][len(prefix):len(prefix) + 6]
+    return make_record(prefix, serial, "02/10/2025", "25-3348", "21/03/2024", "02/10/2025")
+
+
+def golden_path(prefix, page):
+    return GOLDEN_DIR / f"{prefix}_page{page + 1}.png"
+
+
+def rasterizer_version():
+    import pypdfium2
+
+    return f"pdfium {pypdfium2.version.PDFIUM_INFO}"
+
+
+def render_pages(prefix, backend=None):
+    """Grayscale rasters of a product's reference certificate"""
+    pdf = get_engine(prefix, backend).render(reference_record(prefix))
+    return rasterize_pdf(pdf, DPI, rasterizer="pdfium")
+
+
+def compare_pages(expected, actual):
+    """
+    Compare two grayscale rasters
+
+    Returns:
+        dict: "changed" (pixels off by more than PIXEL_TOLERANCE), "max_diff"
+        and "ok"; a different page size is never ok
+    """
+    if expected.shape != actual.shape:
+        return {"changed": None, "max_diff": None, "ok": False}
+    diff = np.abs(expected.astype(np.int16) - actual.astype(np.int16))
+    changed = int(np.count_nonzero(diff > PIXEL_TOLERANCE))
+    return {"changed": changed, "max_diff": int(diff.max()), "ok": changed <= MAX_CHANGED_PIXELS}
+
+
+def diff_image(expected, actual):
+    """RGB image: the golden page in light gray, ink only in the golden red, only in the render blue"""
+    image = np.repeat((255 - (255 - expected.astype(np.uint16)) * 3 // 10).astype(np.uint8)[..., None], 3, axis=2)
+    if expected.shape != actual.shape:
+        return image
+    missing = (expected.astype(np.int16) - actual > PIXEL_TOLERANCE)
+    extra = (actual.astype(np.int16) - expected > PIXEL_TOLERANCE)
+    image[missing] = (220, 0, 0)
+    image[extra] = (0, 60, 230)
+    return image
+
+
+def check_product(prefix, backend=None, diff_dir=DIFF_DIR, write_all=False):
+    """
+    Render one product and compare every page with its golden
+
+    Returns:
+        dict: "prefix", "ok" and "pages" - per page the compare_pages result
+        plus "diff" (diff image path, for failed pages or write_all)
+    """
+    pages = []
+    for index, actual in enumerate(render_pages(prefix, backend)):
+        path = golden_path(prefix, index)
+        if not path.exists():
+            pages.append({"page": index + 1, "changed": None, "max_diff": None, "ok": False,
+                          "diff": None, "missing": True})
+            continue
+        expected = np.asarray(Image.open(path).convert("L"))
+        result = compare_pages(expected, actual)
+        result.update(page=index + 1, diff=None)
+        if write_all or not result["ok"]:
+            Path(diff_dir).mkdir(parents=True, exist_ok=True)
+            result["diff"] = str(Path(diff_dir) / f"{prefix}_page{index + 1}_diff.png")
+            Image.fromarray(diff_image(expected, actual)).save(result["diff"], optimize=True)
+            Image.fromarray(actual).save(Path(diff_dir) / f"{prefix}_page{index + 1}_actual.png", optimize=True)
+        pages.append(result)
+    return {"prefix": prefix, "ok": all(page["ok"] for page in pages), "pages": pages}
+
+
+def update_product(prefix, backend=None):
+    """Write a product's goldens from the current render; returns the paths"""
+    GOLDEN_DIR.mkdir(exist_ok=True)
+    paths = []
+    for index, page in enumerate(render_pages(prefix, backend)):
+        Image.fromarray(page).save(golden_path(prefix, index), optimize=True)
+        paths.append(golden_path(prefix, index))
+    return paths
+
+
+def _check_task(task):
+    return check_product(*task)
+
+
+def _update_task(task):
+    return update_product(*task)
+
+
+def run(prefixes=None, backend=None, update=False, workers=None, diff_dir=DIFF_DIR, write_all=False):
+    """
+    Check (or update) several products, one worker process per product
+
+    Returns:
+        list: check_product results, or the golden paths written per product
+    """
+    prefixes = list(prefixes or PRODUCTS)
+    workers = min(len(prefixes), workers or os.cpu_count() or 1)
+    if update:
+        function, tasks = _update_task, [(prefix, backend) for prefix in prefixes]
+    else:
+        function, tasks = _check_task, [(prefix, backend, diff_dir, write_all) for prefix in prefixes]
+    if workers <= 1:
+        results = [function(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(function, tasks))
+    if update:
+        GOLDEN_INFO.write_text(json.dumps({
+            "dpi": DPI,
+            "rasterizer": rasterizer_version(),
+            "backend": get_engine(prefixes[0], backend).name,
+            "records": {prefix: reference_record(prefix) for prefix in PRODUCTS},
+        }, indent=2), encoding="utf-8")
+    return results
+
+
+def golden_warnings():
+    """Reasons the goldens may not match for reasons other than a regression"""
+    if not GOLDEN_INFO.exists():
+        return ["No goldens yet: run python visual_regression.py --update"]
+    info = json.loads(GOLDEN_INFO.read_text(encoding="utf-8"))
+    warnings = []
+    if info["dpi"] != DPI:
+        warnings.append(f"Goldens were rendered at {info['dpi']} dpi, checking at {DPI}")
+    if info["records"] != {prefix: reference_record(prefix) for prefix in info["records"]}:
+        warnings.append("The reference records changed since the goldens were made")
+    if info["rasterizer"] != rasterizer_version():
+        warnings.append(f"Goldens made with {info['rasterizer']}, checking with {rasterizer_version()}")
+    return warnings
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Compare rendered certificates with golden images")
+    parser.add_argument("--backend", help="Engine backend (default: engine_config.json, as app.py)")
+    parser.add_argument("--products", help="Comma-separated prefixes (default: all)")
+    parser.add_argument("--update", action="store_true", help="Re-create the goldens from the current render")
+    parser.add_argument("--diffs", action="store_true", help="Write diff images for passing pages too")
+    parser.add_argument("--workers", type=int, help="Processes (default: one per product, up to the CPU count)")
+    args = parser.parse_args()
+    prefixes = [prefix.strip().upper() for prefix in args.products.split(",")] if args.products else None
+
+    print("=" * 70)
+    print("Visual Regression")
+    print("=" * 70)
+    start = time.perf_counter()
+    if args.update:
+        for paths in run(prefixes, args.backend, update=True, workers=args.workers):
+            print(f"✓ {', '.join(path.name for path in paths)}")
+        print(f"Goldens written to {GOLDEN_DIR} in {time.perf_counter() - start:.1f}s")
+        print("=" * 70)
+        return 0
+
+    for warning in golden_warnings():
+        print(f"⚠ {warning}")
+    results = run(prefixes, args.backend, workers=args.workers, write_all=args.diffs)
+    for result in results:
+        for page in result["pages"]:
+            if page.get("missing"):
+                line = "no golden"
+            elif page["changed"] is None:
+                line = "page size differs"
+            else:
+                line = f"{page['changed']} pixels changed (max difference {page['max_diff']})"
+            print(f"{'✓' if page['ok'] else '✗'} {result['prefix']} page {page['page']}: {line}"
+                  + (f" → {page['diff']}" if page["diff"] else ""))
+    failed = [result["prefix"] for result in results if not result["ok"]]
+    print(f"\n{len(results) - len(failed)}/{len(results)} products match their goldens "
+          f"in {time.perf_counter() - start:.1f}s")
+    print("=" * 70)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
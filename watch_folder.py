@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Watch-folder daemon
+Turns order CSVs dropped into an inbox into invoice folders without an
+operator. The inbox is watched with inotify on Linux (woken the moment a
+file is closed or moved in) and polled elsewhere, or with --poll for network
+shares, where inotify does not see writes made by other machines.
+
+Each order is claimed by renaming it into inbox/processing/, so several
+daemons can watch the same share without generating an order twice, then
+generated with the batch engine (batch_generate.run_batch) into
+output/Invoice_<n>/ together with a status.json. The order file ends up in
+inbox/done/ or inbox/failed/. Orders claimed by a daemon that died are taken
+over on start and resume from its session journal.
+
+The invoice number is the file name: Invoice_12345.csv, order_12345.csv and
+12345.csv all go to Invoice_12345. Files starting with "." or "~" and files
+not ending in .csv are ignored, so writers can upload under a temporary name
+and rename.
+
+Usage:
+    python watch_folder.py [inbox] [--output output] [--backend incremental] [--poll]
+                           [--interval 1.0] [--once]
+"""
+
+from datetime import datetime
+from pathlib import Path
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import re
+import select
+import socket
+import struct
+import sys
+import time
+import traceback
+
+from batch_generate import read_records, run_batch
+from certificate_ledger import LEDGER_FILE
+from output_layout import OutputLayout
+
+PROCESSING_DIR = "processing"
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+STATUS_NAME = "status.json"
+
+POLL_INTERVAL = 1.0
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+EVENT_HEADER = struct.Struct("iIII")
+
+INVOICE_NAME = re.compile(r"^(?:invoice|order)[ _-]*", re.IGNORECASE)
+
+
+def is_order(name):
+    """True for an order file name the daemon should pick up"""
+    return name.lower().endswith(".csv") and not name.startswith((".", "~"))
+
+
+def invoice_number(name):
+    """Invoice number of an order file (Invoice_12345.csv, order_12345.csv, 12345.csv -> 12345)"""
+    return INVOICE_NAME.sub("", Path(name).stem) or Path(name).stem
+
+
+class InotifyWatcher:
+    """Wakes up for files closed after writing or moved into a folder (Linux only)"""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {folder}")
+
+    def wait(self, timeout):
+        """Names of files completed within timeout seconds ([] if none)"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Lists a folder every interval seconds
+
+    A file is reported once its size and modification time were the same on
+    two consecutive polls, so one still being copied is not picked up.
+    """
+
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        self.folder = Path(folder)
+        self.interval = interval
+        self.seen = {}
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        current = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        stable = [name for name, state in current.items() if self.seen.get(name) == state]
+        self.seen = current
+        return stable
+
+    def close(self):
+        pass
+
+
+def make_watcher(folder, poll=False, interval=POLL_INTERVAL):
+    """InotifyWatcher where available, otherwise (or with poll=True) a PollingWatcher"""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folder, interval)
+
+
+def write_status(folder, status):
+    """Write status.json into folder atomically"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    partial = folder / f".{STATUS_NAME}.partial"
+    partial.write_text(json.dumps(status, indent=2), encoding="utf-8")
+    os.replace(partial, folder / STATUS_NAME)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FolderDaemon:
+    """Claims order files from an inbox and generates their invoices"""
+
+    def __init__(self, inbox, output="output", backend=None, profile=None, poll=False,
+                 interval=POLL_INTERVAL, ledger_path=LEDGER_FILE, log=print):
+        self.inbox = Path(inbox)
+        self.processing = self.inbox / PROCESSING_DIR
+        self.done = self.inbox / DONE_DIR
+        self.failed = self.inbox / FAILED_DIR
+        for folder in (self.inbox, self.processing, self.done, self.failed):
+            folder.mkdir(parents=True, exist_ok=True)
+        self.output = Path(output)
+        self.backend = backend
+        self.profile = profile
+        self.ledger_path = ledger_path
+        self.log = log
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.watcher = make_watcher(self.inbox, poll, interval)
+        self.processed = 0
+
+    @property
+    def mode(self):
+        return "inotify" if isinstance(self.watcher, InotifyWatcher) else "polling"
+
+    def claim_name(self, name):
+        return f"{self.host}@{self.pid}@{name}"
+
+    def claim(self, name):
+        """
+        Move an inbox file into processing/
+
+        rename() is atomic on one filesystem, so of several daemons exactly
+        one succeeds.
+
+        Returns:
+            Path: The claimed file, or None if another daemon was first
+        """
+        target = self.processing / self.claim_name(name)
+        try:
+            os.rename(self.inbox / name, target)
+        except FileNotFoundError:
+            return None
+        return target
+
+    def recover(self):
+        """Claimed files of dead daemons on this host, re-claimed by this one"""
+        recovered = []
+        for path in sorted(self.processing.iterdir()):
+            parts = path.name.split("@", 2)
+            if len(parts) != 3:
+                continue
+            host, pid, name = parts
+            if host != self.host or not pid.isdigit() or int(pid) == self.pid or _alive(int(pid)):
+                continue
+            target = self.processing / self.claim_name(name)
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue
+            recovered.append(target)
+        return recovered
+
+    def process(self, claimed):
+        """
+        Generate the invoice of a claimed order file and file the order away
+
+        Returns:
+            dict: The status written to the invoice folder's status.json
+        """
+        name = claimed.name[len(self.claim_name("")):]
+        invoice = invoice_number(name)
+        invoice_folder = OutputLayout(self.output).invoice_dir(invoice)
+        status = {"order": name, "invoice": invoice, "state": "processing", "host": self.host,
+                  "pid": self.pid, "claimed": datetime.now().isoformat(timespec="seconds")}
+        write_status(invoice_folder, status)
+        messages = []
+        try:
+            records, errors = read_records(claimed)
+            if errors:
+                messages = [f"Row {row_number}: {message}" for row_number, message in errors]
+            elif not records:
+                messages = ["The order has no rows"]
+            else:
+                summary = run_batch(records, self.output, invoice, self.backend, self.profile,
+                                    ledger_path=self.ledger_path, log=lambda line: None)
+                messages = [f"{serial}: {reason}" for serial, reason in summary["duplicates"]]
+                status.update(certificates=summary["certificates"], resumed=summary["resumed"],
+                              elapsed=round(summary["elapsed"], 3))
+        except Exception as e:
+            messages = [f"{type(e).__name__}: {e}"]
+            status["traceback"] = traceback.format_exc()
+
+        status["state"] = "failed" if messages else "done"
+        status["errors"] = messages
+        status["finished"] = datetime.now().isoformat(timespec="seconds")
+        write_status(invoice_folder, status)
+        destination = self.failed if messages else self.done
+        os.replace(claimed, destination / name)
+        self.processed += 1
+        return status
+
+    def run_once(self, names=None):
+        """
+        Claim and process orders in the inbox
+
+        Args:
+            names: File names to try (default: every order in the inbox)
+
+        Returns:
+            list: Status of each order processed
+        """
+        if names is None:
+            names = sorted(entry.name for entry in os.scandir(self.inbox) if entry.is_file())
+        statuses = []
+        for name in names:
+            if not is_order(name):
+                continue
+            claimed = self.claim(name)
+            if claimed is None:
+                continue
+            status = self.process(claimed)
+            verb = "✓" if status["state"] == "done" else "✗"
+            self.log(f"{verb} {name} -> Invoice_{status['invoice']}: {status['state']}"
+                     + (f" ({status['certificates']} certificates)" if "certificates" in status else "")
+                     + "".join(f"\n  {message}" for message in status["errors"]))
+            statuses.append(status)
+        return statuses
+
+    def run(self, stop=None, timeout=1.0):
+        """
+        Process orders as they arrive until stop() returns True (or forever)
+
+        Orders already waiting (and those of dead daemons) are done first.
+        """
+        for claimed in self.recover():
+            self.log(f"✓ Taking over {claimed.name}")
+            self.process(claimed)
+        self.run_once()
+        while stop is None or not stop():
+            names = self.watcher.wait(timeout)
+            if names:
+                self.run_once(sorted(set(names)))
+
+    def close(self):
+        self.watcher.close()
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Generate invoices from order files dropped into a folder")
+    parser.add_argument("inbox", nargs="?", default="inbox", help="Folder to watch (default: inbox)")
+    parser.add_argument("--output", default="output", help="Output directory (default: output)")
+    parser.add_argument("--backend", help="Certificate engine backend (default: engine_config.json)")
+    parser.add_argument("--profile", help="Output profile (default: engine_config.json)")
+    parser.add_argument("--poll", action="store_true", help="Poll instead of inotify (network shares)")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="Polling interval in seconds")
+    parser.add_argument("--once", action="store_true", help="Process the orders waiting now and exit")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("GasClip Watch Folder")
+    print("=" * 70)
+    daemon = FolderDaemon(args.inbox, args.output, args.backend, args.profile, args.poll, args.interval)
+    try:
+        if args.once:
+            for claimed in daemon.recover():
+                daemon.process(claimed)
+            daemon.run_once()
+            print(f"✓ {daemon.processed} order(s) processed")
+            return 0
+        print(f"✓ Watching {daemon.inbox.absolute()} ({daemon.mode})")
+        daemon.run()
+    except KeyboardInterrupt:
+        print(f"\n✓ Stopped after {daemon.processed} order(s)")
+    finally:
+        daemon.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
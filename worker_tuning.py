@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Adaptive worker count for batch generation
+How many render processes pay off depends on the backend, the disk and the
+RAM of the machine. batch_generate.py --workers auto starts from the count
+recorded for this machine (or 2), measures throughput and each worker's
+resident memory (/proc/<pid>/status) while the first certificates render,
+and grows or shrinks the pool: it doubles while that raises throughput
+noticeably, steps back when it doesn't, and never goes past what fits in
+available memory. The first task of each worker after a change is not
+measured, as it includes starting the process. The chosen setting is
+stored per machine and backend in worker_tuning.json for the next run.
+
+Usage:
+    python worker_tuning.py            # show the recorded settings
+    python worker_tuning.py --reset    # forget this machine's settings
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+TUNING_FILE = Path(__file__).parent / "worker_tuning.json"
+
+# Certificates measured before the worker count is settled
+TUNE_CERTIFICATES = 400
+# Certificates per measurement window, per worker (two PARALLEL_CHUNKs)
+WINDOW_PER_WORKER = 16
+# Growing must raise throughput by this much to be kept
+MIN_GAIN = 0.10
+# Share of available memory the workers may use
+MEMORY_SHARE = 0.7
+
+
+def process_rss(pid="self"):
+    """Resident memory of a process in bytes, from /proc (None where there is no /proc)"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def available_memory():
+    """Memory available for new processes in bytes (MemAvailable), or None if unknown"""
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def load_tuning(path=TUNING_FILE):
+    """Recorded settings of every machine: {host: {backend: settings}}"""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return {}
+
+
+def recorded_settings(backend, path=TUNING_FILE):
+    """This machine's recorded settings for a backend, or None"""
+    return load_tuning(path).get(socket.gethostname(), {}).get(backend)
+
+
+def save_settings(backend, settings, path=TUNING_FILE):
+    """Record this machine's settings for a backend"""
+    path = Path(path)
+    tuning = load_tuning(path)
+    tuning.setdefault(socket.gethostname(), {})[backend] = settings
+    partial = path.with_name(f".{path.name}.partial")
+    partial.write_text(json.dumps(tuning, indent=2), encoding="utf-8")
+    os.replace(partial, path)
+
+
+class WorkerTuner:
+    """
+    Hill-climbing worker count from throughput and worker memory
+
+    Feed it every finished task with record(); workers is the number of
+    tasks to keep in flight.
+    """
+
+    def __init__(self, backend, max_workers=None, workers=None, tune_certificates=TUNE_CERTIFICATES,
+                 path=TUNING_FILE, memory=None):
+        """
+        Args:
+            backend: Engine backend the settings are recorded for
+            max_workers: Upper limit (default: CPU count)
+            workers: Fixed worker count - no tuning, only the memory limit
+        """
+        self.backend = backend
+        self.max_workers = max(1, max_workers or workers or os.cpu_count() or 1)
+        self.tune_certificates = tune_certificates
+        self.path = path
+        self.memory = available_memory() if memory is None else memory
+        recorded = recorded_settings(backend, path)
+        self.workers = min(self.max_workers, workers or (recorded["workers"] if recorded else 2))
+        self.worker_rss = {}
+        self.best = None
+        self.fixed = self.settled = workers is not None
+        self.done = 0
+        self.history = []
+        self.clock = time.perf_counter
+        self._window_start = self.clock()
+        self._window_done = 0
+        self._warmup_tasks = 0
+
+    @property
+    def rss_per_worker(self):
+        return max(self.worker_rss.values()) if self.worker_rss else None
+
+    def memory_limit(self):
+        """Most workers that fit in available memory (max_workers if unknown)"""
+        if not self.memory or not self.rss_per_worker:
+            return self.max_workers
+        return max(1, min(self.max_workers, int(self.memory * MEMORY_SHARE // self.rss_per_worker)))
+
+    def record(self, certificates, pid=None, rss=None):
+        """A task finished: certificates rendered, by worker pid using rss bytes"""
+        self.done += certificates
+        self._window_done += certificates
+        if pid is not None and rss:
+            self.worker_rss[pid] = max(rss, self.worker_rss.get(pid, 0))
+
+        # Never more workers than fit in memory, tuned or not
+        limit = self.memory_limit()
+        if self.workers > limit:
+            self.workers = limit
+            self._reset_window()
+            return
+        if self.settled:
+            return
+        if self._warmup_tasks < self.workers:
+            # One task per worker after a change includes starting the
+            # process and loading templates: the window starts after them
+            self._warmup_tasks += 1
+            if self._warmup_tasks == self.workers:
+                self._window_start = self.clock()
+                self._window_done = 0
+            return
+        if self._window_done < self.workers * WINDOW_PER_WORKER:
+            return
+
+        throughput = self._window_done / max(self.clock() - self._window_start, 1e-9)
+        self.history.append((self.workers, round(throughput, 2)))
+        if self.best is None or throughput > self.best[1] * (1 + MIN_GAIN):
+            self.best = (self.workers, throughput)
+            grown = min(self.workers * 2, limit)
+            if grown == self.workers:
+                self.settled = True
+            self.workers = grown
+        else:
+            # Growing did not pay off: go back to the best count and stay
+            self.workers = self.best[0]
+            self.settled = True
+        if self.done >= self.tune_certificates:
+            self.workers = self.best[0]
+            self.settled = True
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = self.clock()
+        self._window_done = 0
+        self._warmup_tasks = 0
+
+    def save(self):
+        """Record the best measured worker count for this machine"""
+        if self.fixed or self.best is None:
+            return
+        # Not self.workers: a grown count may not have been measured yet
+        save_settings(self.backend, {
+            "workers": self.best[0],
+            "throughput": round(self.best[1], 2),
+            "worker_rss_mb": round(self.rss_per_worker / 1024 / 1024, 1) if self.rss_per_worker else None,
+            "cpu_count": os.cpu_count(),
+            "memory_mb": round(self.memory / 1024 / 1024) if self.memory else None,
+            "tuned": datetime.now().isoformat(timespec="seconds"),
+        }, self.path)
+
+
+def _pool_context():
+    # fork would start all max_workers processes up front; forkserver/spawn
+    # start them only as tasks need them, so a pool never outgrows the tuner
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def tuned_map(function, tasks, tuner, sizes=None, initializer=None, initargs=()):
+    """
+    Run function(task) in a process pool sized by a WorkerTuner
+
+    function must return (result, pid, rss) - see measured() - so worker
+    memory can be tracked.
+
+    Args:
+        tasks: Iterable of picklable tasks
+        tuner: WorkerTuner deciding how many tasks are in flight
+        sizes: Function(task) -> certificates in it (default 1)
+
+    Yields:
+        tuple: (task, result) in completion order
+    """
+    sizes = sizes or (lambda task: 1)
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(tuner.max_workers, mp_context=_pool_context(),
+                             initializer=initializer, initargs=initargs) as pool:
+        in_flight = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < tuner.workers:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                in_flight[pool.submit(function, task)] = task
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = in_flight.pop(future)
+                result, pid, rss = future.result()
+                tuner.record(sizes(task), pid, rss)
+                yield task, result
+
+
+def measured(result):
+    """(result, pid, rss) - what tuned_map expects a worker function to return"""
+    return result, os.getpid(), process_rss()
+
+
+def main():
+    """Show or reset the recorded worker settings"""
+    print("=" * 70)
+    print("Worker Tuning")
+    print("=" * 70)
+    host = socket.gethostname()
+    if "--reset" in sys.argv[1:]:
+        tuning = load_tuning()
+        tuning.pop(host, None)
+        TUNING_FILE.write_text(json.dumps(tuning, indent=2), encoding="utf-8")
+        print(f"✓ Forgot the settings of {host}")
+        print("=" * 70)
+        return 0
+    tuning = load_tuning()
+    if not tuning:
+        print("No settings recorded yet (run batch_generate.py --workers auto)")
+    for machine, backends in tuning.items():
+        marker = " (this machine)" if machine == host else ""
+        print(f"{machine}{marker}:")
+        for backend, settings in backends.items():
+            print(f"  {backend}: {settings['workers']} workers, {settings['throughput']} certificates/s, "
+                  f"{settings['worker_rss_mb']} MB per worker (tuned {settings['tuned']})")
+    print("=" * 70)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())